@@ -106,3 +106,25 @@ class CourseMauMetricsAdmin(admin.ModelAdmin):
         ('site', RelatedOnlyDropdownFilter),
         ('course_id', AllValuesDropdownFilter),
         'date_for')
+
+
+class PipelineCourseRunInline(admin.TabularInline):
+    """Shows the course runs on the PipelineSiteRun admin page
+    """
+    model = figures.models.PipelineCourseRun
+    fields = ('course_id', 'status', 'modified')
+    readonly_fields = ('modified',)
+    extra = 0
+
+
+@admin.register(figures.models.PipelineSiteRun)
+class PipelineSiteRunAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the PipelineSiteRun model
+    """
+    list_display = ('id', 'date_for', 'site', 'status', 'site_metrics_status',
+                    'course_count', 'finished_course_count', 'modified')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'status',
+        'date_for')
+    inlines = [PipelineCourseRunInline]
@@ -4,55 +4,343 @@ Initially developed to support API performance improvements
 """
 
 from datetime import datetime
-from dateutil.rrule import rrule, MONTHLY
-from dateutil.relativedelta import relativedelta
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+import time
 
+from dateutil.rrule import rrule, DAILY, MONTHLY
+
+from django.db import connections
 from django.utils.timezone import utc
 
-from figures.mau import get_mau_from_student_modules
-from figures.models import SiteMonthlyMetrics
-from figures.sites import get_student_modules_for_site
+from figures.helpers import (
+    as_date,
+    days_in_month,
+    use_active_user_bitmaps,
+    use_course_monthly_metrics,
+    use_site_course_daily_metrics,
+)
+from figures.mau import get_monthly_active_user_counts
+from figures.models import CourseMauMetrics, PipelineError, SiteMonthlyMetrics
+from figures.pipeline.course_daily_metrics import (
+    CourseDailyMetricsLoader,
+    SiteCourseDailyMetricsLoader,
+)
+from figures.pipeline.active_user_bitmaps import load_active_user_bitmaps
+from figures.pipeline.course_monthly_metrics import load_course_monthly_metrics
+from figures.pipeline.logger import log_error_to_db
+from figures.pipeline.site_daily_metrics import SiteDailyMetricsLoader
+from figures.response_cache import invalidate_site_responses
+from figures.sites import (
+    get_course_keys_for_site,
+    get_student_modules_for_site,
+    invalidate_site_topology,
+)
 
 
-def backfill_monthly_metrics_for_site(site, overwrite):
-    """Quick hack function to backfill all historical site metrics for the site
+logger = logging.getLogger(__name__)
+
+BACKFILL_DAILY_METRICS_WORKERS = 4
+
+
+def backfill_monthly_mau_for_site(site, overwrite=False):
+    """Backfills SiteMonthlyMetrics and CourseMauMetrics for all the site's
+    past months
+
+    The distinct active users are counted per month for the site and per
+    course and month with two grouped ``StudentModule`` queries, then the
+    records are written with bulk upserts. Existing records are only updated
+    if ``overwrite`` is true.
+
+    Site months are bucketed on ``StudentModule.created``, as the site monthly
+    metrics always have been, and every month from the first active month
+    through last month gets a record. Course months are bucketed on
+    ``StudentModule.modified``, like the MAU pipeline, and only months with
+    activity get a record. Course records are dated the last day of the month
 
-    We are a bit verbose with the output to help testing and validation since
-    this function was quickly put together
+    Returns a dict with the ``SiteMonthlyMetrics.add_months`` and
+    ``CourseMauMetrics.save_metrics_bulk`` results
     """
+    this_month = datetime.utcnow().replace(tzinfo=utc).date().replace(day=1)
+    before = datetime(this_month.year, this_month.month, 1).replace(tzinfo=utc)
     site_sm = get_student_modules_for_site(site)
-    if not site_sm:
+
+    site_counts = get_monthly_active_user_counts(
+        site_sm.filter(created__lt=before), field_name='created')
+    if site_counts:
+        for dt in rrule(freq=MONTHLY, dtstart=min(site_counts), until=max(site_counts)):
+            site_counts.setdefault(dt.date(), 0)
+
+    course_counts = get_monthly_active_user_counts(
+        site_sm.filter(modified__lt=before), field_name='modified', by_course=True)
+    course_maus = {
+        (course_id, month.replace(day=days_in_month(month))): count
+        for (course_id, month), count in course_counts.items()}
+
+    return dict(
+        site_months=SiteMonthlyMetrics.add_months(site=site,
+                                                  active_user_counts=site_counts,
+                                                  overwrite=overwrite),
+        course_months=CourseMauMetrics.save_metrics_bulk(site=site,
+                                                         course_maus=course_maus,
+                                                         overwrite=overwrite))
+
+
+def backfill_monthly_metrics_for_site(site, overwrite):
+    """Backfills all historical site monthly metrics and course MAU metrics for
+    the site
+
+    See ``backfill_monthly_mau_for_site``. Returns a list of dicts with the
+    SiteMonthlyMetrics record, whether it was created and the month, in month
+    order, or ``None`` if the site has no student modules
+    """
+    results = backfill_monthly_mau_for_site(site=site, overwrite=overwrite)
+    site_months = results['site_months']
+    created = set(site_months['created'])
+    months = sorted(site_months['created'] + site_months['updated'] + site_months['skipped'])
+    if not months:
         return None
+    objs = SiteMonthlyMetrics.objects.filter(site=site, month_for__in=months)
+    return [dict(obj=obj,
+                 created=obj.month_for in created,
+                 dt=datetime(obj.month_for.year, obj.month_for.month, 1).replace(tzinfo=utc))
+            for obj in objs.order_by('month_for')]
+
+
+def backfill_dates(start_date, end_date):
+    """Returns the list of dates from ``start_date`` through ``end_date``
+    """
+    return [dt.date() for dt in rrule(freq=DAILY,
+                                      dtstart=as_date(start_date),
+                                      until=as_date(end_date))]
+
+
+def backfill_course_daily_metrics_for_site(site, date_for, force_update=False):
+    """Populates CourseDailyMetrics for all the courses in the site for one day
+
+    Uses the site level loader if ``FIGURES_SITE_COURSE_DAILY_METRICS`` is
+    enabled. Otherwise the courses are loaded one at a time. Course failures
+    are recorded in the Figures pipeline error table
+
+    Returns the number of courses that failed
+    """
+    if use_site_course_daily_metrics():
+        results = SiteCourseDailyMetricsLoader(site=site).load(
+            date_for=date_for, force_update=force_update)
+        return len(results['failed'])
+
+    failed = 0
+    for course_key in get_course_keys_for_site(site):
+        try:
+            CourseDailyMetricsLoader(course_key).load(date_for=date_for,
+                                                      force_update=force_update)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Backfill failed for course "{}", date_for={}'.format(
+                course_key, date_for))
+            log_error_to_db(
+                error_data=dict(date_for=date_for,
+                                msg='figures.backfill course daily metrics failed',
+                                exception_class=e.__class__.__name__),
+                error_type=PipelineError.COURSE_DATA,
+                course_id=str(course_key),
+                site=site)
+            failed += 1
+    return failed
+
+
+def log_backfill_error(e, msg, site, date_for):
+    """Records a backfill failure for the site in the Figures pipeline error
+    table
+    """
+    logger.exception('{} for site id={}, date_for={}'.format(msg, site.id, date_for))
+    log_error_to_db(
+        error_data=dict(date_for=date_for,
+                        msg=msg,
+                        exception_class=e.__class__.__name__),
+        error_type=PipelineError.SITE_DATA,
+        site=site)
+
+
+def backfill_site_daily_metrics_for_site(site, dates, force_update=False, progress=None):
+    """Populates SiteDailyMetrics for the site for each date in date order
+
+    The dates have to be done in order because each day's
+    ``cumulative_active_user_count`` is built on the previous day's record.
+    If ``FIGURES_ACTIVE_USER_BITMAPS`` is enabled, the day's active user
+    bitmaps are populated too. If ``FIGURES_COURSE_MONTHLY_METRICS`` is
+    enabled, the course monthly metrics for each month in the dates are
+    updated afterwards
+
+    Failures are recorded in the Figures pipeline error table. A failed date
+    stops the site's dates, since the later days would be built on a missing
+    record. A failed month does not stop the other months. Returns a dict with
+    the number of failures and the list of the dates that were not run
+    """
+    failed = 0
+    dates = sorted(as_date(d) for d in dates)
+    done_dates = []
+    for index, date_for in enumerate(dates):
+        try:
+            if use_active_user_bitmaps():
+                load_active_user_bitmaps(site=site,
+                                         date_for=date_for,
+                                         force_update=force_update)
+            SiteDailyMetricsLoader().load(site=site,
+                                          date_for=date_for,
+                                          force_update=force_update)
+        except Exception as e:  # pylint: disable=broad-except
+            log_backfill_error(e, msg='figures.backfill site daily metrics failed',
+                               site=site, date_for=date_for)
+            failed += 1
+            skipped_dates = dates[index:]
+            break
+        done_dates.append(date_for)
+        if progress:
+            progress.step()
+    else:
+        skipped_dates = []
+    if use_course_monthly_metrics():
+        for month_for in sorted(set(d.replace(day=1) for d in done_dates)):
+            try:
+                load_course_monthly_metrics(site=site, month_for=month_for)
+            except Exception as e:  # pylint: disable=broad-except
+                log_backfill_error(e, msg='figures.backfill course monthly metrics failed',
+                                   site=site, date_for=month_for)
+                failed += 1
+    invalidate_site_responses(site)
+    return dict(failures=failed, skipped_dates=skipped_dates)
+
+
+class BackfillProgress(object):
+    """Tracks the number of units done for a backfill stage and the throughput
+
+    ``report`` is called with a dict of the stage, units done, total units,
+    elapsed seconds and units per second after each unit is done. Units may
+    be stepped from worker threads
+    """
+    def __init__(self, stage, total, report=None):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.report = report
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def step(self):
+        with self._lock:
+            self.done += 1
+            done = self.done
+        elapsed = time.time() - self.start_time
+        status = dict(stage=self.stage,
+                      done=done,
+                      total=self.total,
+                      elapsed=elapsed,
+                      rate=done / elapsed if elapsed else 0.0)
+        logger.info('Backfill {stage}: {done}/{total} in {elapsed:.1f}s '
+                    '({rate:.2f}/s)'.format(**status))
+        if self.report:
+            self.report(status)
+        return status
+
+
+def _run_units(func, units, workers, on_error):
+    """Calls ``func`` for each unit and returns the results
+
+    If ``func`` raises, ``on_error`` is called with the unit and the exception
+    and its return value is used as the unit's result, so one failed unit does
+    not stop the others
+
+    Units run in a thread pool when ``workers`` is more than one. Each worker
+    thread has its own database connection, which is closed when the unit is
+    done
+    """
+    def run_unit(unit):
+        try:
+            return func(unit)
+        except Exception as e:  # pylint: disable=broad-except
+            return on_error(unit, e)
+        finally:
+            if workers > 1:
+                connections.close_all()
+
+    if workers <= 1:
+        return [run_unit(unit) for unit in units]
+
+    pool = ThreadPool(processes=workers)
+    try:
+        return pool.map(run_unit, units)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def backfill_daily_metrics(start_date, end_date, sites,
+                           workers=BACKFILL_DAILY_METRICS_WORKERS,
+                           force_update=False,
+                           report=None):
+    """Backfills CourseDailyMetrics and SiteDailyMetrics for a date range
+
+    First the course daily metrics for each site and date are populated in
+    parallel with ``workers`` threads. Then the site daily metrics are
+    populated, with the sites in parallel and the dates for each site in date
+    order. ``report`` is called with throughput data as units finish. See
+    ``BackfillProgress``
+
+    Failures are recorded in the Figures pipeline error table and do not stop
+    the backfill, except that a site's site daily metrics stop at its first
+    failed date. Returns a dict with the number of course failures, the number
+    of site failures, a dict of site ids to the dates whose site daily metrics
+    were not run, and the ``BackfillProgress`` for each stage. A site and date
+    whose courses could not be backfilled at all counts as one course failure
+    """
+    dates = backfill_dates(start_date, end_date)
+    sites = list(sites)
+    # Pick up organization courses created since the topology was cached, as
+    # the pipeline does for each run
+    invalidate_site_topology()
+
+    course_units = [(site, date_for) for date_for in dates for site in sites]
+    course_progress = BackfillProgress('course daily metrics',
+                                       total=len(course_units),
+                                       report=report)
+
+    def backfill_course_unit(unit):
+        try:
+            return backfill_course_daily_metrics_for_site(site=unit[0],
+                                                          date_for=unit[1],
+                                                          force_update=force_update)
+        finally:
+            course_progress.step()
+
+    def course_unit_error(unit, e):
+        log_backfill_error(e, msg='figures.backfill course daily metrics failed',
+                           site=unit[0], date_for=unit[1])
+        return 1
+
+    course_failed = _run_units(backfill_course_unit, course_units, workers,
+                               on_error=course_unit_error)
+
+    site_progress = BackfillProgress('site daily metrics',
+                                     total=len(sites) * len(dates),
+                                     report=report)
+
+    def site_unit_error(site, e):
+        log_backfill_error(e, msg='figures.backfill site daily metrics failed',
+                           site=site, date_for=None)
+        return dict(failures=1, skipped_dates=[])
+
+    site_results = _run_units(
+        lambda site: backfill_site_daily_metrics_for_site(site=site,
+                                                          dates=dates,
+                                                          force_update=force_update,
+                                                          progress=site_progress),
+        sites, workers, on_error=site_unit_error)
 
-    first_created = site_sm.order_by('created').first().created
-
-    # We do this because there _might_ be a bug in `dateutil.rrule`. It was
-    # skipping over February when we used the `created` field directly for the
-    # start_month variable
-    start_month = datetime(year=first_created.year,
-                           month=first_created.month,
-                           day=1).replace(tzinfo=utc)
-    last_month = datetime.utcnow().replace(tzinfo=utc) - relativedelta(months=1)
-    backfilled = []
-    for dt in rrule(freq=MONTHLY, dtstart=start_month, until=last_month):
-        mau = get_mau_from_student_modules(student_modules=site_sm,
-                                           year=dt.year,
-                                           month=dt.month)
-        month_sm = site_sm.filter(created__year=dt.year, created__month=dt.month)
-        month_learners = month_sm.values_list('student__id', flat=True).distinct()
-
-        obj, created = SiteMonthlyMetrics.add_month(
-            site=site,
-            year=dt.year,
-            month=dt.month,
-            active_user_count=month_learners.count(),
-            overwrite=overwrite)
-
-        backfill_rec = dict(
-            obj=obj,
-            created=created,
-            dt=dt,
-            mau=mau)
-        backfilled.append(backfill_rec)
-
-    return backfilled
+    return dict(course_failures=sum(course_failed),
+                site_failures=sum(result['failures'] for result in site_results),
+                skipped_site_dates=dict(
+                    (site.id, result['skipped_dates'])
+                    for site, result in zip(sites, site_results) if result['skipped_dates']),
+                course_progress=course_progress,
+                site_progress=site_progress)
@@ -0,0 +1,51 @@
+"""Bitmaps of user ids
+
+A set of user ids is represented as a Python integer where bit ``n`` is set if
+user id ``n`` is in the set. Sets are combined with ``|`` and counted with
+``bitmap_count``. Bitmaps are stored zlib compressed with ``encode_bitmap``.
+"""
+
+import binascii
+import zlib
+
+
+def user_ids_to_bitmap(user_ids):
+    """Returns the bitmap for the user ids
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    data = bytearray(max(user_ids) // 8 + 1)
+    for user_id in user_ids:
+        data[user_id >> 3] |= 1 << (user_id & 7)
+    # Bytes are built least significant first
+    data.reverse()
+    return int(binascii.hexlify(data), 16)
+
+
+def bitmap_to_user_ids(bitmap):
+    """Returns the sorted list of user ids in the bitmap
+    """
+    bits = bin(bitmap)[:1:-1]
+    return [user_id for user_id, bit in enumerate(bits) if bit == '1']
+
+
+def bitmap_count(bitmap):
+    """Returns the number of user ids in the bitmap
+    """
+    return bin(bitmap).count('1')
+
+
+def encode_bitmap(bitmap):
+    """Returns the bitmap as zlib compressed bytes
+    """
+    hex_bitmap = '{:x}'.format(bitmap)
+    if len(hex_bitmap) % 2:
+        hex_bitmap = '0' + hex_bitmap
+    return zlib.compress(binascii.unhexlify(hex_bitmap))
+
+
+def decode_bitmap(data):
+    """Returns the bitmap for bytes created with ``encode_bitmap``
+    """
+    return int(binascii.hexlify(zlib.decompress(bytes(data))), 16)
@@ -0,0 +1,145 @@
+"""Streams API records as CSV or NDJSON exports
+
+The records are retrieved from the database in chunks ordered on the primary
+key and written to a streaming response one row at a time, so the memory used
+does not depend on the number of records exported. See
+``figures.views.StreamingExportMixin``
+"""
+
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_str
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMAT_QUERY_PARAM = 'export_format'
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+DEFAULT_EXPORT_FORMAT = 'csv'
+
+
+def queryset_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields lists of up to ``chunk_size`` records from ``queryset``, ordered
+    on the primary key
+
+    Each chunk is retrieved with a keyset query on the primary key. Iterating
+    over the whole queryset would load all the rows, as the database drivers
+    fetch the full result set
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def serializer_columns(serializer, prefix=''):
+    """Returns the CSV column names for the records the serializer returns
+
+    Nested serializers are flattened into dotted column names, as
+    ``flatten_record`` flattens the nested records. Write only fields are left
+    out
+    """
+    columns = []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        column = prefix + field.field_name
+        if (isinstance(field, serializers.BaseSerializer) and
+                not isinstance(field, serializers.ListSerializer)):
+            columns.extend(serializer_columns(field, prefix=column + '.'))
+        else:
+            columns.append(column)
+    return columns
+
+
+def flatten_record(record, prefix='', columns=()):
+    """Returns a list of (column, value) pairs for the serialized record
+
+    Nested records are flattened into dotted column names, except for those in
+    ``columns``, which are JSON encoded like lists
+    """
+    items = []
+    for key, value in record.items():
+        column = prefix + key
+        if isinstance(value, dict) and column not in columns:
+            items.extend(flatten_record(value, prefix=column + '.', columns=columns))
+        elif isinstance(value, (list, tuple, dict)):
+            items.append((column, json.dumps(value, cls=JSONEncoder)))
+        else:
+            items.append((column, value))
+    return items
+
+
+class _RowBuffer(object):
+    """Holds the last row written by a ``csv.writer``
+    """
+    value = ''
+
+    def write(self, value):
+        self.value = value
+
+
+def csv_rows(records, columns=None):
+    """Yields a CSV header row and then a CSV row for each serialized record
+
+    The columns are ``columns``, see ``serializer_columns``, or those of the
+    first record if ``columns`` is not given. Columns missing from a record,
+    such as the columns of a null nested record, are left empty and values
+    not in the columns are dropped
+    """
+    buf = _RowBuffer()
+    writer = None
+    column_set = frozenset(columns or ())
+    for record in records:
+        items = [(force_str(column), force_str('' if value is None else value))
+                 for column, value in flatten_record(record, columns=column_set)]
+        if writer is None:
+            fieldnames = ([force_str(column) for column in columns] if columns
+                          else [column for column, _value in items])
+            writer = csv.DictWriter(buf, fieldnames=fieldnames,
+                                    restval='', extrasaction='ignore')
+            writer.writeheader()
+            yield buf.value
+        writer.writerow(dict(items))
+        yield buf.value
+
+
+def ndjson_rows(records):
+    """Yields a JSON line for each serialized record
+    """
+    for record in records:
+        yield json.dumps(record, cls=JSONEncoder) + '\n'
+
+
+def export_response(records, export_format, filename, columns=None):
+    """Returns a streaming response with the serialized records in the export
+    format
+
+    ``columns`` are the CSV columns, see ``csv_rows``. Raises
+    ``ValidationError`` for an unknown export format
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError({EXPORT_FORMAT_QUERY_PARAM: 'Must be one of {}'.format(
+            ', '.join(sorted(EXPORT_FORMATS.keys())))})
+    if export_format == 'csv':
+        rows = csv_rows(records, columns=columns)
+    else:
+        rows = ndjson_rows(records)
+    response = StreamingHttpResponse(rows, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        filename, export_format)
+    return response
@@ -28,6 +28,7 @@ from figures.models import (
     CourseMauMetrics,
     SiteMauMetrics,
 )
+import figures.sites
 
 
 def char_method_filter(method):
@@ -145,7 +146,14 @@ class UserFilterSet(django_filters.FilterSet):
         to be able to create a course key object from the string
         '''
         course_key = CourseKey.from_string(value.replace(' ', '+'))
-        enrollments = get_enrolled_in_exclude_admins(course_id=course_key)
+        site = figures.sites.get_site_for_course(course_key)
+        if site:
+            admin_user_ids = figures.sites.get_course_admin_user_ids_for_site(
+                site).get(str(course_key), set())
+        else:
+            admin_user_ids = None
+        enrollments = get_enrolled_in_exclude_admins(course_id=course_key,
+                                                     admin_user_ids=admin_user_ids)
         user_ids = enrollments.values_list('user__id', flat=True)
         return queryset.filter(id__in=user_ids)
 
@@ -32,6 +32,70 @@ def log_pipeline_errors_to_db():
     return bool(settings.FEATURES.get('FIGURES_LOG_PIPELINE_ERRORS_TO_DB', True))
 
 
+def use_site_course_daily_metrics():
+    """
+    Populate CourseDailyMetrics for a whole site at a time with grouped queries
+    instead of running the per-course extractor for each course.
+
+    Override by setting ``FIGURES_SITE_COURSE_DAILY_METRICS`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_SITE_COURSE_DAILY_METRICS', False))
+
+
+def use_incremental_learner_grades():
+    """
+    Only recompute course grades for learners with courseware activity since
+    their most recent LearnerCourseGradeMetrics record. Other learners' most
+    recent records are reused for the course average progress.
+
+    Override by setting ``FIGURES_INCREMENTAL_LEARNER_GRADES`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_INCREMENTAL_LEARNER_GRADES', False))
+
+
+def use_active_user_bitmaps():
+    """
+    Store a bitmap of the ids of the users active in each site and course for
+    the day when the daily metrics pipeline runs. See ``ActiveUserBitmap``.
+
+    Override by setting ``FIGURES_ACTIVE_USER_BITMAPS`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_ACTIVE_USER_BITMAPS', False))
+
+
+def use_distinct_cumulative_active_users():
+    """
+    Compute the SiteDailyMetrics ``cumulative_active_user_count`` as the number
+    of distinct users ever active in the site, maintained incrementally in
+    ``SiteEverActiveUsers``, instead of the sum of the daily active user counts.
+
+    Override by setting ``FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS`` to true in the Open edX
+    FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS', False))
+
+
+def use_course_monthly_metrics():
+    """
+    Maintain the CourseMonthlyMetrics model in the daily metrics pipeline and
+    serve the course monthly metrics endpoints from it.
+
+    Override by setting ``FIGURES_COURSE_MONTHLY_METRICS`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_COURSE_MONTHLY_METRICS', False))
+
+
+def use_api_response_cache():
+    """
+    Serve repeat requests to the metrics and course data endpoints from a
+    cache of the responses for each site. The cached responses are replaced
+    when the pipeline next updates the site's metrics.
+
+    Override by setting ``FIGURES_API_RESPONSE_CACHE`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_API_RESPONSE_CACHE', False))
+
+
 def as_course_key(course_id):
     '''Returns course id as a CourseKey instance
 
@@ -110,6 +174,55 @@ def prev_day(val):
     return days_from(val, -1)
 
 
+def day_window(date_for, dates=False):
+    """Returns the half-open (start, end) UTC window for the day
+
+    ``start`` is midnight UTC at the start of the day and ``end`` is midnight
+    UTC at the start of the next day. If ``dates`` is true, returns
+    ``datetime.date`` objects for filtering date fields
+    """
+    start = as_date(date_for)
+    end = next_day(start)
+    if dates:
+        return start, end
+    return as_datetime(start), as_datetime(end)
+
+
+def month_window(month_for, dates=False):
+    """Returns the half-open (start, end) UTC window for the month
+
+    ``month_for`` is a date, datetime or (year, month) tuple. ``start`` is
+    the first day of the month and ``end`` is the first day of the next month.
+    If ``dates`` is true, returns ``datetime.date`` objects for filtering date
+    fields
+    """
+    if isinstance(month_for, tuple):
+        year, month = month_for[0], month_for[1]
+    else:
+        year, month = month_for.year, month_for.month
+    start = datetime.date(year=year, month=month, day=1)
+    end = start + relativedelta(months=1)
+    if dates:
+        return start, end
+    return as_datetime(start), as_datetime(end)
+
+
+def window_filter(field_name, window):
+    """Returns queryset filter keyword args for the half-open (start, end) window
+
+    Use with ``day_window``, ``month_window`` or any (start, end) pair. Filtering
+    on a range lets the database use an index on the field, where the
+    ``__year``, ``__month`` and ``__day`` lookups do not. Example::
+
+        StudentModule.objects.filter(**window_filter('modified', day_window(date_for)))
+    """
+    start, end = window
+    return {
+        '{}__gte'.format(field_name): start,
+        '{}__lt'.format(field_name): end,
+    }
+
+
 def days_in_month(month_for):
     _, num_days_in_month = calendar.monthrange(month_for.year, month_for.month)
     return num_days_in_month
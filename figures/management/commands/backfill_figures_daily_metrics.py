@@ -0,0 +1,93 @@
+"""Backfills Figures daily metrics for a range of dates
+
+Populates CourseDailyMetrics in parallel, then SiteDailyMetrics for each site
+in date order
+"""
+
+from __future__ import print_function
+
+import datetime
+from textwrap import dedent
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils.timezone import utc
+
+from figures.backfill import BACKFILL_DAILY_METRICS_WORKERS, backfill_daily_metrics
+from figures.helpers import as_date, prev_day
+
+
+class Command(BaseCommand):
+    """Backfill Figures daily metrics models for a range of dates
+    """
+    help = dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date',
+                            required=True,
+                            help='first date to backfill in yyyy-mm-dd format')
+        parser.add_argument('--end-date',
+                            help=('last date to backfill in yyyy-mm-dd format.' +
+                                  ' Defaults to yesterday'))
+        parser.add_argument('--site',
+                            action='append',
+                            dest='sites',
+                            help=('id or domain of a site to backfill. Can be given more' +
+                                  ' than once. Defaults to all sites'))
+        parser.add_argument('--workers',
+                            type=int,
+                            default=BACKFILL_DAILY_METRICS_WORKERS,
+                            help='number of worker threads')
+        parser.add_argument('--force-update',
+                            action='store_true',
+                            default=False,
+                            help='Overwrite metrics records if they exist for the given dates')
+
+    def get_sites(self, site_args):
+        if not site_args:
+            return Site.objects.order_by('id')
+        query = Q()
+        for site_arg in site_args:
+            if site_arg.isdigit():
+                query |= Q(id=int(site_arg))
+            else:
+                query |= Q(domain=site_arg)
+        sites = Site.objects.filter(query).order_by('id')  # pylint: disable=no-member
+        if not sites:
+            raise CommandError('No sites found for {}'.format(', '.join(site_args)))
+        return sites
+
+    def print_progress(self, status):
+        print('{stage}: {done}/{total} in {elapsed:.1f}s ({rate:.2f}/s)'.format(**status))
+
+    def handle(self, *args, **options):
+        start_date = as_date(options['start_date'])
+        if options['end_date']:
+            end_date = as_date(options['end_date'])
+        else:
+            end_date = prev_day(datetime.datetime.utcnow().replace(tzinfo=utc).date())
+        if end_date < start_date:
+            raise CommandError('--end-date must not be before --start-date')
+
+        sites = self.get_sites(options['sites'])
+        print('BEGIN: Backfill Figures daily metrics from {} to {} for {} site(s)'.format(
+            start_date, end_date, len(sites)))
+        results = backfill_daily_metrics(start_date=start_date,
+                                         end_date=end_date,
+                                         sites=sites,
+                                         workers=options['workers'],
+                                         force_update=options['force_update'],
+                                         report=self.print_progress)
+        if results['course_failures']:
+            print('{} course daily metrics failed. See the Figures pipeline errors'.format(
+                results['course_failures']))
+        if results['site_failures']:
+            print('{} site daily metrics failed. See the Figures pipeline errors'.format(
+                results['site_failures']))
+        for site in sites:
+            skipped_dates = results['skipped_site_dates'].get(site.id)
+            if skipped_dates:
+                print('Site daily metrics not run for site {} from {} to {}'.format(
+                    site.domain, skipped_dates[0], skipped_dates[-1]))
+        print('DONE: Backfill Figures daily metrics')
@@ -44,6 +44,11 @@ class Command(BaseCommand):
                             action='store_true',
                             default=False,
                             help='Run just the MAU pipeline')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            default=False,
+                            help=('Rerun only the courses that failed or did not run in' +
+                                  ' the previous run for the given date'))
 
     def handle(self, *args, **options):
         '''
@@ -76,6 +81,7 @@ class Command(BaseCommand):
                 else:
                     experimental_populate_daily_metrics.delay(**kwargs)  # pragma: no cover
             else:
+                kwargs['resume'] = options['resume']
                 if options['no_delay']:
                     populate_daily_metrics(**kwargs)
                 else:
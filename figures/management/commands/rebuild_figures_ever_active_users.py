@@ -0,0 +1,49 @@
+"""Rebuilds the sets of users ever active in each site from history
+
+Also corrects the SiteDailyMetrics cumulative active user counts. Run this
+before enabling ``FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS``
+"""
+
+from __future__ import print_function
+
+import datetime
+from textwrap import dedent
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from django.utils.timezone import utc
+
+from figures.helpers import as_date, prev_day
+from figures.pipeline.ever_active_users import rebuild_ever_active_users
+
+
+class Command(BaseCommand):
+    """Rebuild the Figures ever active users sets from history
+    """
+    help = dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date',
+                            help=('last date to include in yyyy-mm-dd format.' +
+                                  ' Defaults to yesterday'))
+        parser.add_argument('--site',
+                            type=int,
+                            action='append',
+                            dest='site_ids',
+                            help='id of a site to rebuild. Defaults to all sites')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            date_for = as_date(options['date'])
+        else:
+            date_for = prev_day(datetime.datetime.utcnow().replace(tzinfo=utc).date())
+        sites = Site.objects.order_by('id')
+        if options['site_ids']:
+            sites = sites.filter(id__in=options['site_ids'])
+
+        print('BEGIN: Rebuild Figures ever active users through {}'.format(date_for))
+        for site in sites:
+            ever_active = rebuild_ever_active_users(site=site, date_for=date_for)
+            print('Site "{}" has {} ever active users'.format(
+                site.domain, ever_active.user_count))
+        print('DONE: Rebuild Figures ever active users')
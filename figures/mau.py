@@ -2,8 +2,19 @@
 This module provides MAU metrics retrieval functionality
 """
 
+from collections import defaultdict
 from datetime import datetime
+import logging
 
+from django.db.models import Count
+try:
+    from django.db.models.functions import TruncMonth
+except ImportError:
+    # Django 1.8 (Ginkgo)
+    TruncMonth = None
+from django.utils.timezone import utc
+
+from figures.helpers import as_date, month_window, window_filter
 from figures.models import CourseMauMetrics, SiteMauMetrics
 from figures.sites import (
     get_course_keys_for_site,
@@ -12,6 +23,9 @@ from figures.sites import (
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 def get_mau_from_student_modules(student_modules, year, month):
     """
     Return records modified in year and month
@@ -21,11 +35,67 @@ def get_mau_from_student_modules(student_modules, year, month):
     the specified month
 
     """
-    qs = student_modules.filter(modified__year=year,
-                                modified__month=month)
+    qs = student_modules.filter(**window_filter('modified', month_window((year, month))))
     return qs.values_list('student__id', flat=True).distinct()
 
 
+def get_mau_counts_by_course(student_modules, year, month):
+    """
+    Return the distinct active user counts for each course with records
+    modified in year and month
+
+    Counts are made with a single ``GROUP BY course_id`` query. Returns a dict
+    of course id strings to counts. Courses without activity are not included
+    """
+    qs = student_modules.filter(**window_filter('modified', month_window((year, month))))
+    rows = qs.order_by().values('course_id').annotate(
+        mau=Count('student_id', distinct=True))
+    return {str(row['course_id']): row['mau'] for row in rows}
+
+
+def get_monthly_active_user_counts(student_modules, field_name='modified', by_course=False):
+    """Returns the distinct active user counts for every month in
+    ``student_modules``
+
+    Months are bucketed on ``field_name`` and represented by the first day of
+    the month. If ``by_course`` is true, the keys are (course id string, month)
+    tuples, otherwise they are months. Months without activity are not
+    included
+
+    Counts are made with a single grouped query. On Django versions without
+    ``TruncMonth`` (Ginkgo), the values are scanned once and counted in Python.
+    The values are also scanned if the database truncates to NULL months, as
+    MySQL does without its time zone tables loaded
+    """
+    if TruncMonth:
+        group_fields = ['course_id', 'month'] if by_course else ['month']
+        rows = student_modules.annotate(
+            month=TruncMonth(field_name, tzinfo=utc)).order_by().values(
+                *group_fields).annotate(count=Count('student_id', distinct=True))
+        counts = {}
+        for row in rows:
+            if row['month'] is None:
+                logger.warning('The database returned NULL months for {}. Load the '
+                               'time zone tables. Counting in Python'.format(field_name))
+                return _count_monthly_active_users(student_modules, field_name, by_course)
+            month = as_date(row['month']).replace(day=1)
+            counts[(str(row['course_id']), month) if by_course else month] = row['count']
+        return counts
+    return _count_monthly_active_users(student_modules, field_name, by_course)
+
+
+def _count_monthly_active_users(student_modules, field_name, by_course):
+    """Counts the monthly active users for ``get_monthly_active_user_counts``
+    in Python with one scan of the values
+    """
+    users = defaultdict(set)
+    values = student_modules.order_by().values_list('course_id', 'student_id', field_name)
+    for course_id, student_id, dt in values.iterator():
+        month = as_date(dt).replace(day=1)
+        users[(str(course_id), month) if by_course else month].add(student_id)
+    return {key: len(user_ids) for key, user_ids in users.items()}
+
+
 def get_mau_from_site_course(site, course_id, year, month):
     """Convenience function to get the distinct active users for a given course
     in a site
@@ -76,6 +146,9 @@ def retrieve_live_course_mau_data(site, course_id):
 def store_mau_metrics(site, overwrite=False):
     """
     Save "snapshot" of MAU metrics
+
+    The site MAU is one distinct count and the course MAUs are counted with a
+    single grouped query. Course records are written in bulk
     """
     today = datetime.utcnow()
 
@@ -90,21 +163,18 @@ def store_mau_metrics(site, overwrite=False):
                                                          date_for=today.date(),
                                                          data=dict(mau=site_mau.count()),
                                                          overwrite=overwrite)
-    course_mau_objects = []
-    for course_key in get_course_keys_for_site(site):
-        course_student_modules = student_modules.filter(course_id=course_key)
-        course_mau = get_mau_from_student_modules(
-            student_modules=course_student_modules,
-            year=today.year,
-            month=today.month)
-        course_mau_obj, _created = CourseMauMetrics.save_metrics(
-                site=site,
-                course_id=str(course_key),
-                date_for=today.date(),
-                data=dict(mau=course_mau.count()),
-                overwrite=overwrite)
-
-        course_mau_objects.append(course_mau_obj)
+
+    course_ids = [str(course_key) for course_key in get_course_keys_for_site(site)]
+    course_maus = get_mau_counts_by_course(student_modules=student_modules,
+                                           year=today.year,
+                                           month=today.month)
+    CourseMauMetrics.save_metrics_bulk(
+        site=site,
+        course_maus={(course_id, today.date()): course_maus.get(course_id, 0)
+                     for course_id in course_ids},
+        overwrite=overwrite)
+    course_mau_objects = list(CourseMauMetrics.objects.filter(
+        site=site, course_id__in=course_ids, date_for=today.date()))
 
     return dict(smo=site_mau_obj,
                 cmos=course_mau_objects)
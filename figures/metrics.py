@@ -21,21 +21,27 @@ parameter to support multi-tenancy
 
 """
 
+from collections import OrderedDict
+import copy
 import datetime
 from decimal import Decimal
 import math
+import threading
+import time
 
 from django.contrib.auth import get_user_model
-from django.db.models import Avg, Max
+from django.db.models import Avg, Case, Count, F, Max, When
 
 from courseware.courses import get_course_by_id  # pylint: disable=import-error
 from courseware.models import StudentModule  # pylint: disable=import-error
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview  # noqa pylint: disable=import-error
 
 from figures.compat import (
     GeneratedCertificate,
     chapter_grade_values,
     course_grade,
 )
+from figures.bitmaps import bitmap_count, bitmap_to_user_ids
 from figures.helpers import (
     as_course_key,
     as_date,
@@ -45,10 +51,15 @@ from figures.helpers import (
     prev_day,
     previous_months_iterator,
     first_last_days_for_month,
+    month_window,
+    use_active_user_bitmaps,
+    window_filter,
 )
 from figures.mau import get_mau_from_site_course
 from figures.models import (
+    ActiveUserBitmap,
     CourseDailyMetrics,
+    CourseMonthlyMetrics,
     SiteDailyMetrics,
     SiteMonthlyMetrics,
 )
@@ -65,6 +76,125 @@ def period_str(month_tuple, fmt='%Y/%m'):
     return datetime.date(*month_tuple).strftime(fmt)
 
 
+#
+# Course structure cache
+#
+
+# Maximum number of course descriptors held by the course structure cache
+COURSE_STRUCTURE_CACHE_SIZE = 10
+
+# Seconds a cached course's version is trusted before it is checked again
+COURSE_STRUCTURE_VERSION_CHECK_INTERVAL = 60
+
+
+def course_structure_version(course_key):
+    """Returns a value that changes when the course is republished
+
+    CourseOverview records are regenerated when a course is published, so we
+    use the overview's ``modified`` timestamp. The overview's ``version`` field
+    is the version of the overview's own schema, not of the course content.
+    Returns ``None`` if there is no overview.
+    """
+    return CourseOverview.objects.filter(id=course_key).values_list(
+        'modified', flat=True).first()
+
+
+def load_course_structure(course_key):
+    """Loads the course descriptor from the modulestore
+
+    This is the learner independent part of grading a course
+    """
+    return get_course_by_id(course_key=course_key)
+
+
+def learner_course_descriptor(course):
+    """Returns a copy of the cached course descriptor set up for grading one
+    learner
+
+    The copy has its own field data cache, so the learner's grading does not
+    share field values with other learners or threads using the cached course
+    """
+    course = copy.copy(course)
+    course._field_data_cache = {}  # pylint: disable=protected-access
+    course.set_grading_policy(course.grading_policy)
+    return course
+
+
+class CourseStructureCache(object):
+    """
+    Bounded, in-process least recently used cache of course descriptors
+
+    Entries are keyed by course id and hold the course structure version they
+    were loaded for. The version is checked at most once every
+    ``version_check_interval`` seconds, and a republished course is reloaded.
+    When the cache is full, the least recently used course is evicted.
+
+    The cached descriptors are not handed out. ``get`` returns a copy set up
+    for one learner, see ``learner_course_descriptor``.
+
+    A single module level instance, ``course_structure_cache``, is shared by
+    all ``LearnerCourseGrades`` instances in the process, so it is shared across
+    the learners in a pipeline run and across Celery tasks in the same worker.
+    """
+
+    def __init__(self, max_size=COURSE_STRUCTURE_CACHE_SIZE,
+                 version_check_interval=COURSE_STRUCTURE_VERSION_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        # course id string to (version, version checked time, course)
+        self._courses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._courses)
+
+    def get_structure(self, course_id):
+        """Returns the cached course descriptor, loading it if it is missing
+        or out of date
+
+        The returned descriptor is shared. Do not grade with it
+        """
+        course_key = as_course_key(course_id)
+        key = str(course_key)
+        now = time.time()
+        with self._lock:
+            entry = self._courses.pop(key, None)
+            if entry is not None:
+                self._courses[key] = entry
+        if entry is not None:
+            version, checked_at, course = entry
+            if now - checked_at < self.version_check_interval:
+                return course
+            current_version = course_structure_version(course_key)
+            if current_version == version:
+                with self._lock:
+                    if key in self._courses:
+                        self._courses[key] = (version, now, course)
+                return course
+        else:
+            current_version = course_structure_version(course_key)
+
+        course = load_course_structure(course_key)
+        with self._lock:
+            self._courses.pop(key, None)
+            self._courses[key] = (current_version, now, course)
+            while len(self._courses) > self.max_size:
+                self._courses.popitem(last=False)
+        return course
+
+    def get(self, course_id):
+        """Returns a course descriptor for grading one learner
+        """
+        return learner_course_descriptor(self.get_structure(course_id))
+
+    def clear(self):
+        with self._lock:
+            self._courses.clear()
+
+
+course_structure_cache = CourseStructureCache()
+
+
 #
 # Learner specific data/metrics
 #
@@ -100,6 +230,10 @@ class LearnerCourseGrades(object):
     def __init__(self, user_id, course_id, **_kwargs):
         """
 
+        The course structure is retrieved from ``course_structure_cache`` so
+        only the learner's course grade is read for each instance. Each
+        instance grades with its own copy of the course descriptor.
+
         If figures.compat.course_grade is unable to retrieve the course blocks,
         raises:
 
@@ -107,9 +241,7 @@ class LearnerCourseGrades(object):
                 "User does not have access to this course")
         """
         self.learner = get_user_model().objects.get(id=user_id)
-        self.course = get_course_by_id(course_key=as_course_key(course_id))
-        self.course._field_data_cache = {}  # pylint: disable=protected-access
-        self.course.set_grading_policy(self.course.grading_policy)
+        self.course = course_structure_cache.get(course_id)
         self.course_grade = course_grade(self.learner, self.course)
 
     def __str__(self):
@@ -276,8 +408,7 @@ def get_site_mau_current_month(site):
     """
     month_for = datetime.datetime.utcnow()
     site_sm = figures.sites.get_student_modules_for_site(site)
-    curr_sm = site_sm.filter(modified__year=month_for.year,
-                             modified__month=month_for.month)
+    curr_sm = site_sm.filter(**window_filter('modified', month_window(month_for)))
     return curr_sm.values('student__id').distinct().count()
 
 
@@ -290,7 +421,16 @@ def get_active_users_for_time_period(site, start_date, end_date, course_ids=None
 
     We don't do this only because it raises timezone warnings
         modified__range=(as_date(start_date), as_date(end_date)),
+
+    If the pipeline stores the active user bitmaps and has stored them for
+    every day of the period, the site count is read from the bitmaps instead
     """
+    if (not course_ids and use_active_user_bitmaps() and
+            active_user_bitmaps_cover_period(site, start_date, end_date)):
+        return get_active_user_count_from_bitmaps(site=site,
+                                                  start_date=start_date,
+                                                  end_date=end_date)
+
     # Get list of learners for the site
 
     user_ids = figures.sites.get_user_ids_for_site(site)
@@ -306,6 +446,53 @@ def get_active_users_for_time_period(site, start_date, end_date, course_ids=None
         **filter_args).values('student__id').distinct().count()
 
 
+def get_active_user_ids_from_bitmaps(site, start_date, end_date, course_id=None):
+    """
+    Returns the sorted list of ids of the users active in the site, or the
+    course if ``course_id`` is given, from ``start_date`` through ``end_date``
+
+    Reads the stored daily ``ActiveUserBitmap`` records instead of
+    StudentModule. Days without a record count as having no activity, so use
+    ``active_user_bitmaps_cover_period`` to check the period has been
+    populated
+    """
+    bitmap = ActiveUserBitmap.objects.bitmap_for_window(
+        site=site,
+        start_date=as_date(start_date),
+        end_date=as_date(end_date),
+        course_id=str(course_id) if course_id else '')
+    return bitmap_to_user_ids(bitmap)
+
+
+def get_active_user_count_from_bitmaps(site, start_date, end_date, course_id=None):
+    """
+    Returns the number of distinct users active in the site, or the course if
+    ``course_id`` is given, from ``start_date`` through ``end_date``
+
+    See ``get_active_user_ids_from_bitmaps``
+    """
+    bitmap = ActiveUserBitmap.objects.bitmap_for_window(
+        site=site,
+        start_date=as_date(start_date),
+        end_date=as_date(end_date),
+        course_id=str(course_id) if course_id else '')
+    return bitmap_count(bitmap)
+
+
+def active_user_bitmaps_cover_period(site, start_date, end_date):
+    """
+    Returns ``True`` if the pipeline stored the site's active user bitmaps for
+    every day from ``start_date`` through ``end_date``
+    """
+    start_date = as_date(start_date)
+    end_date = as_date(end_date)
+    days = ActiveUserBitmap.objects.filter(site=site,
+                                           course_id='',
+                                           date_for__gte=start_date,
+                                           date_for__lte=end_date).count()
+    return days == (end_date - start_date).days + 1
+
+
 def get_total_site_users_for_time_period(site, start_date, end_date, **kwargs):
     """
     Returns the maximum number of users who joined before or on the end date
@@ -627,6 +814,133 @@ def get_month_course_metrics(site, course_id, month_for, **_kwargs):
         )
 
 
+def get_course_history_metrics_for_courses(site, course_ids, date_for, months_back):
+    """Returns a dict of course ids to the course history metrics
+
+    Each course's value is a dict with the ``learners_enrolled``,
+    ``average_progress``, ``average_days_to_complete`` and ``users_completed``
+    history. These are the same values ``get_monthly_history_metric`` returns
+    with the course time period getters. Each metric is one query for all the
+    courses
+    """
+    def history(aggregate, field_name, convert):
+        def aggregate_for_month(start_date, end_date):
+            return aggregate(Case(When(then=F(field_name),
+                                       **_date_for_in_period(start_date, end_date))))
+        return get_course_monthly_history_from_aggregate(
+            queryset=CourseDailyMetrics.objects.filter(site=site),
+            course_ids=course_ids,
+            aggregate_for_month=aggregate_for_month,
+            date_for=date_for,
+            months_back=months_back,
+            convert=convert)
+
+    # See the get_course_*_for_time_period functions
+    def max_value(value):
+        return value if value is not None else 0
+
+    def average_progress(value):
+        if value is None:
+            return 0.0
+        return float(Decimal(value).quantize(Decimal('.00')))
+
+    def average_days(value):
+        return int(math.ceil(value)) if value is not None else 0
+
+    metrics = dict(
+        learners_enrolled=history(Max, 'enrollment_count', max_value),
+        average_progress=history(Avg, 'average_progress', average_progress),
+        average_days_to_complete=history(Avg, 'average_days_to_complete', average_days),
+        users_completed=history(Max, 'num_learners_completed', max_value),
+    )
+    return dict((course_id, dict((key, value[course_id]) for key, value in metrics.items()))
+                for course_id in course_ids)
+
+
+def course_monthly_metrics_data(course_monthly_metrics, month_for):
+    """Returns the ``get_month_course_metrics`` dict for a CourseMonthlyMetrics
+    record
+    """
+    return dict(
+        course_id=course_monthly_metrics.course_id,
+        month_for=month_for,
+        active_users=course_monthly_metrics.active_users,
+        course_enrollments=course_monthly_metrics.course_enrollments,
+        num_learners_completed=course_monthly_metrics.num_learners_completed,
+        avg_days_to_complete=course_monthly_metrics.avg_days_to_complete,
+        avg_progress=float(course_monthly_metrics.avg_progress),
+        )
+
+
+def get_month_course_metrics_for_courses(site, course_ids, month_for):
+    """Returns a list of ``get_month_course_metrics`` dicts for the courses
+
+    Reads the CourseMonthlyMetrics records for the month with one query.
+    Courses without a record, for example before the pipeline has run in the
+    month, are computed with ``get_month_course_metrics``
+    """
+    first_day, _last_day = first_last_days_for_month(month_for)
+    records = dict(
+        (rec.course_id, rec) for rec in CourseMonthlyMetrics.objects.filter(
+            site=site, course_id__in=course_ids, month_for=first_day))
+    data = []
+    for course_id in course_ids:
+        if course_id in records:
+            data.append(course_monthly_metrics_data(records[course_id], month_for))
+        else:
+            data.append(get_month_course_metrics(site=site,
+                                                 course_id=course_id,
+                                                 month_for=month_for))
+    return data
+
+
+def get_course_monthly_metrics_history(site, course_id, field_name, func, date_for,
+                                       months_back):
+    """Returns the same data as ``get_monthly_history_metric`` for a course
+    metric, read from the CourseMonthlyMetrics ``field_name`` values
+
+    Months without a record are computed by calling ``func`` with the site,
+    start date, end date and course id
+    """
+    months = list(previous_months_iterator(month_for=as_date(date_for),
+                                           months_back=months_back))
+    values = dict(CourseMonthlyMetrics.objects.filter(
+        site=site,
+        course_id=course_id,
+        month_for__in=[datetime.date(month[0], month[1], 1) for month in months],
+        ).values_list('month_for', field_name))
+    history = []
+    for month in months:
+        start_date = datetime.date(month[0], month[1], 1)
+        if start_date in values:
+            value = values[start_date]
+            if isinstance(value, Decimal):
+                value = float(value)
+        else:
+            value = func(site=site,
+                         start_date=start_date,
+                         end_date=datetime.date(month[0], month[1], month[2]),
+                         course_id=course_id)
+        history.append(dict(period=period_str(month), value=value))
+    return dict(
+        current_month=history[-1]['value'] if history else 0,
+        history=history,)
+
+
+def get_course_active_users_for_time_period(site, start_date,
+                                            end_date, course_id):  # pylint: disable=unused-argument
+    """Returns the number of distinct users active in the course in the month
+    of ``start_date``
+
+    ``end_date`` is accepted for the ``get_monthly_history_metric`` handler
+    signature. The count is always for the whole month
+    """
+    return get_mau_from_site_course(site=site,
+                                    course_id=course_id,
+                                    year=start_date.year,
+                                    month=start_date.month).count()
+
+
 def get_current_month_site_metrics(site, **_kwargs):
     """
     TODO: put the metric names and functions in a dict and iterate. This then
@@ -665,6 +979,120 @@ def get_current_month_site_metrics(site, **_kwargs):
                 course_completions=course_completions)
 
 
+def get_monthly_history_from_aggregate(queryset, aggregate_for_month, date_for,
+                                       months_back):
+    """Returns the same data as ``get_monthly_history_metric`` from one query
+
+    ``aggregate_for_month`` is called with the start and end dates of each
+    month and returns a conditional aggregate expression for the month. All
+    the months are aggregated over ``queryset`` in a single query. Months
+    without data have the value zero
+    """
+    months, aggregates = _monthly_aggregates(aggregate_for_month, date_for, months_back)
+    values = queryset.aggregate(**aggregates) if aggregates else {}
+    return _monthly_history(months, values, convert=lambda value: value or 0)
+
+
+def get_course_monthly_history_from_aggregate(queryset, course_ids, aggregate_for_month,
+                                              date_for, months_back, convert):
+    """Returns a dict of course ids to ``get_monthly_history_metric`` data for
+    each course from one query
+
+    Like ``get_monthly_history_from_aggregate`` with the queryset grouped by
+    ``course_id``. ``convert`` is called with each month's aggregate value,
+    ``None`` for months without data, and returns the metric value
+    """
+    months, aggregates = _monthly_aggregates(aggregate_for_month, date_for, months_back)
+    rows = {}
+    if aggregates and course_ids:
+        rows = dict((row['course_id'], row) for row in queryset.filter(
+            course_id__in=course_ids).order_by().values('course_id').annotate(**aggregates))
+    return dict((course_id, _monthly_history(months, rows.get(course_id, {}), convert))
+                for course_id in course_ids)
+
+
+def _monthly_aggregates(aggregate_for_month, date_for, months_back):
+    """Returns the months and the ``month_i`` aggregates for the history
+    """
+    months = list(previous_months_iterator(month_for=as_date(date_for),
+                                           months_back=months_back))
+    aggregates = {
+        'month_{}'.format(i): aggregate_for_month(
+            start_date=datetime.date(month[0], month[1], 1),
+            end_date=datetime.date(month[0], month[1], month[2]))
+        for i, month in enumerate(months)}
+    return months, aggregates
+
+
+def _monthly_history(months, values, convert):
+    """Returns the history data for the ``month_i`` aggregate values
+    """
+    history = [dict(period=period_str(month),
+                    value=convert(values.get('month_{}'.format(i))))
+               for i, month in enumerate(months)]
+    return dict(
+        current_month=history[-1]['value'] if history else 0,
+        history=history,)
+
+
+def _date_for_in_period(start_date, end_date):
+    """Filter kwargs for the ``date_for`` of daily metrics in the time period
+    """
+    return dict(date_for__gt=prev_day(start_date), date_for__lt=next_day(end_date))
+
+
+def get_monthly_site_metrics_history(site, date_for, months_back):
+    """Returns the ``get_monthly_site_metrics`` history data with one query per
+    metric
+
+    Each metric is a conditional aggregate per month over the same filters as
+    the time period getters used with ``get_monthly_history_metric``
+    """
+    def history(queryset, aggregate_for_month):
+        return get_monthly_history_from_aggregate(queryset=queryset,
+                                                  aggregate_for_month=aggregate_for_month,
+                                                  date_for=date_for,
+                                                  months_back=months_back)
+
+    def max_daily_metric(field_name):
+        def aggregate_for_month(start_date, end_date):
+            return Max(Case(When(then=F(field_name),
+                                 **_date_for_in_period(start_date, end_date))))
+        return aggregate_for_month
+
+    # See get_active_users_for_time_period
+    def active_users(start_date, end_date):
+        return Count(Case(When(modified__gt=as_datetime(prev_day(start_date)),
+                               modified__lt=as_datetime(next_day(end_date)),
+                               then=F('student_id'))),
+                     distinct=True)
+
+    # See get_total_site_users_for_time_period
+    def total_site_users(start_date, end_date):  # pylint: disable=unused-argument
+        return Count(Case(When(date_joined__lt=as_datetime(next_day(end_date)),
+                               then=F('id'))))
+
+    # Bound the StudentModule scan to the months the active user aggregates read
+    months = list(previous_months_iterator(month_for=as_date(date_for),
+                                           months_back=months_back))
+    student_modules = StudentModule.objects.filter(
+        student_id__in=figures.sites.get_user_ids_for_site(site),
+        modified__gt=as_datetime(prev_day(datetime.date(months[0][0], months[0][1], 1))),
+        modified__lt=as_datetime(next_day(datetime.date(*months[-1]))))
+
+    site_daily_metrics = SiteDailyMetrics.objects.filter(site=site)
+    return dict(
+        monthly_active_users=history(student_modules, active_users),
+        total_site_users=history(figures.sites.get_users_for_site(site),
+                                 total_site_users),
+        total_site_courses=history(site_daily_metrics, max_daily_metric('course_count')),
+        total_course_enrollments=history(site_daily_metrics,
+                                         max_daily_metric('total_enrollment_count')),
+        total_course_completions=history(CourseDailyMetrics.objects.filter(site=site),
+                                         max_daily_metric('num_learners_completed')),
+    )
+
+
 def get_monthly_site_metrics(site, date_for=None, **kwargs):
     """Gets current metrics with history
 
@@ -745,50 +1173,8 @@ def get_monthly_site_metrics(site, date_for=None, **kwargs):
 
     months_back = kwargs.get('months_back', 6)  # Warning: magic number
 
-    ##
-    # Brute force this for now. Later, refactor to define getters externally,
-    # and rely more on the serializers to stitch data together to respond
-    ##
-    # Then, we can put the method calls into a dict, load the dict from
-    # settings, for example, or a Django model
-
-    # We are retrieving data here in series before constructing the return dict
-    # This makes it easier to inspect
-    monthly_active_users = get_monthly_history_metric(
-        func=get_active_users_for_time_period,
-        site=site,
-        date_for=date_for,
-        months_back=months_back,
-    )
-    total_site_users = get_monthly_history_metric(
-        func=get_total_site_users_for_time_period,
-        site=site,
-        date_for=date_for,
-        months_back=months_back,
-    )
-    total_site_courses = get_monthly_history_metric(
-        func=get_total_site_courses_for_time_period,
-        site=site,
-        date_for=date_for,
-        months_back=months_back,
-    )
-    total_course_enrollments = get_monthly_history_metric(
-        func=get_total_enrollments_for_time_period,
-        site=site,
-        date_for=date_for,
-        months_back=months_back,
-    )
-    total_course_completions = get_monthly_history_metric(
-        func=get_total_course_completions_for_time_period,
-        site=site,
-        date_for=date_for,
-        months_back=months_back,
-    )
-
-    return dict(
-        monthly_active_users=monthly_active_users,
-        total_site_users=total_site_users,
-        total_site_courses=total_site_courses,
-        total_course_enrollments=total_course_enrollments,
-        total_course_completions=total_course_completions,
-    )
+    # Each metric's history comes from a single grouped query. See
+    # ``get_monthly_site_metrics_history``
+    return get_monthly_site_metrics_history(site=site,
+                                            date_for=date_for,
+                                            months_back=months_back)
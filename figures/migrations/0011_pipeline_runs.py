@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-17 04:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('figures', '0010_site_monthly_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineCourseRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('course_id', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[(b'pending', b'Pending'), (b'running', b'Running'), (b'succeeded', b'Succeeded'), (b'failed', b'Failed')], default=b'pending', max_length=16)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PipelineSiteRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('date_for', models.DateField()),
+                ('status', models.CharField(choices=[(b'pending', b'Pending'), (b'running', b'Running'), (b'succeeded', b'Succeeded'), (b'failed', b'Failed')], default=b'pending', max_length=16)),
+                ('site_metrics_status', models.CharField(choices=[(b'pending', b'Pending'), (b'running', b'Running'), (b'succeeded', b'Succeeded'), (b'failed', b'Failed')], default=b'pending', max_length=16)),
+                ('course_count', models.IntegerField(default=0)),
+                ('finished_course_count', models.IntegerField(default=0)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Site')),
+            ],
+            options={
+                'ordering': ['-date_for', 'site'],
+            },
+        ),
+        migrations.AddField(
+            model_name='pipelinecourserun',
+            name='site_run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_runs', to='figures.PipelineSiteRun'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pipelinesiterun',
+            unique_together=set([('site', 'date_for')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pipelinecourserun',
+            unique_together=set([('site_run', 'course_id')]),
+        ),
+    ]
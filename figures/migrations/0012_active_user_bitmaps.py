@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-17 05:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('figures', '0011_pipeline_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveUserBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('course_id', models.CharField(blank=True, default=b'', max_length=255)),
+                ('date_for', models.DateField()),
+                ('user_count', models.IntegerField()),
+                ('bitmap', models.BinaryField()),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Site')),
+            ],
+            options={
+                'ordering': ['-date_for'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='activeuserbitmap',
+            unique_together=set([('site', 'course_id', 'date_for')]),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-17 05:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('figures', '0013_site_ever_active_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseMonthlyMetrics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('course_id', models.CharField(max_length=255)),
+                ('month_for', models.DateField()),
+                ('active_users', models.IntegerField()),
+                ('course_enrollments', models.IntegerField()),
+                ('num_learners_completed', models.IntegerField()),
+                ('avg_days_to_complete', models.IntegerField()),
+                ('avg_progress', models.DecimalField(decimal_places=2, max_digits=3)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Site')),
+            ],
+            options={
+                'ordering': ['-month_for', 'course_id'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='coursemonthlymetrics',
+            unique_together=set([('site', 'course_id', 'month_for')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-17 06:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('figures', '0014_course_monthly_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='siteeveractiveusers',
+            name='activity_through',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
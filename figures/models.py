@@ -6,13 +6,45 @@ from datetime import date
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, OuterRef, Subquery, Value, When
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
 
 from jsonfield import JSONField
 
 from model_utils.models import TimeStampedModel
 
+from figures.bitmaps import (
+    bitmap_count,
+    bitmap_to_user_ids,
+    decode_bitmap,
+    encode_bitmap,
+    user_ids_to_bitmap,
+)
+from figures.helpers import month_window, window_filter
+
+
+# Number of records updated per UPDATE statement by ``bulk_update_field``.
+# Keeps the number of query parameters under SQLite's limit
+BULK_UPDATE_BATCH_SIZE = 100
+
+
+def bulk_update_field(model, field_name, values):
+    """Sets ``field_name`` to a different value for each record
+
+    ``values`` maps primary keys to the new field values. Each batch of
+    records is updated with a single ``UPDATE`` query
+    """
+    items = list(values.items())
+    for i in range(0, len(items), BULK_UPDATE_BATCH_SIZE):
+        batch = items[i:i + BULK_UPDATE_BATCH_SIZE]
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{
+            field_name: Case(*[When(pk=pk, then=Value(value)) for pk, value in batch],
+                             output_field=model._meta.get_field(field_name)),
+            'modified': now(),
+        })
+
 
 def default_site():
     """
@@ -80,6 +112,24 @@ class CourseDailyMetrics(TimeStampedModel):
             filter_args['date_for__lt'] = date_for
         return cls.objects.filter(**filter_args).order_by('-date_for').first()
 
+    @classmethod
+    def latest_for_courses(cls, course_ids):
+        """
+        Get the most recent record for each of the courses
+
+        Returns a dict of course id strings to the course's most recent record,
+        or ``None`` if the course has no records. Uses one query regardless of
+        the number of courses, which only loads the latest records
+        """
+        course_ids = [str(course_id) for course_id in course_ids]
+        latest_date_for = cls.objects.filter(course_id=OuterRef('course_id')).order_by(
+            '-date_for').values('date_for')[:1]
+        latest = dict((course_id, None) for course_id in course_ids)
+        for rec in cls.objects.filter(course_id__in=course_ids,
+                                      date_for=Subquery(latest_date_for)):
+            latest[rec.course_id] = rec
+        return latest
+
 
 @python_2_unicode_compatible
 class SiteDailyMetrics(TimeStampedModel):
@@ -172,6 +222,65 @@ class SiteMonthlyMetrics(TimeStampedModel):
                                                            month_for=month_for,
                                                            defaults=defaults)
 
+    @classmethod
+    def add_months(cls, site, active_user_counts, overwrite=False):
+        """Bulk version of ``add_month``
+
+        ``active_user_counts`` maps the first day of each month to the active
+        user count. Existing records are only updated if ``overwrite`` is true
+
+        Returns a dict of the lists of months created, updated and skipped
+        """
+        existing = dict(SiteMonthlyMetrics.objects.filter(
+            site=site,
+            month_for__in=list(active_user_counts.keys())).values_list('month_for', 'id'))
+        new_months = sorted(month_for for month_for in active_user_counts
+                            if month_for not in existing)
+        old_months = sorted(month_for for month_for in active_user_counts
+                            if month_for in existing)
+        with transaction.atomic():
+            SiteMonthlyMetrics.objects.bulk_create([
+                SiteMonthlyMetrics(site=site,
+                                   month_for=month_for,
+                                   active_user_count=active_user_counts[month_for])
+                for month_for in new_months])
+            if overwrite:
+                bulk_update_field(SiteMonthlyMetrics, 'active_user_count', {
+                    existing[month_for]: active_user_counts[month_for]
+                    for month_for in old_months})
+        return dict(created=new_months,
+                    updated=old_months if overwrite else [],
+                    skipped=[] if overwrite else old_months)
+
+
+@python_2_unicode_compatible
+class CourseMonthlyMetrics(TimeStampedModel):
+    """
+    Stores the monthly metrics for a course
+
+    The values are rolled up from the month's CourseDailyMetrics records,
+    except ``active_users``, which is the number of distinct users with
+    courseware activity in the course that month. The daily pipeline updates
+    the record for the month it runs for
+    """
+    site = models.ForeignKey(Site)
+    course_id = models.CharField(max_length=255)
+    # Month for which this record's data are collected. Always the first day
+    month_for = models.DateField()
+    active_users = models.IntegerField()
+    course_enrollments = models.IntegerField()
+    num_learners_completed = models.IntegerField()
+    avg_days_to_complete = models.IntegerField()
+    avg_progress = models.DecimalField(max_digits=3, decimal_places=2)
+
+    class Meta:
+        ordering = ['-month_for', 'course_id']
+        unique_together = ['site', 'course_id', 'month_for']
+
+    def __str__(self):
+        return "id:{}, month_for:{}, course_id:{}".format(
+            self.id, self.month_for, self.course_id)
+
 
 class LearnerCourseGradeMetricsManager(models.Manager):
     """Custom model manager for LearnerCourseGrades model
@@ -180,6 +289,31 @@ class LearnerCourseGradeMetricsManager(models.Manager):
         queryset = self.filter(user=user, course_id=str(course_id))
         return queryset.order_by('-date_for').first()   # pylint: disable=no-member
 
+    def most_recent_for_learners(self, user_ids):
+        """Returns a dict of (user id, course id string) to the learner's most
+        recent record for the course, for all the courses of the given users
+
+        Uses one query regardless of the number of users and courses, which
+        only loads each (user, course) pair's latest record
+        """
+        latest_date_for = self.filter(  # pylint: disable=no-member
+            user_id=OuterRef('user_id'),
+            course_id=OuterRef('course_id')).order_by('-date_for').values('date_for')[:1]
+        records = self.filter(  # pylint: disable=no-member
+            user_id__in=user_ids, date_for=Subquery(latest_date_for)).order_by()
+        return {(rec.user_id, rec.course_id): rec for rec in records}
+
+    def most_recent_for_course(self, course_id, date_for):
+        """Returns a dict of user id to the learner's most recent record on or
+        before ``date_for`` for the course
+        """
+        queryset = self.filter(course_id=str(course_id), date_for__lte=date_for)
+        latest_date_for = queryset.filter(  # pylint: disable=no-member
+            user_id=OuterRef('user_id')).order_by('-date_for').values('date_for')[:1]
+        records = queryset.filter(  # pylint: disable=no-member
+            date_for=Subquery(latest_date_for)).order_by()
+        return {rec.user_id: rec for rec in records}
+
 
 @python_2_unicode_compatible
 class LearnerCourseGradeMetrics(TimeStampedModel):
@@ -310,7 +444,9 @@ class SiteMauMetricsManager(models.Manager):
         """Return the latest record for the given site, month, and year
         If no record found, returns 'None'
         """
-        queryset = self.filter(site=site, date_for__year=year, date_for__month=month)
+        queryset = self.filter(
+            site=site,
+            **window_filter('date_for', month_window((year, month), dates=True)))
         return queryset.order_by('-modified').first()  # pylint: disable=no-member
 
 
@@ -358,8 +494,7 @@ class CourseMauMetricsManager(models.Manager):
         queryset = self.filter(
             site=site,
             course_id=course_id,
-            date_for__year=year,
-            date_for__month=month,
+            **window_filter('date_for', month_window((year, month), dates=True))
         )
         return queryset.order_by('-modified').first()  # pylint: disable=no-member
 
@@ -394,9 +529,196 @@ class CourseMauMetrics(BaseDateMetricsModel):
                                                          defaults=dict(
                                                             mau=data['mau']))
 
+    @classmethod
+    def save_metrics_bulk(cls, site, course_maus, overwrite=False):
+        """Bulk version of ``save_metrics``
+
+        ``course_maus`` maps (course id string, date_for) tuples to the MAU
+        count. Existing records are only updated if ``overwrite`` is true
+
+        Returns a dict of the lists of keys created, updated and skipped
+        """
+        existing = {}
+        if course_maus:
+            existing = dict(
+                ((course_id, date_for), pk) for pk, course_id, date_for in
+                CourseMauMetrics.objects.filter(  # pylint: disable=no-member
+                    site=site,
+                    course_id__in=set(key[0] for key in course_maus),
+                    date_for__in=set(key[1] for key in course_maus),
+                    ).values_list('id', 'course_id', 'date_for'))
+        new_keys = sorted(key for key in course_maus if key not in existing)
+        old_keys = sorted(key for key in course_maus if key in existing)
+        with transaction.atomic():
+            CourseMauMetrics.objects.bulk_create([
+                CourseMauMetrics(site=site,
+                                 course_id=course_id,
+                                 date_for=date_for,
+                                 mau=course_maus[(course_id, date_for)])
+                for course_id, date_for in new_keys])
+            if overwrite:
+                bulk_update_field(CourseMauMetrics, 'mau', {
+                    existing[key]: course_maus[key] for key in old_keys})
+        return dict(created=new_keys,
+                    updated=old_keys if overwrite else [],
+                    skipped=[] if overwrite else old_keys)
+
     def __str__(self):
         return '{}, {}, {}, {}, {}'.format(self.id,
                                            self.site.domain,
                                            self.course_id,
                                            self.date_for,
                                            self.mau)
+
+
+@python_2_unicode_compatible
+class PipelineSiteRun(TimeStampedModel):
+    """Tracks a daily metrics pipeline run for a site and date
+
+    The course runs for the site are tracked in ``PipelineCourseRun``. When the
+    last course run finishes, ``finished_course_count`` reaches ``course_count``
+    and the site daily metrics are populated. ``site_metrics_status`` records
+    the progress of that step so that it runs exactly once per site run.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        )
+
+    site = models.ForeignKey(Site)
+    date_for = models.DateField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    site_metrics_status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    course_count = models.IntegerField(default=0)
+    finished_course_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('site', 'date_for',)
+        ordering = ['-date_for', 'site']
+
+    def __str__(self):
+        return '{}, {}, {}, {}'.format(self.id,
+                                       self.site.domain,
+                                       self.date_for,
+                                       self.status)
+
+
+@python_2_unicode_compatible
+class PipelineCourseRun(TimeStampedModel):
+    """Tracks a course's daily metrics pipeline run within a site run
+    """
+    site_run = models.ForeignKey(PipelineSiteRun, related_name='course_runs')
+    course_id = models.CharField(max_length=255)
+    status = models.CharField(max_length=16,
+                              choices=PipelineSiteRun.STATUS_CHOICES,
+                              default=PipelineSiteRun.PENDING)
+
+    class Meta:
+        unique_together = ('site_run', 'course_id',)
+
+    def __str__(self):
+        return '{}, {}, {}'.format(self.id, self.course_id, self.status)
+
+
+class ActiveUserBitmapManager(models.Manager):
+    """Custom model manager for the ActiveUserBitmap model
+    """
+    def bitmap_for_window(self, site, start_date, end_date, course_id=''):
+        """Returns the bitmap of the users active in the site, or the course if
+        ``course_id`` is given, from ``start_date`` through ``end_date``
+        """
+        bitmap = 0
+        records = self.filter(site=site,  # pylint: disable=no-member
+                              course_id=str(course_id),
+                              date_for__gte=start_date,
+                              date_for__lte=end_date).values_list('bitmap', flat=True)
+        for data in records.iterator():
+            bitmap |= decode_bitmap(data)
+        return bitmap
+
+
+@python_2_unicode_compatible
+class ActiveUserBitmap(TimeStampedModel):
+    """Stores the ids of the users active in a site or course for a day
+
+    The user ids are stored as a compressed bitmap. See ``figures.bitmaps``.
+    Site records have an empty ``course_id``. A site record is stored for each
+    day the pipeline has run, and course records only for courses with
+    activity that day
+    """
+    site = models.ForeignKey(Site)
+    course_id = models.CharField(max_length=255, blank=True, default='')
+    date_for = models.DateField()
+    user_count = models.IntegerField()
+    bitmap = models.BinaryField()
+    objects = ActiveUserBitmapManager()
+
+    class Meta:
+        unique_together = ('site', 'course_id', 'date_for',)
+        ordering = ['-date_for']
+
+    @classmethod
+    def from_user_ids(cls, site, course_id, date_for, user_ids):
+        """Returns an unsaved record for the user ids
+        """
+        bitmap = user_ids_to_bitmap(user_ids)
+        return cls(site=site,
+                   course_id=str(course_id),
+                   date_for=date_for,
+                   user_count=bitmap_count(bitmap),
+                   bitmap=encode_bitmap(bitmap))
+
+    @property
+    def user_ids(self):
+        return bitmap_to_user_ids(decode_bitmap(self.bitmap))
+
+    def __str__(self):
+        return '{}, {}, {}, {}, {}'.format(self.id,
+                                           self.site.domain,
+                                           self.course_id,
+                                           self.date_for,
+                                           self.user_count)
+
+
+@python_2_unicode_compatible
+class SiteEverActiveUsers(TimeStampedModel):
+    """Stores the ids of all the users ever active in a site through a date
+
+    The user ids are stored as a compressed bitmap. See ``figures.bitmaps``.
+    The daily pipeline adds the users active since ``activity_through``, the
+    latest StudentModule ``modified`` time already in the set, so
+    ``user_count`` is the distinct cumulative active user count through
+    ``date_for``
+    """
+    site = models.OneToOneField(Site)
+    date_for = models.DateField()
+    activity_through = models.DateTimeField(null=True, blank=True)
+    user_count = models.IntegerField()
+    bitmap = models.BinaryField()
+
+    def set_bitmap(self, bitmap):
+        self.bitmap = encode_bitmap(bitmap)
+        self.user_count = bitmap_count(bitmap)
+
+    def get_bitmap(self):
+        return decode_bitmap(self.bitmap)
+
+    def __str__(self):
+        return '{}, {}, {}, {}'.format(self.id,
+                                       self.site.domain,
+                                       self.date_for,
+                                       self.user_count)
+
+
+# Connect the Figures signal handlers. Imported here rather than in an
+# AppConfig.ready method so that the handlers are connected however Figures is
+# added to INSTALLED_APPS
+import figures.signals  # noqa: E402,F401 pylint: disable=wrong-import-position,unused-import
@@ -2,7 +2,10 @@
 
 '''
 
-from rest_framework.pagination import LimitOffsetPagination
+from collections import OrderedDict
+
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
 
 
 class FiguresLimitOffsetPagination(LimitOffsetPagination):
@@ -15,3 +18,68 @@ class FiguresKiloPagination(LimitOffsetPagination):
     '''Custom Figures paginator to make the number of records returned consistent
     '''
     default_limit = 1000
+
+
+class FiguresCursorPagination(CursorPagination):
+    '''Cursor paginator ordered on the primary key
+
+    Each page is retrieved with a keyset query on the primary key index, so
+    walking through all the records takes linear time however deep the page.
+    The total count is not retrieved unless the ``count`` query parameter is
+    true
+
+    An empty ``cursor`` query parameter returns the first page. The ``limit``
+    query parameter sets the page size, as it does for the limit offset
+    paginators
+    '''
+    ordering = ('id',)
+    page_size = FiguresLimitOffsetPagination.default_limit
+    page_size_query_param = 'limit'
+    max_page_size = FiguresKiloPagination.default_limit
+    count_query_param = 'count'
+    count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+        return super(FiguresCursorPagination, self).paginate_queryset(
+            queryset, request, view=view)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        '''Always orders on the primary key
+
+        The ordering filter of the view is not used as the ordering must be on
+        a unique, indexed key
+        '''
+        # ``paginate_queryset`` replaces the instance ``ordering``
+        return type(self).ordering
+
+    def decode_cursor(self, request):
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        return super(FiguresCursorPagination, self).decode_cursor(request)
+
+    def get_paginated_response(self, data):
+        response_data = OrderedDict()
+        if self.count is not None:
+            response_data['count'] = self.count
+        response_data['next'] = self.get_next_link()
+        response_data['previous'] = self.get_previous_link()
+        response_data['results'] = data
+        return Response(response_data)
+
+
+class FiguresKiloCursorPagination(FiguresCursorPagination):
+    '''Cursor paginator with the same default page size as FiguresKiloPagination
+    '''
+    page_size = FiguresKiloPagination.default_limit
@@ -0,0 +1,83 @@
+"""Populates the ActiveUserBitmap model
+
+Users are active in a course on a day if they have a StudentModule record for
+the course modified that day. The site's active users are the site's users
+with a StudentModule record modified that day, the same user set
+``figures.metrics.get_active_users_for_time_period`` counts
+
+Only completed days are stored, so a stored day is never a partial snapshot
+"""
+
+from collections import defaultdict
+import datetime
+import logging
+
+from django.db import transaction
+from django.utils.timezone import utc
+
+from courseware.models import StudentModule  # pylint: disable=import-error
+
+from figures.helpers import as_date, day_window, window_filter
+from figures.models import ActiveUserBitmap
+from figures.sites import get_course_keys_for_site, get_user_ids_for_site
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_active_user_ids_by_course(site, date_for):
+    """Returns a dict of course id strings to the sets of ids of the site's
+    users active in the course on the date
+
+    Uses a single query. Courses without activity are not included
+    """
+    student_modules = StudentModule.objects.filter(
+        student_id__in=get_user_ids_for_site(site),
+        **window_filter('modified', day_window(date_for)))
+    user_ids = defaultdict(set)
+    for course_id, user_id in student_modules.order_by().values_list(
+            'course_id', 'student_id').distinct():
+        user_ids[str(course_id)].add(user_id)
+    return user_ids
+
+
+def load_active_user_bitmaps(site, date_for, force_update=False):
+    """Stores the active user bitmaps for the site and each of its courses with
+    activity on the date
+
+    If the site record for the date exists, nothing is done unless
+    ``force_update`` is true, in which case the date's records are replaced.
+    Site records cover the activity of the site's users in any course, while
+    course records are only stored for the site's courses
+
+    Returns the site ``ActiveUserBitmap`` record, or ``None`` if the date has
+    not ended yet (UTC)
+    """
+    date_for = as_date(date_for)
+    if date_for >= datetime.datetime.utcnow().replace(tzinfo=utc).date():
+        logger.info('Not storing active user bitmaps for site id={} for {}, which has '
+                    'not ended'.format(site.id, date_for))
+        return None
+    existing = ActiveUserBitmap.objects.filter(site=site, date_for=date_for)
+    if not force_update:
+        site_record = existing.filter(course_id='').first()  # pylint: disable=no-member
+        if site_record:
+            return site_record
+
+    course_user_ids = get_active_user_ids_by_course(site=site, date_for=date_for)
+    site_course_ids = set(str(course_key) for course_key in get_course_keys_for_site(site))
+    site_record = ActiveUserBitmap.from_user_ids(
+        site=site,
+        course_id='',
+        date_for=date_for,
+        user_ids=set().union(*course_user_ids.values()))
+    records = [site_record] + [
+        ActiveUserBitmap.from_user_ids(site=site,
+                                       course_id=course_id,
+                                       date_for=date_for,
+                                       user_ids=user_ids)
+        for course_id, user_ids in course_user_ids.items() if course_id in site_course_ids]
+    with transaction.atomic():
+        existing.delete()  # pylint: disable=no-member
+        ActiveUserBitmap.objects.bulk_create(records)
+    return site_record
@@ -15,18 +15,28 @@ import datetime
 from decimal import Decimal
 import logging
 
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Count, Max
 from django.utils.timezone import utc
 
 from courseware.models import StudentModule  # pylint: disable=import-error
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview  # noqa pylint: disable=import-error
 from student.models import CourseEnrollment  # pylint: disable=import-error
-from student.roles import CourseCcxCoachRole, CourseInstructorRole, CourseStaffRole  # noqa pylint: disable=import-error
 
-from figures.helpers import as_course_key, as_datetime, next_day, prev_day
+from figures.helpers import (
+    as_course_key,
+    as_date,
+    as_datetime,
+    day_window,
+    next_day,
+    prev_day,
+    use_incremental_learner_grades,
+    window_filter,
+)
 import figures.metrics
-from figures.models import CourseDailyMetrics, PipelineError
-from figures.pipeline.logger import log_error
+from figures.models import CourseDailyMetrics, LearnerCourseGradeMetrics, PipelineError
+from figures.pipeline.logger import log_error, log_error_to_db
 import figures.pipeline.loaders
 from figures.serializers import CourseIndexSerializer
 from figures.compat import GeneratedCertificate
@@ -35,61 +45,130 @@ import figures.sites
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of courses retrieved in each set of grouped queries when
+# extracting metrics for a whole site
+SITE_COURSE_BATCH_SIZE = 500
+
 
 # Extraction helper methods
 
 
-def get_enrolled_in_exclude_admins(course_id, date_for=None):
+def get_enrolled_in_exclude_admins(course_id, date_for=None, admin_user_ids=None):
     """
     Copied over from CourseEnrollmentManager.num_enrolled_in_exclude_admins method
     and modified to filter on date LT
 
     If no date is provided then the date is not used as a filter
 
+    ``admin_user_ids`` are the user ids of the course's staff, instructors and
+    CCX coaches, such as from ``figures.sites.get_course_admin_user_ids_for_site``.
+    If not provided, they are retrieved for the course.
     """
-    course_locator = as_course_key(course_id)
-
-    if getattr(course_id, 'ccx', None):
-        course_locator = course_id.to_course_locator()
+    if admin_user_ids is None:
+        course_key = as_course_key(course_id)
+        admin_user_ids = figures.sites.get_course_admin_user_ids(
+            [course_key]).get(str(course_key), set())
 
-    staff = CourseStaffRole(course_locator).users_with_role()
-    admins = CourseInstructorRole(course_locator).users_with_role()
-    coaches = CourseCcxCoachRole(course_locator).users_with_role()
     filter_args = dict(course_id=course_id, is_active=1)
 
     if date_for:
         filter_args.update(dict(created__lt=as_datetime(next_day(date_for))))
 
     return CourseEnrollment.objects.filter(**filter_args).exclude(
-        user__in=staff).exclude(user__in=admins).exclude(user__in=coaches)
+        user_id__in=admin_user_ids)
 
 
 def get_active_learner_ids_today(course_id, date_for):
     """Get unique user ids for learners who are active today for the given
     course and date
-
-    Note: When Figures no longer has to support Django 1.8, we can simplify
-    this date check:
-        https://docs.djangoproject.com/en/1.9/ref/models/querysets/#date
     """
-    date_for_as_datetime = as_datetime(date_for)
     return StudentModule.objects.filter(
         course_id=as_course_key(course_id),
-        modified__year=date_for_as_datetime.year,
-        modified__month=date_for_as_datetime.month,
-        modified__day=date_for_as_datetime.day,
+        **window_filter('modified', day_window(date_for))
         ).values_list('student__id', flat=True).distinct()
 
 
+def get_learner_last_activity(course_id, date_for, since=None):
+    """Returns a dict of user id to the learner's most recent StudentModule
+    modified timestamp for the course, up to the end of ``date_for``
+
+    If ``since`` is given, only the learners active after ``since`` are
+    returned, so only the recent StudentModule records are read
+    """
+    filter_args = dict(course_id=as_course_key(course_id),
+                       modified__lt=as_datetime(next_day(date_for)))
+    if since is not None:
+        filter_args['modified__gt'] = since
+    return dict(StudentModule.objects.filter(**filter_args).order_by().values(
+        'student_id').annotate(
+            last_modified=Max('modified')).values_list('student_id', 'last_modified'))
+
+
+def get_reusable_learner_course_grades(course_id, date_for):
+    """Returns a dict of user id to LearnerCourseGradeMetrics records that are
+    still current for ``date_for``
+
+    A learner's most recent record is current if the learner has no
+    StudentModule activity in the course after the record was saved.
+    """
+    snapshots = LearnerCourseGradeMetrics.objects.most_recent_for_course(
+        course_id=course_id, date_for=date_for)
+    if not snapshots:
+        return {}
+    # Learners without activity after the oldest snapshot are all current
+    last_activity = get_learner_last_activity(
+        course_id, date_for, since=min(rec.modified for rec in snapshots.values()))
+    return {user_id: rec for user_id, rec in snapshots.items()
+            if user_id not in last_activity or last_activity[user_id] <= rec.modified}
+
+
+def flush_learner_course_grades(writer, course_id, full_only=False):
+    """Writes the learner course grades buffered in ``writer``
+
+    A failed write is logged against the course. The progress of the learners
+    in the failed batch is still used for the course's average progress
+
+    If ``full_only`` is true, the grades are only written if the writer's
+    buffer is full
+    """
+    try:
+        if full_only:
+            writer.flush_if_full()
+        else:
+            writer.flush()
+    except Exception as e:  # pylint: disable=broad-except
+        log_error(
+            error_data=dict(msg='Unable to save learner course grades',
+                            course_id=str(course_id),
+                            exception=str(e)),
+            error_type=PipelineError.GRADES_DATA,
+            course_id=course_id,
+            )
+
+
 def get_average_progress(course_id, date_for, course_enrollments):
     """Collects and aggregates raw course grades data
+
+    If incremental learner grades are enabled (see
+    ``figures.helpers.use_incremental_learner_grades``), grades are only read
+    for learners who have been active since their last grades snapshot
     """
+    if use_incremental_learner_grades():
+        reusable = get_reusable_learner_course_grades(course_id, date_for)
+    else:
+        reusable = {}
+    writer = figures.pipeline.loaders.LearnerCourseGradesWriter(
+        site=figures.sites.get_site_for_course(course_id))
     progress = []
     for ce in course_enrollments:
+        if ce.user_id in reusable:
+            lcgm = reusable[ce.user_id]
+            progress.append(dict(progress_percent=lcgm.progress_percent,
+                                 course_progress_details=lcgm.progress_details))
+            continue
         try:
             course_progress = figures.metrics.LearnerCourseGrades.course_progress(ce)
-            figures.pipeline.loaders.save_learner_course_grades(
-                site=figures.sites.get_site_for_course(course_id),
+            writer.add(
                 date_for=date_for,
                 course_enrollment=ce,
                 course_progress_details=course_progress['course_progress_details'])
@@ -112,6 +191,11 @@ def get_average_progress(course_id, date_for, course_enrollments):
                 course_progress_details=None)
         if course_progress:
             progress.append(course_progress)
+        flush_learner_course_grades(writer, course_id, full_only=True)
+
+    flush_learner_course_grades(writer, course_id)
+    logger.info('Learner course grades for course {}: created={}, updated={}'.format(
+        course_id, writer.created, writer.updated))
 
     if progress:
         progress_percent = [rec['progress_percent'] for rec in progress]
@@ -131,8 +215,13 @@ def get_days_to_complete(course_id, date_for):
     * This means if a learner starts at midnight and finished just before
       midnight, then 0 days will be given
 
-    NOTE: This has limited scaling. We ought to test it with
-    1k, 10k, 100k cert records
+    Certificates and enrollments are retrieved together with a single query
+    that joins each certificate to the learner's enrollment(s) in the course.
+    Learners with more than one enrollment record for the course are reported
+    in the errors list and their earliest enrollment is used. Certificates
+    without a matching enrollment are skipped.
+
+    See ``tests/benchmarks`` for the 1k, 10k, 100k certificate benchmark
 
     TODO: change to use start_date, end_date with defaults that
     start_date is open and end_date is today
@@ -140,28 +229,37 @@ def get_days_to_complete(course_id, date_for):
     TODO: Consider collecting the total seconds rather than days
     This will improve accuracy, but may actually not be that important
     TODO: Analyze the error based on number of completions
-
-    When we have to support scale, we can look into optimization
-    techinques.
     """
-    certificates = GeneratedCertificate.objects.filter(
-        course_id=as_course_key(course_id),
-        created_date__lte=as_datetime(date_for))
+    course_key = as_course_key(course_id)
+    rows = CourseEnrollment.objects.filter(
+        course_id=course_key,
+        user__generatedcertificate__course_id=course_key,
+        user__generatedcertificate__created_date__lte=as_datetime(date_for),
+        ).order_by(
+            'user__generatedcertificate__id', 'created',
+        ).values_list(
+            'user__generatedcertificate__id',
+            'user_id',
+            'created',
+            'user__generatedcertificate__created_date',
+        )
 
     days = []
     errors = []
-    for cert in certificates:
-        ce = CourseEnrollment.objects.filter(
-            course_id=as_course_key(course_id),
-            user=cert.user)
-        # How do we want to handle multiples?
-        if ce.count() > 1:
-            errors.append(
-                dict(msg='Multiple CE records',
-                     course_id=course_id,
-                     user_id=cert.user.id,
-                     ))
-        days.append((cert.created_date - ce[0].created).days)
+    prev_cert_id = None
+    for cert_id, user_id, enrollment_created, cert_created in rows:
+        if cert_id == prev_cert_id:
+            # How do we want to handle multiples?
+            # Report each learner once and keep the earliest enrollment
+            if not errors or errors[-1]['user_id'] != user_id:
+                errors.append(
+                    dict(msg='Multiple CE records',
+                         course_id=course_id,
+                         user_id=user_id,
+                         ))
+            continue
+        prev_cert_id = cert_id
+        days.append((cert_created - enrollment_created).days)
     return dict(days=days, errors=errors)
 
 
@@ -189,6 +287,80 @@ def get_num_learners_completed(course_id, date_for):
         created_date__lt=as_datetime(next_day(date_for)))
     return certificates.count()
 
+
+# Site level extraction helper methods
+#
+# These retrieve data for a batch of courses with one grouped query per metric
+# instead of one query per course. Each returns a dict keyed by the course id
+# string
+
+
+def get_enrollment_counts(course_keys, date_for, admin_user_ids):
+    """Returns the active enrollment counts, excluding course admins, for the
+    given courses
+
+    ``admin_user_ids`` is the dict returned by
+    ``figures.sites.get_course_admin_user_ids``
+    """
+    enrollments = CourseEnrollment.objects.filter(
+        course_id__in=course_keys,
+        is_active=1,
+        created__lt=as_datetime(next_day(date_for)))
+    counts = dict((str(course_key), 0) for course_key in course_keys)
+    for rec in enrollments.values('course_id').order_by().annotate(
+            count=Count('id')):
+        counts[str(rec['course_id'])] = rec['count']
+
+    # Subtract the admins who are also enrolled in their own courses
+    all_admin_user_ids = set().union(*admin_user_ids.values())
+    if all_admin_user_ids:
+        admin_enrollments = enrollments.filter(
+            user_id__in=all_admin_user_ids).values_list('course_id', 'user_id')
+        for course_id, user_id in admin_enrollments:
+            if user_id in admin_user_ids.get(str(course_id), ()):
+                counts[str(course_id)] -= 1
+    return counts
+
+
+def get_active_learner_counts_today(course_keys, date_for):
+    """Returns the number of distinct learners active on ``date_for`` for each
+    of the given courses
+    """
+    student_modules = StudentModule.objects.filter(
+        course_id__in=course_keys,
+        **window_filter('modified', day_window(date_for)))
+    counts = dict((str(course_key), 0) for course_key in course_keys)
+    for rec in student_modules.values('course_id').order_by().annotate(
+            count=Count('student_id', distinct=True)):
+        counts[str(rec['course_id'])] = rec['count']
+    return counts
+
+
+def get_num_learners_completed_counts(course_keys, date_for):
+    """Returns the number of certificates created on or before ``date_for`` for
+    each of the given courses
+    """
+    certificates = GeneratedCertificate.objects.filter(
+        course_id__in=course_keys,
+        created_date__lt=as_datetime(next_day(date_for)))
+    counts = dict((str(course_key), 0) for course_key in course_keys)
+    for rec in certificates.values('course_id').order_by().annotate(
+            count=Count('id')):
+        counts[str(rec['course_id'])] = rec['count']
+    return counts
+
+
+def course_daily_metrics_defaults(data):
+    """Returns the CourseDailyMetrics field values for the extracted ``data``
+    """
+    return dict(
+        enrollment_count=data['enrollment_count'],
+        active_learners_today=data['active_learners_today'],
+        average_progress=str(data['average_progress']),
+        average_days_to_complete=int(round(data['average_days_to_complete'])),
+        num_learners_completed=data['num_learners_completed'],
+    )
+
 # Formal extractor classes
 
 
@@ -216,7 +388,7 @@ class CourseDailyMetricsExtractor(object):
     BUT, we will then need to find a transform
     """
 
-    def extract(self, course_id, date_for=None, **_kwargs):
+    def extract(self, course_id, date_for=None, site=None, **_kwargs):
         """
             defaults = dict(
                 enrollment_count=data['enrollment_count'],
@@ -237,8 +409,15 @@ class CourseDailyMetricsExtractor(object):
         # set of calls defined in a ruleset instead of hardcoded here after
         # retrieving the core quersets
 
+        # Use the site's cached course admins so the site's course roles are
+        # only queried once per pipeline run
+        if site:
+            admin_user_ids = figures.sites.get_course_admin_user_ids_for_site(
+                site).get(str(course_id), set())
+        else:
+            admin_user_ids = None
         course_enrollments = get_enrolled_in_exclude_admins(
-            course_id, date_for,)
+            course_id, date_for, admin_user_ids=admin_user_ids)
 
         data = dict(date_for=date_for, course_id=course_id)
 
@@ -276,7 +455,8 @@ class CourseDailyMetricsLoader(object):
     def get_data(self, date_for):
         return self.extractor.extract(
             course_id=self.course_id,
-            date_for=date_for)
+            date_for=date_for,
+            site=self.site)
 
     @transaction.atomic
     def save_metrics(self, date_for, data):
@@ -291,13 +471,7 @@ class CourseDailyMetricsLoader(object):
             course_id=self.course_id,
             site=self.site,
             date_for=date_for,
-            defaults=dict(
-                enrollment_count=data['enrollment_count'],
-                active_learners_today=data['active_learners_today'],
-                average_progress=str(data['average_progress']),
-                average_days_to_complete=int(round(data['average_days_to_complete'])),
-                num_learners_completed=data['num_learners_completed'],
-            )
+            defaults=course_daily_metrics_defaults(data)
         )
         cdm.clean_fields()
         return (cdm, created,)
@@ -334,3 +508,168 @@ class CourseDailyMetricsLoader(object):
 
         data = self.get_data(date_for=date_for)
         return self.save_metrics(date_for=date_for, data=data)
+
+
+class SiteCourseDailyMetricsExtractor(object):
+    """
+    Extracts CourseDailyMetrics data for all the courses in a site
+
+    Enrollment counts, active learners and completions are retrieved for a
+    batch of courses at a time with grouped queries. Average progress and
+    average days to complete are still collected per course.
+
+    Use this instead of ``CourseDailyMetricsExtractor`` when populating many
+    courses. ``CourseDailyMetricsExtractor`` remains the per-course fallback
+    """
+
+    def __init__(self, batch_size=SITE_COURSE_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def extract(self, site, course_keys, date_for, **_kwargs):
+        """Returns a list of dicts, one for each course successfully extracted
+
+        Each dict has the same keys as ``CourseDailyMetricsExtractor.extract``
+        returns. Courses that fail are logged to the pipeline error log and
+        left out of the results
+        """
+        course_keys = [as_course_key(course_key) for course_key in course_keys]
+        results = []
+        for i in range(0, len(course_keys), self.batch_size):
+            results += self.extract_batch(
+                site=site,
+                course_keys=course_keys[i:i + self.batch_size],
+                date_for=date_for)
+        return results
+
+    def extract_batch(self, site, course_keys, date_for):
+        admin_user_ids = figures.sites.get_course_admin_user_ids(course_keys)
+        enrollment_counts = get_enrollment_counts(
+            course_keys, date_for, admin_user_ids)
+        active_learner_counts = get_active_learner_counts_today(
+            course_keys, date_for)
+        completed_counts = get_num_learners_completed_counts(
+            course_keys, date_for)
+
+        results = []
+        for course_key in course_keys:
+            course_id = str(course_key)
+            try:
+                course_enrollments = CourseEnrollment.objects.filter(
+                    course_id=course_key,
+                    is_active=1,
+                    created__lt=as_datetime(next_day(date_for)),
+                    ).exclude(user_id__in=admin_user_ids.get(course_id, []))
+                results.append(dict(
+                    date_for=date_for,
+                    course_id=course_id,
+                    enrollment_count=enrollment_counts[course_id],
+                    active_learners_today=active_learner_counts[course_id],
+                    average_progress=get_average_progress(
+                        course_key, date_for, course_enrollments,),
+                    average_days_to_complete=get_average_days_to_complete(
+                        course_key, date_for,),
+                    num_learners_completed=completed_counts[course_id],
+                ))
+            except Exception as e:  # pylint: disable=broad-except
+                log_error_to_db(
+                    error_data=dict(
+                        date_for=date_for,
+                        msg='Unable to extract site course daily metrics',
+                        exception_class=e.__class__.__name__,
+                        exception=str(e),
+                        ),
+                    error_type=PipelineError.COURSE_DATA,
+                    course_id=course_id,
+                    site=site,
+                    )
+                logger.exception(
+                    'Unable to extract course daily metrics for "{}"'.format(
+                        course_id))
+        return results
+
+
+class SiteCourseDailyMetricsLoader(object):
+    """
+    Populates CourseDailyMetrics for all the courses in a site
+
+    Existing records are looked up in a single query, new records are written
+    with ``bulk_create`` and, with ``force_update``, existing records are
+    updated in place
+    """
+
+    def __init__(self, site, extractor=None):
+        self.site = site
+        self.extractor = extractor or SiteCourseDailyMetricsExtractor()
+
+    def load(self, date_for=None, force_update=False, course_keys=None, **_kwargs):
+        """
+        If ``course_keys`` is not provided, then all the courses in the site are
+        loaded
+
+        Returns a dict of lists of the course id strings that were created,
+        updated, skipped because a record already exists, and failed
+        """
+        if date_for:
+            date_for = as_date(date_for)
+        else:
+            date_for = prev_day(
+                datetime.datetime.utcnow().replace(tzinfo=utc).date())
+        if course_keys is None:
+            course_keys = figures.sites.get_course_keys_for_site(self.site)
+        course_ids = [str(course_key) for course_key in course_keys]
+
+        existing = dict(CourseDailyMetrics.objects.filter(
+            course_id__in=course_ids,
+            date_for=date_for).values_list('course_id', 'id'))
+        results = dict(created=[], updated=[], skipped=[], failed=[])
+
+        if force_update:
+            to_extract = course_ids
+        else:
+            results['skipped'] = [cid for cid in course_ids if cid in existing]
+            to_extract = [cid for cid in course_ids if cid not in existing]
+
+        extracted = self.extractor.extract(site=self.site,
+                                           course_keys=to_extract,
+                                           date_for=date_for)
+        new_records = []
+        updates = []
+        for data in extracted:
+            cdm = CourseDailyMetrics(
+                site=self.site,
+                date_for=date_for,
+                course_id=data['course_id'],
+                **course_daily_metrics_defaults(data))
+            try:
+                cdm.clean_fields()
+            except ValidationError as e:
+                log_error(
+                    error_data=dict(
+                        date_for=date_for,
+                        msg='Invalid course daily metrics',
+                        message_dict=e.message_dict,
+                        ),
+                    error_type=PipelineError.COURSE_DATA,
+                    course_id=data['course_id'],
+                    site=self.site,
+                    )
+                continue
+            if data['course_id'] in existing:
+                updates.append(data)
+            else:
+                new_records.append(cdm)
+
+        with transaction.atomic():
+            CourseDailyMetrics.objects.bulk_create(new_records)
+            for data in updates:
+                CourseDailyMetrics.objects.filter(
+                    pk=existing[data['course_id']]).update(
+                        site=self.site,
+                        modified=datetime.datetime.utcnow().replace(tzinfo=utc),
+                        **course_daily_metrics_defaults(data))
+
+        results['created'] = [rec.course_id for rec in new_records]
+        results['updated'] = [data['course_id'] for data in updates]
+        loaded = set(results['created'] + results['updated'])
+        results['failed'] = [cid for cid in to_extract if cid not in loaded]
+        return results
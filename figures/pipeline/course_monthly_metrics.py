@@ -0,0 +1,95 @@
+"""Populates the CourseMonthlyMetrics model
+
+The course monthly metrics are rolled up from the month's CourseDailyMetrics
+records with one grouped query for all the site's courses. The active users
+come from one grouped StudentModule query. The values match those returned by
+``figures.metrics.get_month_course_metrics``
+"""
+
+from decimal import Decimal
+import math
+
+from django.db import transaction
+from django.db.models import Avg, Max
+
+from figures.helpers import as_date, month_window
+from figures.mau import get_mau_counts_by_course
+from figures.models import CourseDailyMetrics, CourseMonthlyMetrics, bulk_update_field
+from figures.sites import get_course_keys_for_site, get_student_modules_for_site
+
+
+COURSE_MONTHLY_METRICS_FIELDS = [
+    'active_users',
+    'course_enrollments',
+    'num_learners_completed',
+    'avg_days_to_complete',
+    'avg_progress',
+]
+
+
+def get_course_monthly_metrics_data(site, month_for, course_ids):
+    """Returns a dict of course id strings to dicts of the course monthly
+    metrics fields for the month
+    """
+    start_date, end_date = month_window(month_for, dates=True)
+    daily = dict(
+        (row['course_id'], row) for row in CourseDailyMetrics.objects.filter(
+            site=site,
+            course_id__in=course_ids,
+            date_for__gte=start_date,
+            date_for__lt=end_date).order_by().values('course_id').annotate(
+                course_enrollments=Max('enrollment_count'),
+                num_learners_completed=Max('num_learners_completed'),
+                avg_days_to_complete=Avg('average_days_to_complete'),
+                avg_progress=Avg('average_progress')))
+    active_users = get_mau_counts_by_course(
+        student_modules=get_student_modules_for_site(site),
+        year=start_date.year,
+        month=start_date.month)
+
+    data = {}
+    for course_id in course_ids:
+        row = daily.get(course_id, {})
+        avg_days_to_complete = row.get('avg_days_to_complete')
+        avg_progress = row.get('avg_progress')
+        data[course_id] = dict(
+            active_users=active_users.get(course_id, 0),
+            course_enrollments=row.get('course_enrollments') or 0,
+            num_learners_completed=row.get('num_learners_completed') or 0,
+            avg_days_to_complete=(int(math.ceil(avg_days_to_complete))
+                                  if avg_days_to_complete is not None else 0),
+            avg_progress=(Decimal(avg_progress).quantize(Decimal('.00'))
+                          if avg_progress is not None else Decimal('0.00')),
+        )
+    return data
+
+
+def load_course_monthly_metrics(site, month_for):
+    """Creates or updates the CourseMonthlyMetrics records for all the courses
+    in the site for the month of ``month_for``
+
+    Returns a dict with the number of records created and updated
+    """
+    month_for = as_date(month_for).replace(day=1)
+    course_ids = [str(course_key) for course_key in get_course_keys_for_site(site)]
+    data = get_course_monthly_metrics_data(site=site,
+                                           month_for=month_for,
+                                           course_ids=course_ids)
+    existing = dict(CourseMonthlyMetrics.objects.filter(
+        site=site,
+        month_for=month_for).values_list('course_id', 'id'))
+
+    with transaction.atomic():
+        CourseMonthlyMetrics.objects.bulk_create([
+            CourseMonthlyMetrics(site=site,
+                                 course_id=course_id,
+                                 month_for=month_for,
+                                 **values)
+            for course_id, values in data.items() if course_id not in existing])
+        for field_name in COURSE_MONTHLY_METRICS_FIELDS:
+            bulk_update_field(CourseMonthlyMetrics, field_name, {
+                existing[course_id]: values[field_name]
+                for course_id, values in data.items() if course_id in existing})
+
+    updated = len([course_id for course_id in data if course_id in existing])
+    return dict(created=len(data) - updated, updated=updated)
@@ -0,0 +1,124 @@
+"""Maintains the SiteEverActiveUsers model
+
+The set of users ever active in a site is updated each day with only the
+users active since the set's ``activity_through`` time, so the distinct cumulative active user
+count costs a query over the day's StudentModule activity instead of a scan of
+the site's whole history.
+
+``rebuild_ever_active_users`` builds the set from the site's history in one
+ordered pass over StudentModule, correcting the SiteDailyMetrics
+``cumulative_active_user_count`` values along the way.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models import Max
+
+from figures.bitmaps import user_ids_to_bitmap
+from figures.helpers import as_date, day_window, next_day, window_filter
+from figures.models import SiteDailyMetrics, SiteEverActiveUsers, bulk_update_field
+from figures.sites import get_student_modules_for_site
+
+
+logger = logging.getLogger(__name__)
+
+
+def update_ever_active_users(site, date_for):
+    """Adds the users active since the site's ever active set was last updated
+    through ``date_for``
+
+    The set records the latest StudentModule ``modified`` time it has added,
+    so activity after a run for a day that had not ended yet is added by the
+    next run
+
+    Returns the distinct cumulative active user count through ``date_for``.
+    Returns ``None`` if the site has no ever active set yet, or if the set is
+    already past ``date_for``, since the count can't be derived from it. Use
+    ``rebuild_ever_active_users`` in those cases
+    """
+    date_for = as_date(date_for)
+    with transaction.atomic():
+        ever_active = SiteEverActiveUsers.objects.select_for_update().filter(
+            site=site).first()
+        if not ever_active:
+            logger.info('No ever active users set for site id={}. Rebuild it with the '
+                        'rebuild_figures_ever_active_users command'.format(site.id))
+            return None
+        if ever_active.date_for > date_for:
+            logger.warning('Ever active users set for site id={} is for {}, after {}'.format(
+                site.id, ever_active.date_for, date_for))
+            return None
+
+        # Usually the activity since the previous run. Includes any days the
+        # pipeline missed since the set was last updated. Sets without a
+        # high-water mark start at the day after their date
+        if ever_active.activity_through:
+            window = (ever_active.activity_through, day_window(date_for)[1])
+        else:
+            window = (day_window(next_day(ever_active.date_for))[0], day_window(date_for)[1])
+        student_modules = get_student_modules_for_site(site).filter(
+            **window_filter('modified', window))
+        activity_through = student_modules.aggregate(
+            activity_through=Max('modified'))['activity_through']
+        if activity_through:
+            user_ids = student_modules.values_list('student_id', flat=True).distinct()
+            ever_active.set_bitmap(ever_active.get_bitmap() | user_ids_to_bitmap(user_ids))
+            ever_active.activity_through = activity_through
+        ever_active.date_for = date_for
+        ever_active.save()
+    return ever_active.user_count
+
+
+def rebuild_ever_active_users(site, date_for):
+    """Builds the site's ever active users set through ``date_for`` from the
+    site's StudentModule history
+
+    Makes one pass over the site's StudentModule records in ``modified`` order.
+    The site's SiteDailyMetrics ``cumulative_active_user_count`` values through
+    ``date_for`` are set to the distinct counts as of each record's date
+
+    Returns the ``SiteEverActiveUsers`` record
+    """
+    date_for = as_date(date_for)
+    student_modules = get_student_modules_for_site(site).filter(
+        modified__lt=day_window(date_for)[1])
+
+    user_ids = set()
+    daily_counts = []
+    current_day = None
+    modified = None
+    for user_id, modified in student_modules.order_by('modified').values_list(
+            'student_id', 'modified').iterator():
+        day = modified.date()
+        if day != current_day:
+            if current_day:
+                daily_counts.append((current_day, len(user_ids)))
+            current_day = day
+        user_ids.add(user_id)
+    if current_day:
+        daily_counts.append((current_day, len(user_ids)))
+
+    # Days without activity carry the previous day's count forward
+    cumulative_counts = {}
+    count_index = 0
+    count = 0
+    for sdm_date, sdm_id in SiteDailyMetrics.objects.filter(
+            site=site, date_for__lte=date_for).order_by('date_for').values_list(
+                'date_for', 'id'):
+        while count_index < len(daily_counts) and daily_counts[count_index][0] <= sdm_date:
+            count = daily_counts[count_index][1]
+            count_index += 1
+        cumulative_counts[sdm_id] = count
+
+    with transaction.atomic():
+        bulk_update_field(SiteDailyMetrics, 'cumulative_active_user_count',
+                          cumulative_counts)
+        ever_active = SiteEverActiveUsers.objects.filter(site=site).first()
+        if not ever_active:
+            ever_active = SiteEverActiveUsers(site=site)
+        ever_active.date_for = date_for
+        ever_active.activity_through = modified
+        ever_active.set_bitmap(user_ids_to_bitmap(user_ids))
+        ever_active.save()
+    return ever_active
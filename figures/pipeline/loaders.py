@@ -2,23 +2,51 @@
 
 """
 
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils.timezone import utc
+
+from figures.helpers import as_date
 from figures.models import LearnerCourseGradeMetrics
 
 
-def save_learner_course_grades(site, date_for, course_enrollment, course_progress_details):
-    """
+# Fields updated from ``course_progress_details`` data
+LEARNER_COURSE_GRADE_FIELDS = [
+    'points_possible',
+    'points_earned',
+    'sections_worked',
+    'sections_possible',
+]
 
-    ``course_progress_details`` data are the ``course_progress_details`` from the
-    ``LearnerCourseGrades.course_progress method``
+LEARNER_COURSE_GRADES_BATCH_SIZE = 500
+
+# Number of records updated per UPDATE statement. Keeps the number of query
+# parameters under SQLite's limit
+LEARNER_COURSE_GRADES_UPDATE_BATCH_SIZE = 100
 
+
+def learner_course_grades_data(course_progress_details):
+    """Maps ``course_progress_details`` to LearnerCourseGradeMetrics fields
     """
-    # details = course_progress['course_progress_details']
-    data = dict(
+    return dict(
         points_possible=course_progress_details['points_possible'],
         points_earned=course_progress_details['points_earned'],
         sections_worked=course_progress_details['sections_worked'],
         sections_possible=course_progress_details['count']
         )
+
+
+def save_learner_course_grades(site, date_for, course_enrollment, course_progress_details):
+    """
+
+    ``course_progress_details`` data are the ``course_progress_details`` from the
+    ``LearnerCourseGrades.course_progress method``
+
+    """
+    # details = course_progress['course_progress_details']
+    data = learner_course_grades_data(course_progress_details)
     obj, created = LearnerCourseGradeMetrics.objects.update_or_create(
         site=site,
         user=course_enrollment.user,
@@ -26,3 +54,95 @@ def save_learner_course_grades(site, date_for, course_enrollment, course_progres
         date_for=date_for,
         defaults=data)
     return obj, created
+
+
+class LearnerCourseGradesWriter(object):
+    """Buffered writer for LearnerCourseGradeMetrics records
+
+    Collects learner course grades with ``add`` and writes them in batches with
+    a single query to find existing records, ``bulk_create`` for new records and
+    a single ``UPDATE`` for existing records. Records are matched on the
+    model's ``unique_together`` fields, user, course_id and date_for. If the
+    same learner, course and date is added more than once before a flush, the
+    last one added is saved.
+
+    ``created`` and ``updated`` hold the running counts of records written.
+
+    ``add`` only buffers, so a failed write is never reported against the
+    record being added. Call ``flush_if_full`` between records and ``flush``
+    after the last record is added.
+    """
+    def __init__(self, site, batch_size=LEARNER_COURSE_GRADES_BATCH_SIZE):
+        self.site = site
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self._buffer = {}
+
+    def add(self, date_for, course_enrollment, course_progress_details):
+        key = (course_enrollment.user_id,
+               str(course_enrollment.course_id),
+               as_date(date_for))
+        self._buffer[key] = learner_course_grades_data(course_progress_details)
+
+    def flush_if_full(self):
+        """Writes the buffered records if there are at least ``batch_size`` of
+        them
+
+        Returns the ``flush`` results, or None if the buffer is not full
+        """
+        if len(self._buffer) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Writes the buffered records
+
+        Returns a dict with the number of records created and updated by this
+        flush
+        """
+        if not self._buffer:
+            return dict(created=0, updated=0)
+        records, self._buffer = self._buffer, {}
+        existing = dict(
+            ((user_id, course_id, date_for), pk) for pk, user_id, course_id, date_for in
+            LearnerCourseGradeMetrics.objects.filter(  # pylint: disable=no-member
+                user_id__in=set(key[0] for key in records),
+                course_id__in=set(key[1] for key in records),
+                date_for__in=set(key[2] for key in records),
+                ).order_by().values_list('id', 'user_id', 'course_id', 'date_for'))
+
+        new_records = [
+            LearnerCourseGradeMetrics(site=self.site,
+                                      user_id=key[0],
+                                      course_id=key[1],
+                                      date_for=key[2],
+                                      **data)
+            for key, data in records.items() if key not in existing]
+        updates = [(existing[key], data) for key, data in records.items() if key in existing]
+
+        with transaction.atomic():
+            LearnerCourseGradeMetrics.objects.bulk_create(new_records)
+            batch_size = LEARNER_COURSE_GRADES_UPDATE_BATCH_SIZE
+            for i in range(0, len(updates), batch_size):
+                self._update(updates[i:i + batch_size])
+
+        self.created += len(new_records)
+        self.updated += len(updates)
+        return dict(created=len(new_records), updated=len(updates))
+
+    def _update(self, updates):
+        """Updates existing records with one query
+
+        ``updates`` is a list of (primary key, data) tuples
+        """
+        fields = {
+            field: Case(
+                *[When(pk=pk, then=Value(data[field])) for pk, data in updates],
+                output_field=LearnerCourseGradeMetrics._meta.get_field(field))
+            for field in LEARNER_COURSE_GRADE_FIELDS}
+        LearnerCourseGradeMetrics.objects.filter(  # pylint: disable=no-member
+            pk__in=[pk for pk, _ in updates]).update(
+                site=self.site,
+                modified=datetime.datetime.utcnow().replace(tzinfo=utc),
+                **fields)
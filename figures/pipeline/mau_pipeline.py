@@ -12,9 +12,13 @@ See figures.tasks for the Celery tasks that run MAU jobs
 """
 
 from figures.helpers import as_course_key
-from figures.mau import get_mau_from_student_modules
+from figures.mau import get_mau_counts_by_course, get_mau_from_student_modules
 from figures.models import CourseMauMetrics
-from figures.sites import get_student_modules_for_course_in_site
+from figures.sites import (
+    get_course_keys_for_site,
+    get_student_modules_for_course_in_site,
+    get_student_modules_for_site,
+)
 
 
 def get_all_mau_for_site_course(site, courselike, month_for):
@@ -87,3 +91,25 @@ def collect_course_mau(site, courselike, month_for, **kwargs):
                                    overwrite=overwrite)
 
     return obj, created
+
+
+def collect_site_course_mau(site, month_for, **kwargs):
+    """
+    Extracts, transforms, loads the MAU data for all the courses in the site
+
+    Counts the MAU for every course with a single grouped query and saves the
+    records in bulk. Courses without activity get a zero MAU record
+
+    Returns the ``CourseMauMetrics.save_metrics_bulk`` results
+    """
+    overwrite = kwargs.get('overwrite', False)
+    course_ids = [str(course_key) for course_key in get_course_keys_for_site(site)]
+    course_maus = get_mau_counts_by_course(
+        student_modules=get_student_modules_for_site(site),
+        year=month_for.year,
+        month=month_for.month)
+    return CourseMauMetrics.save_metrics_bulk(
+        site=site,
+        course_maus={(course_id, month_for): course_maus.get(course_id, 0)
+                     for course_id in course_ids},
+        overwrite=overwrite)
@@ -0,0 +1,222 @@
+"""Tracks daily metrics pipeline runs in the database
+
+A ``PipelineSiteRun`` record is created for each site and date the daily
+metrics pipeline runs for, with a ``PipelineCourseRun`` record for each of the
+site's courses. Course tasks claim pending course runs, so the number of
+course tasks running at once for a site is bounded by the number of course
+runs claimed. When a course run finishes, the site run's finished course count
+is incremented. The course task that finishes the last course claims the site
+daily metrics step, so it runs exactly once per site run, whether or not
+course runs failed.
+
+Claims are made with conditional ``UPDATE`` queries so that only one caller
+can claim a course run or the site daily metrics step. A course run or site
+daily metrics step left running for longer than ``RUN_CLAIM_TIMEOUT`` is
+assumed to belong to a task that stopped, and can be claimed again. Site runs
+left running for longer than ``RUN_CLAIM_TIMEOUT`` are picked up by the
+``figures.tasks.resume_stalled_site_runs`` periodic task.
+
+The serial ``populate_daily_metrics`` task records its progress in the same
+models, so an interrupted or partly failed run can be resumed with
+``resume_site_run``, which only reruns the courses that did not succeed.
+"""
+
+import datetime
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from figures.helpers import as_date
+from figures.models import PipelineCourseRun, PipelineSiteRun
+
+
+RUN_CLAIM_TIMEOUT = datetime.timedelta(hours=6)
+
+
+def claimable_filter(status_field):
+    """Returns a filter for records whose ``status_field`` is pending, or
+    running for longer than ``RUN_CLAIM_TIMEOUT``
+    """
+    return Q(**{status_field: PipelineSiteRun.PENDING}) | Q(**{
+        status_field: PipelineSiteRun.RUNNING,
+        'modified__lt': now() - RUN_CLAIM_TIMEOUT})
+
+
+def start_site_run(site, date_for, course_ids):
+    """Creates or restarts the site run for the site and date
+
+    Any course runs from a previous run for the site and date are replaced by
+    pending course runs for ``course_ids``
+
+    Returns the ``PipelineSiteRun`` record
+    """
+    course_ids = [str(course_id) for course_id in course_ids]
+    with transaction.atomic():
+        site_run, _created = PipelineSiteRun.objects.update_or_create(
+            site=site,
+            date_for=as_date(date_for),
+            defaults=dict(status=PipelineSiteRun.RUNNING,
+                          site_metrics_status=PipelineSiteRun.PENDING,
+                          course_count=len(course_ids),
+                          finished_course_count=0))
+        site_run.course_runs.all().delete()
+        PipelineCourseRun.objects.bulk_create(
+            [PipelineCourseRun(site_run=site_run, course_id=course_id)
+             for course_id in course_ids])
+    return site_run
+
+
+def running_site_run(site, date_for):
+    """Returns the running site run for the site and date, or ``None``
+    """
+    return PipelineSiteRun.objects.filter(site=site,
+                                          date_for=as_date(date_for),
+                                          status=PipelineSiteRun.RUNNING).first()
+
+
+def stalled_site_runs():
+    """Returns the site runs that are running but have not progressed for
+    longer than ``RUN_CLAIM_TIMEOUT``
+
+    A site run's ``modified`` time is updated when a course run finishes and
+    when its site daily metrics step is claimed
+    """
+    return PipelineSiteRun.objects.filter(status=PipelineSiteRun.RUNNING,
+                                          modified__lt=now() - RUN_CLAIM_TIMEOUT)
+
+
+def resume_site_run(site, date_for, course_ids):
+    """Resumes the site run for the site and date, or starts one if there is
+    no site run yet
+
+    Course runs that succeeded are kept. Course runs that failed, are still
+    pending or were left running by a worker that stopped are reset to pending.
+    Course runs are added for new courses and removed for courses no longer
+    in ``course_ids``. If any course is to be run, or the site daily metrics
+    did not succeed, the site daily metrics step is reset to pending.
+
+    Returns the ``PipelineSiteRun`` record. Its status is succeeded if there is
+    nothing left to run
+    """
+    course_ids = [str(course_id) for course_id in course_ids]
+    with transaction.atomic():
+        site_run = PipelineSiteRun.objects.select_for_update().filter(
+            site=site, date_for=as_date(date_for)).first()
+        if not site_run:
+            return start_site_run(site=site, date_for=date_for, course_ids=course_ids)
+
+        existing = dict(site_run.course_runs.values_list('course_id', 'id'))
+        current = set(course_ids)
+        removed = [pk for course_id, pk in existing.items() if course_id not in current]
+        if removed:
+            PipelineCourseRun.objects.filter(id__in=removed).delete()
+        site_run.course_runs.exclude(status=PipelineSiteRun.SUCCEEDED).update(
+            status=PipelineSiteRun.PENDING, modified=now())
+        PipelineCourseRun.objects.bulk_create(
+            [PipelineCourseRun(site_run=site_run, course_id=course_id)
+             for course_id in course_ids if course_id not in existing])
+
+        site_run.course_count = len(course_ids)
+        site_run.finished_course_count = site_run.course_runs.filter(
+            status=PipelineSiteRun.SUCCEEDED).count()
+        if (site_run.finished_course_count < site_run.course_count or
+                site_run.site_metrics_status != PipelineSiteRun.SUCCEEDED):
+            site_run.status = PipelineSiteRun.RUNNING
+            site_run.site_metrics_status = PipelineSiteRun.PENDING
+        else:
+            site_run.status = PipelineSiteRun.SUCCEEDED
+        site_run.save()
+    return site_run
+
+
+def claim_course_runs(site_run):
+    """Claims all of the site run's pending course runs
+
+    This is for running a site's courses in a single process. Returns the
+    list of claimed ``PipelineCourseRun`` records
+    """
+    course_runs = list(site_run.course_runs.filter(
+        status=PipelineSiteRun.PENDING).order_by('id'))
+    site_run.course_runs.filter(status=PipelineSiteRun.PENDING).update(
+        status=PipelineSiteRun.RUNNING, modified=now())
+    for course_run in course_runs:
+        course_run.status = PipelineSiteRun.RUNNING
+    return course_runs
+
+
+def claim_course_run(site_run):
+    """Claims the next pending course run for the site run
+
+    Course runs left running for longer than ``RUN_CLAIM_TIMEOUT`` are claimed
+    again
+
+    Returns the claimed ``PipelineCourseRun`` with status running or ``None``
+    if there are no pending course runs left
+    """
+    while True:
+        course_run = site_run.course_runs.filter(
+            claimable_filter('status')).order_by('id').first()
+        if not course_run:
+            return None
+        claimed = PipelineCourseRun.objects.filter(
+            id=course_run.id,
+            status=course_run.status,
+            modified=course_run.modified).update(status=PipelineSiteRun.RUNNING,
+                                                 modified=now())
+        if claimed:
+            course_run.status = PipelineSiteRun.RUNNING
+            return course_run
+
+
+def finish_course_run(course_run, succeeded):
+    """Records the course run result and counts it toward the site run
+
+    Only running course runs are counted, so finishing a course run more than
+    once does not count it twice
+    """
+    status = PipelineSiteRun.SUCCEEDED if succeeded else PipelineSiteRun.FAILED
+    with transaction.atomic():
+        finished = PipelineCourseRun.objects.filter(
+            id=course_run.id,
+            status=PipelineSiteRun.RUNNING).update(status=status, modified=now())
+        if finished:
+            PipelineSiteRun.objects.filter(id=course_run.site_run_id).update(
+                finished_course_count=F('finished_course_count') + 1,
+                modified=now())
+    course_run.status = status
+    return bool(finished)
+
+
+def claim_site_metrics(site_run):
+    """Claims the site daily metrics step when all course runs have finished
+
+    A site daily metrics step left running for longer than
+    ``RUN_CLAIM_TIMEOUT`` is claimed again
+
+    Returns ``True`` to exactly one caller per site run
+    """
+    return bool(PipelineSiteRun.objects.filter(
+        claimable_filter('site_metrics_status'),
+        id=site_run.id,
+        finished_course_count__gte=F('course_count'),
+        ).update(site_metrics_status=PipelineSiteRun.RUNNING, modified=now()))
+
+
+def finish_site_run(site_run, succeeded):
+    """Records the site daily metrics result and the overall site run status
+
+    The site run fails if the site daily metrics step or any course run failed
+    """
+    site_metrics_status = (PipelineSiteRun.SUCCEEDED if succeeded
+                           else PipelineSiteRun.FAILED)
+    course_failed = site_run.course_runs.filter(
+        status=PipelineSiteRun.FAILED).exists()
+    status = (PipelineSiteRun.SUCCEEDED if succeeded and not course_failed
+              else PipelineSiteRun.FAILED)
+    PipelineSiteRun.objects.filter(id=site_run.id).update(
+        site_metrics_status=site_metrics_status,
+        status=status,
+        modified=now())
+    site_run.site_metrics_status = site_metrics_status
+    site_run.status = status
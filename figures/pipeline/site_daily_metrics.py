@@ -7,12 +7,23 @@ course metrics. These data are extracted directly from edx-platform models
 '''
 
 import datetime
+import logging
 
+from django.db import transaction
 from django.utils.timezone import utc
 from django.db.models import Sum
 
-from figures.helpers import as_course_key, as_datetime, next_day, prev_day
+from figures.helpers import (
+    as_course_key,
+    as_datetime,
+    day_window,
+    next_day,
+    prev_day,
+    use_distinct_cumulative_active_users,
+    window_filter,
+)
 from figures.models import CourseDailyMetrics, SiteDailyMetrics
+from figures.pipeline.ever_active_users import update_ever_active_users
 from figures.sites import (
     get_courses_for_site,
     get_users_for_site,
@@ -20,6 +31,9 @@ from figures.sites import (
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 #
 # Standalone helper methods
 #
@@ -62,14 +76,9 @@ def get_site_active_users_for_date(site, date_for):
     user ids
     '''
     student_modules = get_student_modules_for_site(site)
-
-    # For Ginkgo backward compatibility, Django 1.8 does not support
-    # `modified__date=<some_value>` in filters. Therefore, we need to match
-    # each date field
-    return student_modules.filter(modified__year=date_for.year,
-                                  modified__month=date_for.month,
-                                  modified__day=date_for.day).values_list(
-        'student__id', flat=True).distinct()
+    return student_modules.filter(
+        **window_filter('modified', day_window(date_for))).values_list(
+            'student__id', flat=True).distinct()
 
 
 def get_previous_cumulative_active_user_count(site, date_for):
@@ -134,6 +143,8 @@ class SiteDailyMetricsExtractor(object):
         todays_active_users = get_site_active_users_for_date(site, date_for)
         todays_active_user_count = todays_active_users.count()
         data['todays_active_user_count'] = todays_active_user_count
+        # The loader replaces this with the distinct count when
+        # FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS is enabled
         data['cumulative_active_user_count'] = get_previous_cumulative_active_user_count(
             site, date_for) + todays_active_user_count
         data['total_user_count'] = user_count
@@ -177,15 +188,36 @@ class SiteDailyMetricsLoader(object):
                 pass
 
         data = self.extractor.extract(site=site, date_for=date_for)
-        site_metrics, created = SiteDailyMetrics.objects.update_or_create(
-            date_for=date_for,
-            site=site,
-            defaults=dict(
-                cumulative_active_user_count=data['cumulative_active_user_count'],
-                todays_active_user_count=data['todays_active_user_count'],
-                total_user_count=data['total_user_count'],
-                course_count=data['course_count'],
-                total_enrollment_count=data['total_enrollment_count'],
+        with transaction.atomic():
+            site_metrics, created = SiteDailyMetrics.objects.update_or_create(
+                date_for=date_for,
+                site=site,
+                defaults=dict(
+                    cumulative_active_user_count=data['cumulative_active_user_count'],
+                    todays_active_user_count=data['todays_active_user_count'],
+                    total_user_count=data['total_user_count'],
+                    course_count=data['course_count'],
+                    total_enrollment_count=data['total_enrollment_count'],
+                )
             )
-        )
+            if use_distinct_cumulative_active_users():
+                self.load_distinct_cumulative_active_user_count(site_metrics)
         return site_metrics, created
+
+    def load_distinct_cumulative_active_user_count(self, site_metrics):
+        '''
+        Adds the activity since the last update to the site's ever active users
+        set, then sets the record's cumulative active user count from it. Called
+        after the record is saved, in the same transaction, so a failed save
+        does not advance the set
+
+        Keeps the summed count if the set can't give the count for the date
+        '''
+        count = update_ever_active_users(site_metrics.site, site_metrics.date_for)
+        if count is None:
+            logger.warning('Falling back to the summed cumulative active user count '
+                           'for site id={}, date_for={}'.format(site_metrics.site.id,
+                                                                site_metrics.date_for))
+            return
+        site_metrics.cumulative_active_user_count = count
+        site_metrics.save()
@@ -0,0 +1,130 @@
+"""Caches API responses for each site
+
+The metrics and course data endpoints only change when the pipeline writes
+new metrics. Responses are cached by site, endpoint path and query parameters
+under the site's generation number. The pipeline bumps the generation when it
+finishes updating a site's metrics, so the next request recomputes the
+response. See ``figures.tasks``
+
+Cached responses carry an ``ETag`` built from the same key, so a client that
+sends it back in ``If-None-Match`` gets a 304 without the response being
+rebuilt or re-sent until the site's generation changes
+
+Enabled with ``FIGURES_API_RESPONSE_CACHE``, see
+``figures.helpers.use_api_response_cache``
+"""
+
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import json
+
+import django.contrib.sites.shortcuts
+from django.core.cache import cache
+from django.utils.http import quote_etag, urlencode
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+import figures.helpers
+import figures.sites
+
+
+SITE_GENERATION_CACHE_KEY = 'figures.response_cache.site_generation.{site_id}'
+RESPONSE_CACHE_KEY = 'figures.response_cache.{site_id}.{generation}.{request_hash}'
+# Responses are recomputed at least this often in case a pipeline run fails
+RESPONSE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def site_generation(site):
+    """Returns the current generation of the site's cached responses
+    """
+    return figures.sites.cache_version(
+        SITE_GENERATION_CACHE_KEY.format(site_id=figures.sites.site_to_id(site)))
+
+
+def invalidate_site_responses(site):
+    """Bumps the site's generation so its cached responses are not used again
+    """
+    figures.sites.bump_cache_version(
+        SITE_GENERATION_CACHE_KEY.format(site_id=figures.sites.site_to_id(site)))
+
+
+def response_cache_key(site, request):
+    """Returns the cache key for the request's response for the site
+
+    The query parameters are sorted so the order they are given in doesn't
+    matter
+    """
+    query = urlencode(sorted((key, value) for key, values in request.query_params.lists()
+                             for value in values))
+    request_hash = hashlib.md5(u'{}?{}'.format(
+        request.path, query).encode('utf-8')).hexdigest()
+    return RESPONSE_CACHE_KEY.format(site_id=site.id,
+                                     generation=site_generation(site),
+                                     request_hash=request_hash)
+
+
+def response_etag(cache_key):
+    """Returns the quoted ETag for the response cached under ``cache_key``
+
+    The cache key changes with the site's generation, so the ETag does too
+    """
+    return quote_etag(hashlib.md5(cache_key.encode('utf-8')).hexdigest())
+
+
+def unquote_etag(etag):
+    """Returns the value of the ETag without the weak indicator and the quotes
+    """
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def etag_matches(request, etag):
+    """Returns True if the request's ``If-None-Match`` header matches ``etag``
+
+    Weak comparison is used, as is required for ``If-None-Match``. The header
+    is parsed here rather than with ``django.utils.http.parse_etags``, which
+    returns quoted ETags in newer Django versions and unquoted ones in older
+    versions. The ETags built by ``response_etag`` contain no commas
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    etags = [unquote_etag(tag) for tag in header.split(',')]
+    return '*' in etags or unquote_etag(etag) in etags
+
+
+def cache_site_response(view_method):
+    """Decorator for view handler methods to serve the response from the site
+    response cache
+
+    Only successful responses are cached. The response data are cached as
+    JSON, which is what the endpoints return to the Figures UI
+
+    The handler runs after authentication and permission checks, so a 304 is
+    only returned to callers allowed to see the response
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not figures.helpers.use_api_response_cache():
+            return view_method(self, request, *args, **kwargs)
+
+        site = django.contrib.sites.shortcuts.get_current_site(request)
+        cache_key = response_cache_key(site, request)
+        etag = response_etag(cache_key)
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        content = cache.get(cache_key)
+        if content is not None:
+            response = Response(json.loads(content, object_pairs_hook=OrderedDict))
+        else:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(cache_key, JSONRenderer().render(response.data),
+                          RESPONSE_CACHE_TIMEOUT)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+    return wrapper
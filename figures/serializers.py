@@ -17,6 +17,7 @@ looking at adding additional Figures models to capture:
 
 """
 
+from collections import defaultdict
 import datetime
 
 from django.contrib.auth import get_user_model
@@ -272,8 +273,13 @@ class GeneralCourseDataSerializer(serializers.Serializer):
         This is a hack to get the site for this course
         We do this because the figures.metrics calls we are making require the
         site object as a parameter
+
+        Views serializing a page of courses can provide the site, the course
+        staff roles and the latest CourseDailyMetrics records for the page in
+        the ``site``, ``course_staff`` and ``course_metrics`` context items, see
+        ``GeneralCourseDataViewSet.list``
         """
-        self.site = figures.sites.get_site_for_course(instance)
+        self.site = self.context.get('site') or figures.sites.get_site_for_course(instance)
         ret = super(GeneralCourseDataSerializer, self).to_representation(instance)
         return ret
 
@@ -281,13 +287,21 @@ class GeneralCourseDataSerializer(serializers.Serializer):
     #     return figures.sites.get_site_for_course(str(obj.id))
 
     def get_staff(self, obj):
-        qs = CourseAccessRole.objects.filter(course_id=obj.id)
+        course_staff = self.context.get('course_staff')
+        if course_staff is not None:
+            qs = course_staff.get(str(obj.id), [])
+        else:
+            qs = CourseAccessRole.objects.filter(course_id=obj.id)
         if qs:
             return [CourseAccessRoleForGCDSerializer(data).data for data in qs]
         else:
             return []
 
     def get_metrics(self, obj):
+        course_metrics = self.context.get('course_metrics')
+        if course_metrics is not None:
+            latest = course_metrics.get(str(obj.id))
+            return CourseDailyMetricsSerializer(latest).data if latest else []
         qs = CourseDailyMetrics.objects.filter(course_id=str(obj.id))
         if qs:
             return CourseDailyMetricsSerializer(qs.latest('date_for')).data
@@ -332,6 +346,19 @@ def get_course_history_metric(site, course_id, func, date_for, months_back):
         )
 
 
+def get_course_staff_for_courses(course_ids):
+    """Returns a dict of course id strings to lists of the course's
+    CourseAccessRole records, retrieved with one query
+    """
+    course_staff = dict((str(course_id), []) for course_id in course_ids)
+    roles = CourseAccessRole.objects.filter(
+        course_id__in=[as_course_key(course_id) for course_id in course_ids]
+        ).select_related('user__profile')
+    for role in roles:
+        course_staff[str(role.course_id)].append(role)
+    return course_staff
+
+
 class CourseDetailsSerializer(serializers.ModelSerializer):
     """
 
@@ -375,13 +402,31 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         This is a hack to get the site for this course
         We do this because the figures.metrics calls we are making require the
         site object as a parameter
+
+        Views serializing a page of courses can provide the site, the course
+        history metrics and the course staff roles for the page in the
+        ``site``, ``course_history`` and ``course_staff`` context items, see
+        ``CourseDetailsViewSet.list``
         """
-        self.site = figures.sites.get_site_for_course(instance)
+        self.site = self.context.get('site') or figures.sites.get_site_for_course(instance)
         ret = super(CourseDetailsSerializer, self).to_representation(instance)
         return ret
 
+    def get_history(self, course_overview, metric):
+        """Returns the metric history from the ``course_history`` context, or
+        ``None`` if the context doesn't have the course
+        """
+        course_history = self.context.get('course_history', {})
+        if str(course_overview.id) in course_history:
+            return course_history[str(course_overview.id)][metric]
+        return None
+
     def get_staff(self, course_overview):
-        qs = CourseAccessRole.objects.filter(course_id=course_overview.id)
+        course_staff = self.context.get('course_staff')
+        if course_staff is not None:
+            qs = course_staff.get(str(course_overview.id), [])
+        else:
+            qs = CourseAccessRole.objects.filter(course_id=course_overview.id)
         if qs:
             return [CourseAccessRoleForGCDSerializer(data).data for data in qs]
         else:
@@ -392,6 +437,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         Would be nice to have the course_enrollment and course_overview models
         linked
         """
+        history = self.get_history(course_overview, 'learners_enrolled')
+        if history is not None:
+            return history
         return get_course_history_metric(
             site=self.site,
             course_id=course_overview.id,
@@ -403,6 +451,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
     def get_average_progress(self, course_overview):
         """
         """
+        history = self.get_history(course_overview, 'average_progress')
+        if history is not None:
+            return history
         return get_course_history_metric(
             site=self.site,
             course_id=course_overview.id,
@@ -414,6 +465,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
     def get_average_days_to_complete(self, course_overview):
         """
         """
+        history = self.get_history(course_overview, 'average_days_to_complete')
+        if history is not None:
+            return history
         return get_course_history_metric(
             site=self.site,
             course_id=course_overview.id,
@@ -425,6 +479,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
     def get_users_completed(self, course_overview):
         """
         """
+        history = self.get_history(course_overview, 'users_completed')
+        if history is not None:
+            return history
         return get_course_history_metric(
             site=self.site,
             course_id=course_overview.id,
@@ -530,6 +587,16 @@ class GeneralUserDataSerializer(serializers.Serializer):
             return []
 
     def get_courses(self, user):
+        """Returns the serialized courses the user is enrolled in
+
+        Views serializing a page of users can provide the courses for the page
+        in the ``user_courses`` context item, see
+        ``get_general_user_data_context``
+        """
+        user_courses = self.context.get('user_courses')
+        if user_courses is not None:
+            return user_courses.get(user.id, [])
+
         course_ids = CourseEnrollment.objects.filter(
             user=user).values_list('course_id', flat=True).distinct()
 
@@ -539,6 +606,32 @@ class GeneralUserDataSerializer(serializers.Serializer):
         return [CourseOverviewSerializer(data).data for data in course_overviews]
 
 
+def get_general_user_data_context(user_ids):
+    """Returns the ``GeneralUserDataSerializer`` context items with the
+    serialized courses each user is enrolled in
+
+    Uses one query for the users' enrollments and one for the courses. Each
+    user's courses are in the order the courses query returns them, as when
+    the courses are retrieved per user
+    """
+    user_course_ids = defaultdict(set)
+    for user_id, course_id in CourseEnrollment.objects.filter(
+            user_id__in=user_ids).values_list('user_id', 'course_id').distinct():
+        user_course_ids[user_id].add(str(course_id))
+
+    all_course_ids = set().union(*user_course_ids.values())
+    course_overviews = CourseOverview.objects.filter(
+        id__in=[as_course_key(course_id) for course_id in all_course_ids]
+        ) if all_course_ids else []
+    courses = [(str(course_overview.id), CourseOverviewSerializer(course_overview).data)
+               for course_overview in course_overviews]
+
+    user_courses = dict(
+        (user_id, [data for course_id, data in courses if course_id in course_ids])
+        for user_id, course_ids in user_course_ids.items())
+    return dict(user_courses=user_courses)
+
+
 class UserDemographicSerializer(serializers.Serializer):
     country = SerializeableCountryField(
         source='profile.country', required=False, read_only=True, allow_blank=True)
@@ -600,21 +693,35 @@ class LearnerCourseDetailsSerializer(serializers.ModelSerializer):
 
         TODO: We will cache course grades, so we'll refactor this method to  use
         the cache, so we'll likely change the call to LearnerCourseGrades
-        """
-        cert = GeneratedCertificate.objects.filter(
-            user=course_enrollment.user,
-            course_id=course_enrollment.course_id,
-            )
 
-        if cert:
-            course_completed = cert[0].created_date
+        Views serializing a page of learners can provide the certificate dates
+        and the most recent LearnerCourseGradeMetrics records for the page in
+        the ``certificates`` and ``learner_grades`` context items, keyed by
+        (user id, course id string). See ``get_learner_details_context``
+        """
+        key = (course_enrollment.user_id, str(course_enrollment.course_id))
+        certificates = self.context.get('certificates')
+        if certificates is not None:
+            course_completed = certificates.get(key, False)
         else:
-            course_completed = False
+            cert = GeneratedCertificate.objects.filter(
+                user=course_enrollment.user,
+                course_id=course_enrollment.course_id,
+                )
+
+            if cert:
+                course_completed = cert[0].created_date
+            else:
+                course_completed = False
 
         try:
-            obj = LearnerCourseGradeMetrics.objects.most_recent_for_learner_course(
-                user=course_enrollment.user,
-                course_id=str(course_enrollment.course_id))
+            learner_grades = self.context.get('learner_grades')
+            if learner_grades is not None:
+                obj = learner_grades.get(key)
+            else:
+                obj = LearnerCourseGradeMetrics.objects.most_recent_for_learner_course(
+                    user=course_enrollment.user,
+                    course_id=str(course_enrollment.course_id))
             course_progress = dict(
                 progress_percent=obj.progress_percent,
                 course_progress_details=obj.progress_details)
@@ -647,6 +754,33 @@ class LearnerCourseDetailsSerializer(serializers.ModelSerializer):
         return data
 
 
+def get_learner_details_context(site, user_ids):
+    """Returns the ``LearnerDetailsSerializer`` context items with the site
+    course enrollments, certificate dates and most recent
+    LearnerCourseGradeMetrics records for the users
+
+    Uses a fixed number of queries regardless of the number of users
+    """
+    course_enrollments = defaultdict(list)
+    enrollments = figures.sites.get_course_enrollments_for_site(site).filter(
+        user_id__in=user_ids).select_related('user')
+    if RELEASE_LINE != 'ginkgo':
+        enrollments = enrollments.select_related('course')
+    for course_enrollment in enrollments:
+        course_enrollments[course_enrollment.user_id].append(course_enrollment)
+
+    certificates = {}
+    for user_id, course_id, created_date in GeneratedCertificate.objects.filter(
+            user_id__in=user_ids).values_list('user_id', 'course_id', 'created_date'):
+        certificates.setdefault((user_id, str(course_id)), created_date)
+
+    return dict(
+        course_enrollments=course_enrollments,
+        certificates=certificates,
+        learner_grades=LearnerCourseGradeMetrics.objects.most_recent_for_learners(user_ids),
+    )
+
+
 class LearnerDetailsSerializer(serializers.ModelSerializer):
 
     """
@@ -737,9 +871,15 @@ class LearnerDetailsSerializer(serializers.ModelSerializer):
 
         """
 
-        course_enrollments = figures.sites.get_course_enrollments_for_site(
-            self.context.get('site')).filter(user=user)
-        return LearnerCourseDetailsSerializer(course_enrollments, many=True).data
+        course_enrollments = self.context.get('course_enrollments')
+        if course_enrollments is not None:
+            course_enrollments = course_enrollments.get(user.id, [])
+        else:
+            course_enrollments = figures.sites.get_course_enrollments_for_site(
+                self.context.get('site')).filter(user=user)
+        return LearnerCourseDetailsSerializer(course_enrollments,
+                                              many=True,
+                                              context=self.context).data
 
     def get_profile_image(self, user):
         if hasattr(user, 'profile'):
@@ -27,6 +27,7 @@ def update_celerybeat_schedule(celerybeat_schedule_settings, figures_env_tokens)
     Figures pipeline job schedule configuration in CELERYBEAT_SCHEDULE.
 
     Daily metrics pipeline scheduler is on by default
+    Hourly resume of stalled pipeline site runs is on by default
     Course MAU metrics pipeline scheduler is off by default
 
     TODO: Language improvement: Change the "IMPORT" to "CAPTURE" or "EXTRACT"
@@ -40,6 +41,14 @@ def update_celerybeat_schedule(celerybeat_schedule_settings, figures_env_tokens)
                 ),
             }
 
+    if figures_env_tokens.get('ENABLE_STALLED_PIPELINE_RUN_RESUME', True):
+        celerybeat_schedule_settings['figures-resume-stalled-site-runs'] = {
+            'task': 'figures.tasks.resume_stalled_site_runs',
+            'schedule': crontab(
+                minute=figures_env_tokens.get('STALLED_PIPELINE_RUN_RESUME_MINUTE', 30),
+                ),
+            }
+
     if figures_env_tokens.get('ENABLE_DAILY_MAU_IMPORT', False):
         celerybeat_schedule_settings['figures-daily-mau'] = {
             'task': 'figures.tasks.populate_all_mau',
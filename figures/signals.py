@@ -0,0 +1,43 @@
+"""
+Signal handlers for Figures
+
+Imported by ``figures.models`` so the handlers are connected when the app loads
+"""
+
+from django.contrib.sites.models import Site
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from organizations.models import Organization, OrganizationCourse
+from student.models import CourseAccessRole  # pylint: disable=import-error
+
+import figures.sites
+
+
+@receiver(post_save, sender=CourseAccessRole)
+@receiver(post_delete, sender=CourseAccessRole)
+def invalidate_course_admin_user_ids(sender, **kwargs):  # pylint: disable=unused-argument
+    """Clears the cached course admin user ids when a course access role changes
+    """
+    figures.sites.invalidate_course_admin_user_ids()
+
+
+@receiver(post_save, sender=OrganizationCourse)
+@receiver(post_delete, sender=OrganizationCourse)
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_site_topology(sender, **kwargs):  # pylint: disable=unused-argument
+    """Clears the cached site topology when organization courses,
+    organizations or sites change
+    """
+    figures.sites.invalidate_site_topology()
+
+
+if hasattr(Organization, 'sites'):
+    @receiver(m2m_changed, sender=Organization.sites.through)
+    def invalidate_site_topology_for_sites(sender, **kwargs):  # pylint: disable=unused-argument
+        """Clears the cached site topology when organization sites change
+        """
+        figures.sites.invalidate_site_topology()
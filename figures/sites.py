@@ -10,21 +10,46 @@ TODO:
 Document how organization site mapping works
 """
 
+from collections import defaultdict
+import time
+
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.conf import settings
+from django.core.cache import cache
 
 # TODO: Add exception handling
 import organizations
 
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview  # noqa pylint: disable=import-error
 from courseware.models import StudentModule  # pylint: disable=import-error
-from student.models import CourseEnrollment  # pylint: disable=import-error
+from student.models import CourseAccessRole, CourseEnrollment  # pylint: disable=import-error
+from student.roles import CourseCcxCoachRole, CourseInstructorRole, CourseStaffRole  # noqa pylint: disable=import-error
 
 from figures.helpers import as_course_key
 import figures.helpers
 
 
+# Course roles whose users are not counted as learners
+COURSE_ADMIN_ROLES = [
+    CourseStaffRole.ROLE,
+    CourseInstructorRole.ROLE,
+    CourseCcxCoachRole.ROLE,
+]
+
+COURSE_ADMIN_ROLES_VERSION_CACHE_KEY = 'figures.sites.course_admin_roles_version'
+COURSE_ADMIN_USER_IDS_CACHE_KEY = 'figures.sites.course_admin_user_ids.{site_id}.{version}'
+COURSE_ADMIN_USER_IDS_CACHE_TIMEOUT = 60 * 60
+
+SITE_TOPOLOGY_VERSION_CACHE_KEY = 'figures.sites.site_topology_version'
+SITE_TOPOLOGY_CACHE_KEY = 'figures.sites.site_topology.{version}'
+SITE_TOPOLOGY_CACHE_TIMEOUT = 60 * 60
+
+# The site topology for this process. Replaced when the shared version changes
+# or the topology expires. See ``get_site_topology``
+_site_topology = {}
+
+
 class CrossSiteResourceError(Exception):
     """
     Raised when a cross site resource access is attempted
@@ -74,6 +99,93 @@ def default_site():
     return None
 
 
+def build_site_topology():
+    """Returns the mappings between sites, organizations and courses
+
+    Returns a dict of primitives so it can be stored in the shared cache:
+
+    * ``course_orgs``: course id strings to lists of (organization id, name)
+    * ``org_sites``: organization ids to lists of site ids
+    * ``site_orgs``: site ids to lists of organization ids
+    * ``site_course_ids``: site ids to lists of course id strings
+    * ``has_sites``: true if organizations have sites (Appsembler's fork of
+      edx-organizations)
+
+    Uses two queries
+    """
+    has_sites = hasattr(organizations.models.Organization, 'sites')
+    org_sites = defaultdict(list)
+    site_orgs = defaultdict(list)
+    if has_sites:
+        org_site_ids = organizations.models.Organization.sites.through.objects.values_list(
+            'organization_id', 'site_id')
+        for org_id, site_id in org_site_ids:
+            org_sites[org_id].append(site_id)
+            site_orgs[site_id].append(org_id)
+
+    course_orgs = defaultdict(list)
+    site_course_ids = defaultdict(list)
+    org_courses = organizations.models.OrganizationCourse.objects.order_by('id').values_list(
+        'course_id', 'organization_id', 'organization__name')
+    for course_id, org_id, org_name in org_courses:
+        course_orgs[course_id].append((org_id, org_name))
+        for site_id in org_sites[org_id]:
+            site_course_ids[site_id].append(course_id)
+
+    return dict(
+        course_orgs=dict(course_orgs),
+        org_sites=dict(org_sites),
+        site_orgs=dict(site_orgs),
+        site_course_ids=dict(site_course_ids),
+        has_sites=has_sites,
+    )
+
+
+def site_topology_version():
+    """Returns the current version of the site topology cache entries
+    """
+    return cache_version(SITE_TOPOLOGY_VERSION_CACHE_KEY)
+
+
+def invalidate_site_topology():
+    """Invalidates the cached site topology in all processes
+
+    Called when organization courses, organization sites or sites are changed
+    """
+    bump_cache_version(SITE_TOPOLOGY_VERSION_CACHE_KEY)
+
+
+def get_site_topology():
+    """Returns the site topology built by ``build_site_topology``
+
+    The topology is kept in the shared cache and in this process until
+    ``invalidate_site_topology`` is called, see ``figures.signals``, or until
+    ``SITE_TOPOLOGY_CACHE_TIMEOUT`` seconds after it was built. It can be stale
+    until then: organization courses and organizations are created in the
+    CMS, where the Figures signals are not connected, so the LMS does not see
+    them until the timeout. The daily pipeline tasks and the backfill
+    invalidate the topology when they start, so their runs include new
+    courses. Checking the topology is current costs one cache read. The
+    process copy also holds the parsed course keys for each site, see
+    ``get_course_keys_for_site``, and the sites, see ``get_site_for_course``
+    """
+    global _site_topology  # pylint: disable=global-statement
+    version = site_topology_version()
+    topology = _site_topology
+    now = time.time()
+    if ('course_orgs' not in topology or topology['version'] != version or
+            topology['expires_at'] <= now):
+        cache_key = SITE_TOPOLOGY_CACHE_KEY.format(version=version)
+        data = cache.get(cache_key)
+        if data is None or data['expires_at'] <= now:
+            data = dict(build_site_topology(),
+                        expires_at=now + SITE_TOPOLOGY_CACHE_TIMEOUT)
+            cache.set(cache_key, data, SITE_TOPOLOGY_CACHE_TIMEOUT)
+        topology = dict(data, version=version, site_course_keys={}, sites={})
+        _site_topology = topology
+    return topology
+
+
 def get_site_for_course(course_id):
     """
     Given a course, return the related site or None
@@ -87,19 +199,27 @@ def get_site_for_course(course_id):
     There should be only one organization per course.
     TODO: Figure out how we want to handle ``DoesNotExist``
     whether to let it raise back up raw or handle with a custom exception
+
+    In multisite mode the mapping comes from the site topology, so repeated
+    calls don't query the database
     """
     if figures.helpers.is_multisite():
-        org_courses = organizations.models.OrganizationCourse.objects.filter(
-            course_id=str(course_id))
-        if org_courses:
+        topology = get_site_topology()
+        course_orgs = topology['course_orgs'].get(str(course_id))
+        if course_orgs:
             # Keep until this assumption analyzed
             msg = 'Multiple orgs found for course: {}'
-            assert org_courses.count() == 1, msg.format(course_id)
-            first_org = org_courses.first().organization
-            if hasattr(first_org, 'sites'):
+            assert len(course_orgs) == 1, msg.format(course_id)
+            org_id, org_name = course_orgs[0]
+            if topology['has_sites']:
+                site_ids = topology['org_sites'].get(org_id, [])
                 msg = 'Must have one and only one site. Org is "{}"'
-                assert first_org.sites.count() == 1, msg.format(first_org.name)
-                site = first_org.sites.first()
+                assert len(site_ids) == 1, msg.format(org_name)
+                site = topology['sites'].get(site_ids[0])
+                if site is None:
+                    site = Site.objects.filter(  # pylint: disable=no-member
+                        id=site_ids[0]).first()
+                    topology['sites'][site_ids[0]] = site
             else:
                 site = None
         else:
@@ -115,16 +235,32 @@ def get_site_for_course(course_id):
 def get_organizations_for_site(site):
     """
     TODO: Refactor the functions in this module that make this call
+
+    Requires organizations with sites (Appsembler's fork of
+    edx-organizations). Otherwise the query raises ``FieldError``
     """
-    return organizations.models.Organization.objects.filter(sites__in=[site])
+    topology = get_site_topology()
+    if not topology['has_sites']:
+        return organizations.models.Organization.objects.filter(sites__in=[site])
+    return organizations.models.Organization.objects.filter(
+        id__in=topology['site_orgs'].get(site_to_id(site), []))
 
 
 def get_course_keys_for_site(site):
+    """Returns a list of the course keys for the site's courses
+
+    In multisite mode the course keys come from the site topology, parsed
+    once per process
+    """
     if figures.helpers.is_multisite():
-        orgs = organizations.models.Organization.objects.filter(sites__in=[site])
-        org_courses = organizations.models.OrganizationCourse.objects.filter(
-            organization__in=orgs)
-        course_ids = org_courses.values_list('course_id', flat=True)
+        topology = get_site_topology()
+        site_id = site_to_id(site)
+        course_keys = topology['site_course_keys'].get(site_id)
+        if course_keys is None:
+            course_keys = [as_course_key(cid) for cid in
+                           topology['site_course_ids'].get(site_id, [])]
+            topology['site_course_keys'][site_id] = course_keys
+        return list(course_keys)
     else:
         course_ids = CourseOverview.objects.all().values_list('id', flat=True)
     return [as_course_key(cid) for cid in course_ids]
@@ -145,9 +281,8 @@ def get_courses_for_site(site):
 
 def get_user_ids_for_site(site):
     if figures.helpers.is_multisite():
-        orgs = organizations.models.Organization.objects.filter(sites__in=[site])
         mappings = organizations.models.UserOrganizationMapping.objects.filter(
-            organization__in=orgs)
+            organization_id__in=get_site_topology()['site_orgs'].get(site_to_id(site), []))
         user_ids = mappings.values_list('user', flat=True)
     else:
         user_ids = get_user_model().objects.all().values_list('id', flat=True)
@@ -181,3 +316,85 @@ def get_student_modules_for_course_in_site(site, course_id):
 def get_student_modules_for_site(site):
     course_ids = get_course_keys_for_site(site)
     return StudentModule.objects.filter(course_id__in=course_ids)
+
+
+def role_course_key(course_key):
+    """Returns the course key used to look up course access roles
+
+    CCX course roles are assigned on the CCX's parent course
+    """
+    if getattr(course_key, 'ccx', None):
+        return course_key.to_course_locator()
+    return course_key
+
+
+def get_course_admin_user_ids(course_keys):
+    """Returns the user ids of the staff, instructors and CCX coaches for each
+    of the given courses
+
+    The returned dict maps course id strings to sets of user ids. Courses with
+    no admins are not in the dict
+    """
+    course_ids_for_role_key = defaultdict(list)
+    for course_key in course_keys:
+        course_ids_for_role_key[str(role_course_key(course_key))].append(
+            str(course_key))
+
+    admin_user_ids = defaultdict(set)
+    roles = CourseAccessRole.objects.filter(
+        course_id__in=[as_course_key(key) for key in course_ids_for_role_key],
+        role__in=COURSE_ADMIN_ROLES).values_list('course_id', 'user_id')
+    for role_course_id, user_id in roles:
+        for course_id in course_ids_for_role_key[str(role_course_id)]:
+            admin_user_ids[course_id].add(user_id)
+    return admin_user_ids
+
+
+def cache_version(version_key):
+    """Returns the current version stored in the cache under ``version_key``
+    """
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, int(time.time() * 1000), None)
+        version = cache.get(version_key)
+    return version
+
+
+def bump_cache_version(version_key):
+    """Changes the version stored in the cache under ``version_key``
+    """
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, int(time.time() * 1000), None)
+
+
+def course_admin_roles_version():
+    """Returns the current version of the course admin user ids cache entries
+    """
+    return cache_version(COURSE_ADMIN_ROLES_VERSION_CACHE_KEY)
+
+
+def invalidate_course_admin_user_ids():
+    """Invalidates the cached course admin user ids for all sites
+
+    Called when course access roles are changed
+    """
+    bump_cache_version(COURSE_ADMIN_ROLES_VERSION_CACHE_KEY)
+
+
+def get_course_admin_user_ids_for_site(site):
+    """Returns a dict of course id strings to the sets of user ids of the
+    staff, instructors and CCX coaches for the site's courses
+
+    The dict is built with a single query and cached until course access roles
+    change. See ``figures.signals``
+    """
+    cache_key = COURSE_ADMIN_USER_IDS_CACHE_KEY.format(
+        site_id=site_to_id(site),
+        version=course_admin_roles_version())
+    admin_user_ids = cache.get(cache_key)
+    if admin_user_ids is None:
+        admin_user_ids = dict(get_course_admin_user_ids(get_course_keys_for_site(site)))
+        cache.set(cache_key, admin_user_ids, COURSE_ADMIN_USER_IDS_CACHE_TIMEOUT)
+    return admin_user_ids
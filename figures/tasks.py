@@ -15,13 +15,21 @@ from celery.utils.log import get_task_logger
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview  # noqa pylint: disable=import-error
 from student.models import CourseEnrollment  # pylint: disable=import-error
 
-from figures.helpers import as_course_key, as_date
-from figures.models import PipelineError
-from figures.pipeline.course_daily_metrics import CourseDailyMetricsLoader
+from figures.helpers import as_course_key, as_date, prev_day
+from figures.models import PipelineCourseRun, PipelineError, PipelineSiteRun
+from figures.pipeline.course_daily_metrics import (
+    CourseDailyMetricsLoader,
+    SiteCourseDailyMetricsLoader,
+)
+import figures.pipeline.runs
 from figures.pipeline.site_daily_metrics import SiteDailyMetricsLoader
+import figures.helpers
 import figures.sites
-from figures.pipeline.mau_pipeline import collect_course_mau
+from figures.pipeline.active_user_bitmaps import load_active_user_bitmaps
+from figures.pipeline.course_monthly_metrics import load_course_monthly_metrics
+from figures.pipeline.mau_pipeline import collect_course_mau, collect_site_course_mau
 from figures.pipeline.logger import log_error_to_db
+from figures.response_cache import invalidate_site_responses
 
 
 logger = get_task_logger(__name__)
@@ -35,6 +43,31 @@ logger = get_task_logger(__name__)
 # logger.setLevel('INFO')
 
 
+# Default maximum number of course tasks running at once for a site in
+# ``populate_daily_metrics_parallel``
+MAX_COURSE_TASKS_PER_SITE = 4
+
+
+def log_course_error(e, site, course_id, date_for):
+    """Always capture CDM load exceptions to the Figures pipeline error table
+    """
+    error_data = dict(
+        date_for=date_for,
+        msg='figures.tasks.populate_daily_metrics failed',
+        exception_class=e.__class__.__name__,
+        )
+    if hasattr(e, 'message_dict'):
+        error_data['message_dict'] = e.message_dict
+    log_error_to_db(
+        error_data=error_data,
+        error_type=PipelineError.COURSE_DATA,
+        course_id=str(course_id),
+        site=site,
+        logger=logger,
+        log_pipeline_errors_to_db=True,
+        )
+
+
 @shared_task
 def populate_single_cdm(course_id, date_for=None, force_update=False):
     '''Populates a CourseDailyMetrics record for the given date and course
@@ -58,9 +91,43 @@ def populate_single_cdm(course_id, date_for=None, force_update=False):
         elapsed_time, cdm_obj))
 
 
+@shared_task
+def populate_site_course_daily_metrics(site_id, date_for=None, force_update=False,
+                                       course_ids=None):
+    '''Populates CourseDailyMetrics records for the courses in the site
+
+    Uses the site level loader, which extracts data for many courses with
+    grouped queries and bulk writes the records. If ``course_ids`` is not
+    provided, all of the site's courses are populated
+    '''
+    if date_for:
+        date_for = as_date(date_for)
+    if course_ids is not None:
+        course_ids = [as_course_key(course_id) for course_id in course_ids]
+    logger.info('populate_site_course_daily_metrics. site id = {}'.format(site_id))
+    start_time = time.time()
+
+    loader = SiteCourseDailyMetricsLoader(site=Site.objects.get(id=site_id))
+    results = loader.load(date_for=date_for,
+                          force_update=force_update,
+                          course_keys=course_ids)
+    elapsed_time = time.time() - start_time
+    logger.info(
+        'done. Elapsed time (seconds)={}. created={}, updated={}, skipped={}, failed={}'.format(
+            elapsed_time,
+            len(results['created']),
+            len(results['updated']),
+            len(results['skipped']),
+            len(results['failed'])))
+    return results
+
+
 @shared_task
 def populate_site_daily_metrics(site_id, **kwargs):
     '''Populate a SiteDailyMetrics record
+
+    Invalidates the site's cached API responses unless ``invalidate_responses``
+    is false, for callers that invalidate them after further steps
     '''
     logger.debug(
         'populate_site_daily_metrics called for site_id={}'.format(site_id))
@@ -69,12 +136,70 @@ def populate_site_daily_metrics(site_id, **kwargs):
         date_for=kwargs.get('date_for', None),
         force_update=kwargs.get('force_update', False),
         )
+    if kwargs.get('invalidate_responses', True):
+        invalidate_site_responses(site_id)
     logger.debug(
         'done running populate_site_daily_metrics for site_id={}"'.format(site_id))
 
 
+def populate_daily_metrics_for_site(site, date_for, force_update=False, resume=False):
+    '''Populates the course and site daily metrics for the site, one course at
+    a time, recording progress in the pipeline run ledger
+
+    If ``resume`` is true, only the courses that did not succeed in the site's
+    previous run for the date are populated. See ``figures.pipeline.runs``
+    '''
+    course_ids = [course.id for course in figures.sites.get_courses_for_site(site)]
+    if resume:
+        site_run = figures.pipeline.runs.resume_site_run(
+            site=site, date_for=date_for, course_ids=course_ids)
+        if site_run.status == PipelineSiteRun.SUCCEEDED:
+            logger.info('Nothing to resume for site id={}, date_for={}'.format(
+                site.id, date_for))
+            return
+    else:
+        site_run = figures.pipeline.runs.start_site_run(
+            site=site, date_for=date_for, course_ids=course_ids)
+    course_runs = figures.pipeline.runs.claim_course_runs(site_run)
+
+    populated_site_courses = False
+    if course_runs and figures.helpers.use_site_course_daily_metrics():
+        try:
+            results = populate_site_course_daily_metrics(
+                site_id=site.id,
+                date_for=date_for,
+                force_update=force_update,
+                course_ids=[course_run.course_id for course_run in course_runs])
+            failed = set(str(course_id) for course_id in results['failed'])
+            for course_run in course_runs:
+                figures.pipeline.runs.finish_course_run(
+                    course_run, succeeded=course_run.course_id not in failed)
+            populated_site_courses = True
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(
+                'populate_site_course_daily_metrics failed for site id={}. '
+                'Falling back to populating courses individually'.format(site.id))
+
+    if not populated_site_courses:
+        for course_run in course_runs:
+            try:
+                populate_single_cdm(
+                    course_id=course_run.course_id,
+                    date_for=date_for,
+                    force_update=force_update)
+                succeeded = True
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception('figures.tasks.populate_daily_metrics failed')
+                log_course_error(e, site=site, course_id=course_run.course_id,
+                                 date_for=date_for)
+                succeeded = False
+            figures.pipeline.runs.finish_course_run(course_run, succeeded=succeeded)
+
+    populate_site_daily_metrics_for_run(site_run, force_update=force_update)
+
+
 @shared_task
-def populate_daily_metrics(date_for=None, force_update=False):
+def populate_daily_metrics(date_for=None, force_update=False, resume=False):
     '''Populates the daily metrics models for the given date
 
     This method populates CourseDailyMetrics for all the courses in the site,
@@ -84,10 +209,18 @@ def populate_daily_metrics(date_for=None, force_update=False):
     ``populate_site_daily_metrics`` as immediate calls so that no courses are
     missed when the site daily metrics record is populated.
 
-    NOTE: We have an experimental task that runs the course populators in
+    If ``FIGURES_SITE_COURSE_DAILY_METRICS`` is enabled in the Open edX
+    FEATURES, the course metrics for each site are populated together with
+    ``populate_site_course_daily_metrics``. If that fails for a site, we fall
+    back to populating the site's courses one at a time.
+
+    Each course's result is recorded in the pipeline run ledger. If ``resume``
+    is true, only the courses that failed or never ran in the previous run for
+    the date are populated, then the site metrics are populated again.
 
+    NOTE: ``populate_daily_metrics_parallel`` runs the course populators in
     parallel, then when they are all done, populates the site metrics. See the
-    function ``experimental_populate_daily_metrics`` docstring for details
+    function ``populate_daily_metrics_parallel`` docstring for details
 
     TODO: Add error handling and error logging
     TODO: Create and add decorator to assign 'date_for' if None
@@ -100,41 +233,248 @@ def populate_daily_metrics(date_for=None, force_update=False):
     logger.info('Starting task "figures.populate_daily_metrics" for date "{}"'.format(
         date_for))
 
+    # Organization courses created in the CMS do not send the signals that
+    # invalidate the site topology, so rebuild it for each run
+    figures.sites.invalidate_site_topology()
     for site in Site.objects.all():
-        for course in figures.sites.get_courses_for_site(site):
-            try:
-                populate_single_cdm(
-                    course_id=course.id,
-                    date_for=date_for,
-                    force_update=force_update)
-            except Exception as e:  # pylint: disable=broad-except
-                logger.exception('figures.tasks.populate_daily_metrics failed')
-                # Always capture CDM load exceptions to the Figures pipeline
-                # error table
-                error_data = dict(
-                    date_for=date_for,
-                    msg='figures.tasks.populate_daily_metrics failed',
-                    exception_class=e.__class__.__name__,
-                    )
-                if hasattr(e, 'message_dict'):
-                    error_data['message_dict'] = e.message_dict  # pylint: disable=no-member
-                log_error_to_db(
-                    error_data=error_data,
-                    error_type=PipelineError.COURSE_DATA,
-                    course_id=str(course.id),
-                    site=site,
-                    logger=logger,
-                    log_pipeline_errors_to_db=True,
-                    )
-        populate_site_daily_metrics(
-            site_id=site.id,
-            date_for=date_for,
-            force_update=force_update)
+        populate_daily_metrics_for_site(site=site,
+                                        date_for=date_for,
+                                        force_update=force_update,
+                                        resume=resume)
 
     logger.info('Finished task "figures.populate_daily_metrics" for date "{}"'.format(
         date_for))
 
 
+#
+# Parallel Daily Metrics Tasks
+#
+
+
+@shared_task
+def populate_daily_metrics_parallel(date_for=None, force_update=False,
+                                    max_course_tasks=MAX_COURSE_TASKS_PER_SITE):
+    '''Populates the daily metrics models for the given date with parallel
+    course tasks
+
+    Starts ``populate_site_daily_metrics_parallel`` for each site.
+
+    Unlike ``experimental_populate_daily_metrics``, this does not use a Celery
+    chord. Progress is tracked in the ``PipelineSiteRun`` and
+    ``PipelineCourseRun`` models. See ``figures.pipeline.runs``
+    '''
+    if date_for:
+        date_for = as_date(date_for)
+    else:
+        date_for = datetime.datetime.utcnow().replace(tzinfo=utc).date()
+
+    logger.info('Starting task "figures.populate_daily_metrics_parallel" for date "{}"'.format(
+        date_for))
+    # Organization courses created in the CMS do not send the signals that
+    # invalidate the site topology, so rebuild it for each run
+    figures.sites.invalidate_site_topology()
+    for site in Site.objects.all():
+        populate_site_daily_metrics_parallel.delay(
+            site_id=site.id,
+            date_for=str(date_for),
+            force_update=force_update,
+            max_course_tasks=max_course_tasks)
+
+
+def start_course_run_task(course_run, force_update=False):
+    '''Queues ``populate_course_daily_metrics_for_run`` for the claimed course
+    run
+
+    Returns False if the task could not be queued
+    '''
+    try:
+        populate_course_daily_metrics_for_run.delay(course_run_id=course_run.id,
+                                                    force_update=force_update)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Unable to queue the course task for course run id={}'.format(
+            course_run.id))
+        return False
+    return True
+
+
+def continue_site_run(site_run, force_update=False,
+                      max_course_tasks=MAX_COURSE_TASKS_PER_SITE):
+    '''Starts course tasks for up to ``max_course_tasks`` of the site run's
+    pending or stalled course runs, then populates the site daily metrics if
+    all the course runs have finished
+
+    If a course task cannot be queued, the claimed course run is populated in
+    this task
+    '''
+    for _ in range(max_course_tasks):
+        course_run = figures.pipeline.runs.claim_course_run(site_run)
+        if not course_run:
+            break
+        if not start_course_run_task(course_run, force_update=force_update):
+            populate_course_daily_metrics_for_run(course_run_id=course_run.id,
+                                                  force_update=force_update)
+            break
+
+    # Handles sites without courses and site runs whose courses have finished
+    populate_site_daily_metrics_for_run(site_run, force_update=force_update)
+
+
+@shared_task(acks_late=True)
+def populate_site_daily_metrics_parallel(site_id, date_for, force_update=False,
+                                         max_course_tasks=MAX_COURSE_TASKS_PER_SITE):
+    '''Starts a site run and up to ``max_course_tasks`` course tasks for the site
+
+    Each course task starts a task for the next pending course when it is done,
+    so at most ``max_course_tasks`` course tasks run at once for the site. The
+    site daily metrics are populated once, after the last course finishes.
+
+    If the site already has a running site run for the date, as when this task
+    is delivered again after a worker stopped, that run is continued instead
+    of restarted, so course runs in flight are kept
+    '''
+    site = Site.objects.get(id=site_id)
+    site_run = figures.pipeline.runs.running_site_run(site=site, date_for=date_for)
+    if site_run:
+        logger.info('populate_site_daily_metrics_parallel. Continuing site run id={}'.format(
+            site_run.id))
+    else:
+        course_keys = figures.sites.get_course_keys_for_site(site)
+        site_run = figures.pipeline.runs.start_site_run(
+            site=site, date_for=date_for, course_ids=course_keys)
+    logger.info('populate_site_daily_metrics_parallel. site id={}, courses={}'.format(
+        site_id, site_run.course_count))
+    continue_site_run(site_run, force_update=force_update,
+                      max_course_tasks=max_course_tasks)
+
+
+@shared_task(acks_late=True)
+def populate_course_daily_metrics_for_run(course_run_id, force_update=False):
+    '''Populates CourseDailyMetrics for a course run, then starts the next
+    pending course run for the site. If this is the last course to finish,
+    populates the site daily metrics
+
+    The task is acknowledged after it runs, so it is delivered again if the
+    worker stops. It returns without doing anything if the course run was
+    removed by a restarted site run. If the course run has already finished,
+    only the site daily metrics are populated, in case the worker stopped
+    before it got to them. If the task for the next course run cannot be
+    queued, the next course run is populated in this task
+    '''
+    course_run = PipelineCourseRun.objects.select_related(
+        'site_run__site').filter(id=course_run_id).first()
+    if not course_run:
+        logger.info('Course run id={} was removed by a restarted site run'.format(
+            course_run_id))
+        return
+    site_run = course_run.site_run
+    if course_run.status != PipelineSiteRun.RUNNING:
+        logger.info('Course run id={} has already finished'.format(course_run_id))
+        populate_site_daily_metrics_for_run(site_run, force_update=force_update)
+        return
+    while course_run:
+        try:
+            populate_single_cdm(course_id=course_run.course_id,
+                                date_for=site_run.date_for,
+                                force_update=force_update)
+            succeeded = True
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('figures.tasks.populate_course_daily_metrics_for_run failed')
+            log_course_error(e, site=site_run.site, course_id=course_run.course_id,
+                             date_for=site_run.date_for)
+            succeeded = False
+        figures.pipeline.runs.finish_course_run(course_run, succeeded=succeeded)
+
+        course_run = figures.pipeline.runs.claim_course_run(site_run)
+        if course_run and start_course_run_task(course_run, force_update=force_update):
+            course_run = None
+    populate_site_daily_metrics_for_run(site_run, force_update=force_update)
+
+
+@shared_task
+def resume_stalled_site_runs(max_course_tasks=MAX_COURSE_TASKS_PER_SITE):
+    '''Continues the site runs that have not progressed for longer than
+    ``figures.pipeline.runs.RUN_CLAIM_TIMEOUT``
+
+    Stalled course runs are only claimed again when a task looks for the next
+    course run, so without this periodic task a site run whose course tasks
+    all stopped would never reach its site daily metrics
+    '''
+    for site_run in figures.pipeline.runs.stalled_site_runs().select_related('site'):
+        logger.info('Resuming stalled site run id={}'.format(site_run.id))
+        try:
+            continue_site_run(site_run, max_course_tasks=max_course_tasks)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('resume_stalled_site_runs failed for site run id={}'.format(
+                site_run.id))
+
+
+def populate_active_user_bitmaps(site_id, date_for, force_update=False):
+    '''Populates the ActiveUserBitmap records for the site and its courses for
+    the day before ``date_for`` and for ``date_for``
+
+    Only completed days are stored, so the daily run for today stores
+    yesterday's records, once the day has ended. Failures are logged and do
+    not stop the site daily metrics
+    '''
+    try:
+        site = Site.objects.get(id=site_id)
+        for day in (prev_day(date_for), as_date(date_for)):
+            load_active_user_bitmaps(site=site,
+                                     date_for=day,
+                                     force_update=force_update)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('populate_active_user_bitmaps failed for site id={}, '
+                         'date_for={}'.format(site_id, date_for))
+
+
+def populate_course_monthly_metrics(site_id, date_for):
+    '''Updates the CourseMonthlyMetrics records for the site's courses for the
+    month of ``date_for``
+
+    On the first day of a month, the previous month is updated too, since the
+    previous day's run did not see the activity after it ran. Failures are
+    raised so that the site run is recorded as failed
+    '''
+    site = Site.objects.get(id=site_id)
+    date_for = as_date(date_for)
+    months = [date_for]
+    if prev_day(date_for).month != date_for.month:
+        months.insert(0, prev_day(date_for))
+    for month_for in months:
+        load_course_monthly_metrics(site=site, month_for=month_for)
+
+
+def populate_site_daily_metrics_for_run(site_run, force_update=False):
+    '''Populates SiteDailyMetrics for the site run if all the site's course
+    runs have finished and no other task has already claimed it
+
+    If any of the site steps fail, the site run is recorded as failed and the
+    exception is raised
+    '''
+    if not figures.pipeline.runs.claim_site_metrics(site_run):
+        return
+    try:
+        if figures.helpers.use_active_user_bitmaps():
+            populate_active_user_bitmaps(site_id=site_run.site_id,
+                                         date_for=site_run.date_for,
+                                         force_update=force_update)
+        populate_site_daily_metrics(site_id=site_run.site_id,
+                                    date_for=site_run.date_for,
+                                    force_update=force_update,
+                                    invalidate_responses=False)
+        if figures.helpers.use_course_monthly_metrics():
+            populate_course_monthly_metrics(site_id=site_run.site_id,
+                                            date_for=site_run.date_for)
+    except Exception:
+        logger.exception('populate_site_daily_metrics_for_run failed for site run {}'.format(
+            site_run.id))
+        figures.pipeline.runs.finish_site_run(site_run, succeeded=False)
+        raise
+    figures.pipeline.runs.finish_site_run(site_run, succeeded=True)
+    # Invalidated once, after all the site steps
+    invalidate_site_responses(site_run.site_id)
+
+
 #
 # Daily Metrics Experimental Tasks
 #
@@ -146,7 +486,7 @@ def experimental_populate_daily_metrics(date_for=None, force_update=False):
 
     WARNING: In Ginkgo devstack, this task tends to gets stuck in the middle of
     processing course metrics. Not all the courses get processed and the site
-    metrics doesn't get called.
+    metrics doesn't get called. Use ``populate_daily_metrics_parallel`` instead.
 
     We're keeping it in the tasks so that we can continue to debug this.
     Enabling parallel course tasks will improve the pipeline performance
@@ -223,16 +563,25 @@ def populate_mau_metrics_for_site(site_id, month_for=None, force_update=False):
     """
     Collect (save) MAU metrics for the specified site
 
-    Iterates over all courses in the site to collect MAU counts
+    Collects the MAU counts for all courses in the site with one grouped query
+    and saves them in bulk. See ``collect_site_course_mau``
     TODO: Decide how sites would be excluded and create filter
-    TODO: Check results of 'store_mau_metrics' to log unexpected results
     """
+    if month_for:
+        month_for = as_date(month_for)
+    else:
+        month_for = datetime.datetime.utcnow().date()
     site = Site.objects.get(id=site_id)
-    for course_key in figures.sites.get_course_keys_for_site(site):
-        populate_course_mau(site_id=site_id,
-                            course_id=str(course_key),
-                            month_for=month_for,
-                            force_update=force_update)
+    start_time = time.time()
+    results = collect_site_course_mau(site=site,
+                                      month_for=month_for,
+                                      overwrite=force_update)
+    invalidate_site_responses(site_id)
+    elapsed_time = time.time() - start_time
+    logger.info(('populate_mau_metrics_for_site. site id={}, created={}, updated={}, '
+                 'skipped={}. Elapsed time (seconds)={}').format(
+        site_id, len(results['created']), len(results['updated']),
+        len(results['skipped']), elapsed_time))
 
 
 @shared_task
@@ -243,5 +592,6 @@ def populate_all_mau():
     Initially, run it every day to observe monthly active user accumulation for
     the month and evaluate the results
     """
+    figures.sites.invalidate_site_topology()
     for site in Site.objects.all():
         populate_mau_metrics_for_site(site_id=site.id, force_update=False)
@@ -67,13 +67,27 @@ from figures.serializers import (
     UserIndexSerializer,
     GeneralUserDataSerializer,
     get_course_history_metric,
+    get_course_staff_for_courses,
+    get_general_user_data_context,
+    get_learner_details_context,
+    HISTORY_MONTHS_BACK,
 )
 from figures import metrics
+from figures.exports import (
+    DEFAULT_EXPORT_FORMAT,
+    EXPORT_FORMAT_QUERY_PARAM,
+    export_response,
+    queryset_chunks,
+    serializer_columns,
+)
 from figures.pagination import (
+    FiguresCursorPagination,
+    FiguresKiloCursorPagination,
     FiguresLimitOffsetPagination,
     FiguresKiloPagination,
 )
 import figures.permissions
+from figures.response_cache import cache_site_response
 import figures.helpers
 import figures.sites
 from figures.mau import (
@@ -146,6 +160,85 @@ class StaffUserOnDefaultSiteAuthMixin(object):
         figures.permissions.IsStaffUserOnDefaultSite,
     )
 
+
+class CursorPaginationOptInMixin(object):
+    '''Paginates with ``cursor_pagination_class`` instead of the view's
+    ``pagination_class`` when the request has the ``cursor`` query parameter
+
+    Cursor pagination avoids the offset scan and the count query of the limit
+    offset paginators on sites with many records. See
+    figures.pagination.FiguresCursorPagination
+    '''
+    cursor_pagination_class = FiguresCursorPagination
+
+    @property
+    def paginator(self):
+        request = getattr(self, 'request', None)
+        if not hasattr(self, '_paginator') and request is not None:
+            pagination_class = self.cursor_pagination_class
+            if pagination_class.cursor_query_param in request.query_params:
+                self._paginator = pagination_class()
+        return super(CursorPaginationOptInMixin, self).paginator
+
+
+class BulkContextListMixin(object):
+    '''Serializes the list page with the serializer context items for all the
+    page's records retrieved up front by ``get_bulk_context``
+
+    Override ``get_bulk_context`` so the number of queries does not depend on
+    the number of records in the page
+    '''
+
+    def get_list_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def get_bulk_context(self, objs):  # pylint: disable=unused-argument
+        '''Returns the serializer context items retrieved up front for ``objs``
+        '''
+        return {}
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_list_queryset()
+        page = self.paginate_queryset(queryset)
+        objs = list(page if page is not None else queryset)
+        context = self.get_serializer_context()
+        context.update(self.get_bulk_context(objs))
+        serializer = self.get_serializer_class()(objs, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+
+class StreamingExportMixin(BulkContextListMixin):
+    '''Adds an ``export`` list route that streams all the filtered records as
+    CSV or NDJSON, selected with the ``export_format`` query parameter
+
+    The records are serialized a chunk at a time, with ``get_bulk_context``
+    called for each chunk. The CSV columns come from the serializer's fields,
+    so they do not depend on the first record. See figures.exports
+    '''
+    export_filename = 'figures-export'
+
+    def get_export_queryset(self):
+        return self.get_list_queryset()
+
+    def export_records(self):
+        serializer_class = self.get_serializer_class()
+        for chunk in queryset_chunks(self.get_export_queryset()):
+            context = self.get_serializer_context()
+            context.update(self.get_bulk_context(chunk))
+            for record in serializer_class(chunk, many=True, context=context).data:
+                yield record
+
+    @list_route()
+    def export(self, request, *args, **kwargs):
+        return export_response(
+            self.export_records(),
+            export_format=request.query_params.get(EXPORT_FORMAT_QUERY_PARAM,
+                                                   DEFAULT_EXPORT_FORMAT),
+            filename=self.export_filename,
+            columns=serializer_columns(self.get_serializer()))
+
 #
 # Views for data in edX platform
 #
@@ -181,7 +274,8 @@ class CoursesIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class UserIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class UserIndexViewSet(CommonAuthMixin, CursorPaginationOptInMixin,
+                       viewsets.ReadOnlyModelViewSet):
     '''Provides a list of users with abbreviated details
 
     Uses figures.filters.UserFilter to select subsets of User objects
@@ -198,9 +292,11 @@ class UserIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class CourseEnrollmentViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class CourseEnrollmentViewSet(CommonAuthMixin, CursorPaginationOptInMixin, StreamingExportMixin,
+                              viewsets.ReadOnlyModelViewSet):
     model = CourseEnrollment
     pagination_class = FiguresLimitOffsetPagination
+    export_filename = 'course-enrollments'
     serializer_class = CourseEnrollmentSerializer
     filter_backends = (DjangoFilterBackend, )
     filter_class = CourseEnrollmentFilter
@@ -210,14 +306,19 @@ class CourseEnrollmentViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         queryset = figures.sites.get_course_enrollments_for_site(site)
         return queryset
 
+    def get_export_queryset(self):
+        return super(CourseEnrollmentViewSet, self).get_export_queryset().select_related(
+            'user__profile')
+
 #
 # Views for Figures models
 #
 
 
-class CourseDailyMetricsViewSet(CommonAuthMixin, viewsets.ModelViewSet):
+class CourseDailyMetricsViewSet(CommonAuthMixin, StreamingExportMixin, viewsets.ModelViewSet):
 
     model = CourseDailyMetrics
+    export_filename = 'course-daily-metrics'
     # queryset = CourseDailyMetrics.objects.all()
     pagination_class = FiguresLimitOffsetPagination
     serializer_class = CourseDailyMetricsSerializer
@@ -230,9 +331,10 @@ class CourseDailyMetricsViewSet(CommonAuthMixin, viewsets.ModelViewSet):
         return queryset
 
 
-class SiteDailyMetricsViewSet(CommonAuthMixin, viewsets.ModelViewSet):
+class SiteDailyMetricsViewSet(CommonAuthMixin, StreamingExportMixin, viewsets.ModelViewSet):
 
     model = SiteDailyMetrics
+    export_filename = 'site-daily-metrics'
     pagination_class = FiguresLimitOffsetPagination
     serializer_class = SiteDailyMetricsSerializer
     filter_backends = (DjangoFilterBackend, )
@@ -272,6 +374,7 @@ class GeneralSiteMetricsView(CommonAuthMixin, APIView):
         '''
         return metrics.get_monthly_site_metrics
 
+    @cache_site_response
     def get(self, request, format=None):  # pylint: disable=redefined-builtin
         '''
         Does not yet support multi-tenancy
@@ -287,7 +390,8 @@ class GeneralSiteMetricsView(CommonAuthMixin, APIView):
         return Response(data)
 
 
-class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class GeneralCourseDataViewSet(CommonAuthMixin, BulkContextListMixin,
+                               viewsets.ReadOnlyModelViewSet):
     """Viewset intended for Figures Web UI
     """
     model = CourseOverview
@@ -306,6 +410,20 @@ class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         queryset = figures.sites.get_courses_for_site(site)
         return queryset
 
+    def get_bulk_context(self, objs):
+        '''Returns the staff roles and latest CourseDailyMetrics for the courses
+        '''
+        course_ids = [str(course_overview.id) for course_overview in objs]
+        return dict(
+            site=django.contrib.sites.shortcuts.get_current_site(self.request),
+            course_staff=get_course_staff_for_courses(course_ids),
+            course_metrics=CourseDailyMetrics.latest_for_courses(course_ids))
+
+    @cache_site_response
+    def list(self, request, *args, **kwargs):
+        return super(GeneralCourseDataViewSet, self).list(request, *args, **kwargs)
+
+    @cache_site_response
     def retrieve(self, request, *args, **kwargs):
         course_id_str = kwargs.get('pk', '')
         course_key = CourseKey.from_string(course_id_str.replace(' ', '+'))
@@ -318,7 +436,7 @@ class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         return Response(GeneralCourseDataSerializer(course_overview).data)
 
 
-class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class CourseDetailsViewSet(CommonAuthMixin, BulkContextListMixin, viewsets.ReadOnlyModelViewSet):
     '''
 
     '''
@@ -336,6 +454,25 @@ class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         queryset = figures.sites.get_courses_for_site(site)
         return queryset
 
+    def get_bulk_context(self, objs):
+        '''Returns the history metrics and staff for the courses
+        '''
+        site = django.contrib.sites.shortcuts.get_current_site(self.request)
+        course_ids = [str(course_overview.id) for course_overview in objs]
+        return dict(
+            site=site,
+            course_history=metrics.get_course_history_metrics_for_courses(
+                site=site,
+                course_ids=course_ids,
+                date_for=datetime.utcnow(),
+                months_back=HISTORY_MONTHS_BACK),
+            course_staff=get_course_staff_for_courses(course_ids))
+
+    @cache_site_response
+    def list(self, request, *args, **kwargs):
+        return super(CourseDetailsViewSet, self).list(request, *args, **kwargs)
+
+    @cache_site_response
     def retrieve(self, request, *args, **kwargs):
         # NOTE: Duplicating code in GeneralCourseDataViewSet. Candidate to dry up
         # Make it a decorator
@@ -350,7 +487,8 @@ class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         return Response(CourseDetailsSerializer(course_overview).data)
 
 
-class GeneralUserDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class GeneralUserDataViewSet(CommonAuthMixin, CursorPaginationOptInMixin, StreamingExportMixin,
+                             viewsets.ReadOnlyModelViewSet):
     '''View class to serve general user data to the Figures UI
 
     See the serializer class, GeneralUserDataSerializer for the specific fields
@@ -364,6 +502,8 @@ class GeneralUserDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     '''
     model = get_user_model()
     pagination_class = FiguresKiloPagination
+    cursor_pagination_class = FiguresKiloCursorPagination
+    export_filename = 'users-general'
     serializer_class = GeneralUserDataSerializer
     filter_backends = (SearchFilter, DjangoFilterBackend, OrderingFilter)
     filter_class = UserFilterSet
@@ -375,10 +515,21 @@ class GeneralUserDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         queryset = figures.sites.get_users_for_site(site)
         return queryset
 
+    def get_list_queryset(self):
+        return super(GeneralUserDataViewSet, self).get_list_queryset().select_related(
+            'profile')
+
+    def get_bulk_context(self, objs):
+        '''Returns the courses for the users
+        '''
+        return get_general_user_data_context(user_ids=[user.id for user in objs])
+
 
-class LearnerDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class LearnerDetailsViewSet(CommonAuthMixin, CursorPaginationOptInMixin, StreamingExportMixin,
+                            viewsets.ReadOnlyModelViewSet):
     model = get_user_model()
     pagination_class = FiguresLimitOffsetPagination
+    export_filename = 'learner-details'
     serializer_class = LearnerDetailsSerializer
     filter_backends = (DjangoFilterBackend, )
     filter_class = UserFilterSet
@@ -393,6 +544,18 @@ class LearnerDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         context['site'] = django.contrib.sites.shortcuts.get_current_site(self.request)
         return context
 
+    def get_list_queryset(self):
+        return super(LearnerDetailsViewSet, self).get_list_queryset().select_related(
+            'profile')
+
+    def get_bulk_context(self, objs):
+        '''Returns the course enrollments, certificates and most recent learner
+        grades for the learners
+        '''
+        return get_learner_details_context(
+            site=django.contrib.sites.shortcuts.get_current_site(self.request),
+            user_ids=[user.id for user in objs])
+
 
 class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
     """
@@ -428,6 +591,15 @@ class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
     def historic_data(self, site, course_id, func, **_kwargs):
         date_for = _kwargs.get('date_for', datetime.utcnow().date())
         months_back = _kwargs.get('months_back', self.months_back)
+        field_name = _kwargs.get('field_name')
+        if field_name and figures.helpers.use_course_monthly_metrics():
+            return metrics.get_course_monthly_metrics_history(
+                site=site,
+                course_id=course_id,
+                field_name=field_name,
+                func=func,
+                date_for=date_for,
+                months_back=months_back)
         return get_course_history_metric(
             site=site,
             course_id=course_id,
@@ -436,6 +608,7 @@ class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
             months_back=months_back
         )
 
+    @cache_site_response
     def list(self, request):
         """
         Returns site metrics data for current month
@@ -447,6 +620,11 @@ class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         course_keys = figures.sites.get_course_keys_for_site(site)
         date_for = datetime.utcnow().date()
         month_for = '{}/{}'.format(date_for.month, date_for.year)
+        if figures.helpers.use_course_monthly_metrics():
+            return Response(metrics.get_month_course_metrics_for_courses(
+                site=site,
+                course_ids=[str(course_key) for course_key in course_keys],
+                month_for=month_for))
         data = []
         for course_key in course_keys:
             data.append(metrics.get_month_course_metrics(site=site,
@@ -454,6 +632,7 @@ class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
                                                          month_for=month_for))
         return Response(data)
 
+    @cache_site_response
     def retrieve(self, request, *args, **kwargs):
         """
         TODO: Make sure we have a test to handle invalid or empty course id
@@ -462,63 +641,86 @@ class CourseMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
 
         date_for = datetime.utcnow().date()
         month_for = '{}/{}'.format(date_for.month, date_for.year)
-        data = metrics.get_month_course_metrics(site=site,
-                                                course_id=course_id,
-                                                month_for=month_for)
+        if figures.helpers.use_course_monthly_metrics():
+            data = metrics.get_month_course_metrics_for_courses(site=site,
+                                                                course_ids=[course_id],
+                                                                month_for=month_for)[0]
+        else:
+            data = metrics.get_month_course_metrics(site=site,
+                                                    course_id=course_id,
+                                                    month_for=month_for)
         return Response(data)
 
     @detail_route()
+    @cache_site_response
     def active_users(self, request, **kwargs):
         site, course_id = self.site_course_helper(kwargs.get('pk', ''))
         date_for = datetime.utcnow().date()
         months_back = 6
-        active_users = metrics.get_course_mau_history_metrics(
-            site=site,
-            course_id=course_id,
-            date_for=date_for,
-            months_back=months_back,
-        )
+        if figures.helpers.use_course_monthly_metrics():
+            active_users = self.historic_data(
+                site=site,
+                course_id=course_id,
+                func=metrics.get_course_active_users_for_time_period,
+                field_name='active_users',
+                date_for=date_for,
+                months_back=months_back)
+        else:
+            active_users = metrics.get_course_mau_history_metrics(
+                site=site,
+                course_id=course_id,
+                date_for=date_for,
+                months_back=months_back,
+            )
         data = dict(active_users=active_users)
         return Response(data)
 
     @detail_route()
+    @cache_site_response
     def course_enrollments(self, request, *args, **kwargs):
         site, course_id = self.site_course_helper(kwargs.get('pk', ''))
         data = dict(course_enrollments=self.historic_data(
             request=request,
             site=site,
             course_id=course_id,
-            func=metrics.get_course_enrolled_users_for_time_period))
+            func=metrics.get_course_enrolled_users_for_time_period,
+            field_name='course_enrollments'))
         return Response(data)
 
     @detail_route()
+    @cache_site_response
     def num_learners_completed(self, request, *args, **kwargs):
         site, course_id = self.site_course_helper(kwargs.get('pk', ''))
         data = dict(num_learners_completed=self.historic_data(
             request=request,
             site=site,
             course_id=course_id,
-            func=metrics.get_course_num_learners_completed_for_time_period))
+            func=metrics.get_course_num_learners_completed_for_time_period,
+            field_name='num_learners_completed'))
         return Response(data)
 
     @detail_route()
+    @cache_site_response
     def avg_days_to_complete(self, request, *args, **kwargs):
         site, course_id = self.site_course_helper(kwargs.get('pk', ''))
         data = dict(avg_days_to_complete=self.historic_data(
             request=request,
             site=site,
             course_id=course_id,
-            func=metrics.get_course_average_days_to_complete_for_time_period))
+            func=metrics.get_course_average_days_to_complete_for_time_period,
+            field_name='avg_days_to_complete'))
         return Response(data)
 
     @detail_route()
+    @cache_site_response
     def avg_progress(self, request, *args, **kwargs):
         site, course_id = self.site_course_helper(kwargs.get('pk', ''))
         data = dict(avg_progress=self.historic_data(
             request=request,
             site=site,
             course_id=course_id,
-            func=metrics.get_course_average_progress_for_time_period))
+            func=metrics.get_course_average_progress_for_time_period,
+            field_name='avg_progress'))
         return Response(data)
 
 
@@ -539,6 +741,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
     Tradeoff: Additional storage cost to reduced request time
     Perhaps we make this a server setting
     """
+    @cache_site_response
     def list(self, request):
         """
         Returns site metrics data for current month
@@ -549,6 +752,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def registered_users(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         date_for = datetime.utcnow().date()
@@ -564,6 +768,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def new_users(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         date_for = datetime.utcnow().date()
@@ -579,6 +784,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def course_completions(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         date_for = datetime.utcnow().date()
@@ -594,6 +800,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def course_enrollments(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         date_for = datetime.utcnow().date()
@@ -609,6 +816,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def site_courses(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         date_for = datetime.utcnow().date()
@@ -624,6 +832,7 @@ class SiteMonthlyMetricsViewSet(CommonAuthMixin, viewsets.ViewSet):
         return Response(data)
 
     @list_route()
+    @cache_site_response
     def active_users(self, request):
         site = django.contrib.sites.shortcuts.get_current_site(self.request)
         months_back = 6
@@ -52,6 +52,7 @@ class CourseOverview(models.Model):
     display_org_with_default = models.TextField()
     number = models.TextField()
     created = models.DateTimeField(null=True) # from TimeStampedModel
+    modified = models.DateTimeField(auto_now=True, null=True) # from TimeStampedModel
     start = models.DateTimeField(null=True)
     end = models.DateTimeField(null=True)
     enrollment_start = models.DateTimeField(null=True)
@@ -0,0 +1,76 @@
+"""Benchmarks for the CourseDailyMetrics pipeline
+
+These are skipped unless the ``FIGURES_BENCHMARKS`` environment variable is
+set. Run with::
+
+    FIGURES_BENCHMARKS=1 pytest -s tests/benchmarks
+
+"""
+
+import datetime
+import time
+
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.utils.timezone import utc
+
+from student.models import CourseEnrollment
+
+from figures.compat import GeneratedCertificate
+from figures.pipeline import course_daily_metrics as pipeline_cdm
+
+from tests.factories import CourseOverviewFactory
+from tests.helpers import benchmarks_enabled
+
+
+pytestmark = pytest.mark.skipif(not benchmarks_enabled(),
+                                reason='FIGURES_BENCHMARKS is not set')
+
+BATCH_SIZE = 500
+
+
+def create_certificate_data(course_overview, count, enrolled_on):
+    """Bulk create learners, enrollments and certificates for the course
+
+    Certificates are created 1 to 100 days after enrollment
+    """
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username='bench{}'.format(i), email='bench{}@example.com'.format(i))
+         for i in range(count)],
+        batch_size=BATCH_SIZE)
+    user_ids = User.objects.filter(
+        username__startswith='bench').values_list('id', flat=True)
+    CourseEnrollment.objects.bulk_create(
+        [CourseEnrollment(user_id=user_id, course_id=course_overview.id)
+         for user_id in user_ids],
+        batch_size=BATCH_SIZE)
+    CourseEnrollment.objects.filter(
+        course_id=course_overview.id).update(created=enrolled_on)
+    GeneratedCertificate.objects.bulk_create(
+        [GeneratedCertificate(
+            user_id=user_id,
+            course_id=course_overview.id,
+            created_date=enrolled_on + datetime.timedelta(days=1 + i % 100))
+         for i, user_id in enumerate(user_ids)],
+        batch_size=BATCH_SIZE)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('cert_count', [1000, 10000, 100000])
+def test_get_days_to_complete_benchmark(cert_count):
+    enrolled_on = datetime.datetime(2018, 1, 1).replace(tzinfo=utc)
+    date_for = datetime.date(2018, 12, 31)
+    course_overview = CourseOverviewFactory()
+    create_certificate_data(course_overview, cert_count, enrolled_on)
+
+    start_time = time.time()
+    results = pipeline_cdm.get_days_to_complete(course_id=course_overview.id,
+                                                date_for=date_for)
+    elapsed_time = time.time() - start_time
+    print('\nget_days_to_complete: {} certificates in {:.3f} seconds'.format(
+        cert_count, elapsed_time))
+
+    assert len(results['days']) == cert_count
+    assert not results['errors']
@@ -0,0 +1,102 @@
+"""Benchmarks StudentModule date filtering
+
+Compares the ``__year``, ``__month`` and ``__day`` lookups Figures used to
+filter ``StudentModule.modified`` with the half-open range filters from
+``figures.helpers.window_filter``.
+
+These are skipped unless the ``FIGURES_BENCHMARKS`` environment variable is
+set. Run with::
+
+    FIGURES_BENCHMARKS=1 pytest -s tests/benchmarks
+
+"""
+
+import datetime
+import time
+
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils.timezone import utc
+
+from courseware.models import StudentModule
+
+from figures.helpers import (
+    as_course_key,
+    day_window,
+    month_window,
+    window_filter,
+)
+
+from tests.helpers import benchmarks_enabled, make_course_key_str
+
+
+pytestmark = pytest.mark.skipif(not benchmarks_enabled(),
+                                reason='FIGURES_BENCHMARKS is not set')
+
+BATCH_SIZE = 500
+ITERATIONS = 5
+
+
+def seed_student_modules(count, first_day, days):
+    """Bulk create ``count`` StudentModule records modified over ``days`` days
+
+    The production StudentModule model indexes ``modified``. The mock does not,
+    so we add the index here
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX IF NOT EXISTS bench_sm_modified '
+                       'ON courseware_studentmodule (modified)')
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username='smbench{}'.format(i), email='smbench{}@example.com'.format(i))
+         for i in range(1000)],
+        batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.filter(
+        username__startswith='smbench').values_list('id', flat=True))
+    course_key = as_course_key(make_course_key_str('bench', 'SM1'))
+    records = []
+    for i in range(count):
+        modified = first_day + datetime.timedelta(days=i % days, seconds=i % 86400)
+        records.append(StudentModule(student_id=user_ids[i % len(user_ids)],
+                                     course_id=course_key,
+                                     created=modified,
+                                     modified=modified))
+    StudentModule.objects.bulk_create(records, batch_size=BATCH_SIZE)
+
+
+def time_query(queryset):
+    start_time = time.time()
+    for _ in range(ITERATIONS):
+        count = queryset.values('student_id').distinct().count()
+    return (time.time() - start_time) / ITERATIONS, count
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('sm_count', [100000])
+def test_student_module_date_filter_benchmark(sm_count):
+    first_day = datetime.datetime(2019, 1, 1, tzinfo=utc)
+    seed_student_modules(sm_count, first_day, days=365)
+    date_for = datetime.date(2019, 6, 15)
+
+    day_extract, day_extract_count = time_query(StudentModule.objects.filter(
+        modified__year=date_for.year,
+        modified__month=date_for.month,
+        modified__day=date_for.day))
+    day_range, day_range_count = time_query(StudentModule.objects.filter(
+        **window_filter('modified', day_window(date_for))))
+    month_extract, month_extract_count = time_query(StudentModule.objects.filter(
+        modified__year=date_for.year,
+        modified__month=date_for.month))
+    month_range, month_range_count = time_query(StudentModule.objects.filter(
+        **window_filter('modified', month_window(date_for))))
+
+    print('\nStudentModule ({} records) distinct active users'.format(sm_count))
+    print('  day:   __year/__month/__day {:.4f}s, window {:.4f}s'.format(
+        day_extract, day_range))
+    print('  month: __year/__month       {:.4f}s, window {:.4f}s'.format(
+        month_extract, month_range))
+
+    assert day_extract_count == day_range_count
+    assert month_extract_count == month_range_count
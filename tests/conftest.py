@@ -3,6 +3,8 @@ from datetime import datetime
 import pytest
 from django.utils.timezone import utc
 
+import figures.sites
+
 from tests.factories import (
     CourseOverviewFactory,
     OrganizationFactory,
@@ -17,6 +19,14 @@ if organizations_support_sites():
     from tests.factories import UserOrganizationMappingFactory
 
 
+@pytest.fixture(autouse=True)
+def invalidate_site_topology():
+    """Test database changes are rolled back without sending signals, so the
+    site topology cached by a previous test may be out of date
+    """
+    figures.sites.invalidate_site_topology()
+
+
 @pytest.fixture
 @pytest.mark.django_db
 def sm_test_data(db):
@@ -51,3 +51,11 @@ def django_filters_pre_v1():
     """
     import django_filters
     return version.parse(django_filters.__version__) < version.parse('1.0.0')
+
+
+def benchmarks_enabled():
+    """Returns `True` if the ``FIGURES_BENCHMARKS`` environment variable is set
+
+    Benchmarks create large data sets and are skipped by default
+    """
+    return bool(os.environ.get('FIGURES_BENCHMARKS'))
@@ -0,0 +1,108 @@
+'''Test the figures.metrics course structure cache
+
+'''
+
+import datetime
+
+import mock
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview  # noqa pylint: disable=import-error
+
+import figures.metrics
+from figures.metrics import CourseStructureCache, LearnerCourseGrades
+
+from tests.factories import (
+    CourseEnrollmentFactory,
+    CourseOverviewFactory,
+    )
+
+
+@pytest.mark.django_db
+class TestCourseStructureCache(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.course_overviews = [CourseOverviewFactory() for i in range(3)]
+        self.load_calls = []
+        real_load_course_structure = figures.metrics.load_course_structure
+
+        def mock_load_course_structure(course_key):
+            self.load_calls.append(str(course_key))
+            return real_load_course_structure(course_key)
+
+        patcher = mock.patch('figures.metrics.load_course_structure',
+                             mock_load_course_structure)
+        patcher.start()
+        yield
+        patcher.stop()
+
+    def test_get_loads_once(self):
+        cache = CourseStructureCache()
+        course_id = self.course_overviews[0].id
+        course = cache.get_structure(course_id)
+        assert course.id == course_id
+        assert cache.get_structure(str(course_id)) is course
+        assert self.load_calls == [str(course_id)]
+        assert len(cache) == 1
+
+    def test_get_returns_learner_copies(self):
+        cache = CourseStructureCache()
+        course_id = self.course_overviews[0].id
+        courses = [cache.get(course_id) for i in range(2)]
+        assert courses[0] is not courses[1]
+        assert courses[0] is not cache.get_structure(course_id)
+        assert all(course._field_data_cache == {} for course in courses)
+        assert self.load_calls == [str(course_id)]
+
+    def test_republished_course_is_reloaded(self):
+        cache = CourseStructureCache(version_check_interval=0)
+        co = self.course_overviews[0]
+        course = cache.get_structure(co.id)
+        assert cache.get_structure(co.id) is course
+        co.modified = co.modified + datetime.timedelta(minutes=1)
+        CourseOverview.objects.filter(id=co.id).update(modified=co.modified)
+        assert cache.get_structure(co.id) is not course
+        assert self.load_calls == [str(co.id)] * 2
+        assert len(cache) == 1
+
+    def test_version_checked_once_per_interval(self):
+        cache = CourseStructureCache()
+        course_id = self.course_overviews[0].id
+        cache.get(course_id)
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(3):
+                cache.get(course_id)
+        assert len(queries) == 0
+
+    def test_evicts_least_recently_used(self):
+        cache = CourseStructureCache(max_size=2)
+        course_ids = [co.id for co in self.course_overviews]
+        cache.get(course_ids[0])
+        cache.get(course_ids[1])
+        cache.get(course_ids[0])
+        cache.get(course_ids[2])
+        assert len(cache) == 2
+        self.load_calls = []
+        cache.get(course_ids[0])
+        cache.get(course_ids[2])
+        assert not self.load_calls
+        cache.get(course_ids[1])
+        assert self.load_calls == [str(course_ids[1])]
+
+    def test_clear(self):
+        cache = CourseStructureCache()
+        cache.get(self.course_overviews[0].id)
+        cache.clear()
+        assert not len(cache)
+
+    def test_learner_course_grades_shares_structure(self):
+        figures.metrics.course_structure_cache.clear()
+        co = self.course_overviews[0]
+        enrollments = [CourseEnrollmentFactory(course_id=co.id) for i in range(3)]
+        courses = [LearnerCourseGrades(ce.user.id, ce.course_id).course
+                   for ce in enrollments]
+        assert len(set(id(course) for course in courses)) == 3
+        assert self.load_calls == [str(co.id)]
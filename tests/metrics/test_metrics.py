@@ -43,6 +43,8 @@ from dateutil.rrule import rrule, DAILY
 import pytest
 
 from django.contrib.sites.models import Site
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import utc
 
 from figures.metrics import (
@@ -51,6 +53,7 @@ from figures.metrics import (
     get_course_average_progress_for_time_period,
     get_course_enrolled_users_for_time_period,
     get_course_num_learners_completed_for_time_period,
+    get_monthly_history_metric,
     get_monthly_site_metrics,
     get_total_course_completions_for_time_period,
     get_total_enrollments_for_time_period,
@@ -381,6 +384,33 @@ class TestSiteMetricsGettersStandalone(object):
                                                              end_date=self.data_end_date)
         assert count == cdm[-1].num_learners_completed
 
+    def test_get_monthly_site_metrics_history(self):
+        '''The grouped history matches the per-month time period getters
+        '''
+        for i in range(3):
+            create_student_module_test_data(start_date=self.data_start_date,
+                                            end_date=self.data_end_date)
+        create_course_daily_metrics_data(site=self.site,
+                                         start_date=self.data_start_date,
+                                         end_date=self.data_end_date)
+        date_for = datetime.date(2018, 3, 15)
+        getters = dict(
+            monthly_active_users=get_active_users_for_time_period,
+            total_site_users=get_total_site_users_for_time_period,
+            total_site_courses=get_total_site_courses_for_time_period,
+            total_course_enrollments=get_total_enrollments_for_time_period,
+            total_course_completions=get_total_course_completions_for_time_period,
+        )
+        expected = {key: get_monthly_history_metric(func=func,
+                                                    site=self.site,
+                                                    date_for=date_for,
+                                                    months_back=6)
+                    for key, func in getters.items()}
+        with CaptureQueriesContext(connection) as ctx:
+            actual = get_monthly_site_metrics(site=self.site, date_for=date_for)
+        assert actual == expected
+        assert len(ctx.captured_queries) == len(getters)
+
     def test_get_monthly_site_metrics(self):
         '''
         Since we are testing results for individual getters in other test
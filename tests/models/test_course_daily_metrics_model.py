@@ -12,7 +12,9 @@ import pytest
 
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
 
 from opaque_keys.edx.locator import CourseLocator
 
@@ -268,3 +270,21 @@ class TestCourseDailyMetrics(object):
             course_id=course_overview.id,
             date_for=dates[0])
         assert not rec3
+
+    def test_latest_for_courses(self):
+        course_overviews = [CourseOverviewFactory() for i in range(3)]
+        for course_overview, dates in zip(course_overviews[:2], [
+                [datetime.date(2019, 10, 1), datetime.date(2019, 10, 5)],
+                [datetime.date(2019, 10, 3)]]):
+            for rec_date in dates:
+                CourseDailyMetricsFactory(site=self.site,
+                                          course_id=str(course_overview.id),
+                                          date_for=rec_date)
+
+        with CaptureQueriesContext(connection) as ctx:
+            latest = CourseDailyMetrics.latest_for_courses(
+                [course_overview.id for course_overview in course_overviews])
+        assert len(ctx.captured_queries) == 1
+        assert latest[str(course_overviews[0].id)].date_for == datetime.date(2019, 10, 5)
+        assert latest[str(course_overviews[1].id)].date_for == datetime.date(2019, 10, 3)
+        assert latest[str(course_overviews[2].id)] is None
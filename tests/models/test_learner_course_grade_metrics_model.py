@@ -6,10 +6,16 @@ import datetime
 import pytest
 
 from django.contrib.sites.models import Site
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from figures.models import LearnerCourseGradeMetrics
 
-from tests.factories import CourseEnrollmentFactory
+from tests.factories import (
+    CourseEnrollmentFactory,
+    LearnerCourseGradeMetricsFactory,
+    UserFactory,
+)
 
 
 @pytest.mark.django_db
@@ -67,6 +73,25 @@ class TestLearnerCourseGradeMetrics(object):
         assert last_day
         assert obj.date_for == last_day
 
+    def test_most_recent_for_course(self):
+        other_enrollment = CourseEnrollmentFactory(
+            course_id=self.course_enrollment.course_id)
+        expected = {}
+        for ce, last_day in [(self.course_enrollment, 3), (other_enrollment, 2)]:
+            for day in range(1, last_day + 1):
+                rec = self.create_rec.copy()
+                rec.update(dict(user=ce.user, date_for=datetime.date(2018, 2, day)))
+                obj = LearnerCourseGradeMetrics.objects.create(**rec)
+            expected[ce.user.id] = obj
+        rec = self.create_rec.copy()
+        rec['date_for'] = datetime.date(2018, 2, 4)
+        LearnerCourseGradeMetrics.objects.create(**rec)
+
+        recs = LearnerCourseGradeMetrics.objects.most_recent_for_course(
+            course_id=self.course_enrollment.course_id,
+            date_for=datetime.date(2018, 2, 3))
+        assert recs == expected
+
     def test_progress_percent(self):
         expected = (self.grade_data['sections_worked'] /
             self.grade_data['sections_possible'])
@@ -82,3 +107,26 @@ class TestLearnerCourseGradeMetrics(object):
     def test_progress_details(self):
         obj = LearnerCourseGradeMetrics(**self.create_rec)
         assert obj.progress_details == self.grade_data
+
+
+@pytest.mark.django_db
+def test_most_recent_for_learners(db):
+    users = [UserFactory() for i in range(3)]
+    course_ids = ['course-v1:StarFleetAcademy+SFA01+2161',
+                  'course-v1:StarFleetAcademy+SFA02+2161']
+    for user, course_id, date_for in [(users[0], course_ids[0], datetime.date(2019, 1, 1)),
+                                      (users[0], course_ids[0], datetime.date(2019, 1, 3)),
+                                      (users[0], course_ids[1], datetime.date(2019, 1, 2)),
+                                      (users[1], course_ids[0], datetime.date(2019, 1, 2)),
+                                      (users[2], course_ids[0], datetime.date(2019, 1, 5))]:
+        LearnerCourseGradeMetricsFactory(user=user, course_id=course_id, date_for=date_for)
+
+    with CaptureQueriesContext(connection) as ctx:
+        latest = LearnerCourseGradeMetrics.objects.most_recent_for_learners(
+            [users[0].id, users[1].id])
+    assert len(ctx.captured_queries) == 1
+    assert dict((key, rec.date_for) for key, rec in latest.items()) == {
+        (users[0].id, course_ids[0]): datetime.date(2019, 1, 3),
+        (users[0].id, course_ids[1]): datetime.date(2019, 1, 2),
+        (users[1].id, course_ids[0]): datetime.date(2019, 1, 2),
+    }
@@ -54,6 +54,32 @@ class TestCourseMauMonthlyMetrics(object):
         assert obj3 == obj2
         assert obj3.mau == data['mau']
 
+    def test_save_metrics_bulk(self):
+        course_id = str(self.course_overview.id)
+        other_course_id = str(CourseOverviewFactory().id)
+        CourseMauMetrics.save_metrics(site=self.site,
+                                      course_id=course_id,
+                                      date_for=date(2019, 10, 31),
+                                      data=dict(mau=1))
+        course_maus = {
+            (course_id, date(2019, 10, 31)): 42,
+            (course_id, date(2019, 11, 30)): 43,
+            (other_course_id, date(2019, 10, 31)): 44,
+        }
+        results = CourseMauMetrics.save_metrics_bulk(site=self.site,
+                                                     course_maus=course_maus)
+        assert results['skipped'] == [(course_id, date(2019, 10, 31))]
+        assert len(results['created']) == 2
+        assert CourseMauMetrics.objects.get(
+            course_id=course_id, date_for=date(2019, 10, 31)).mau == 1
+
+        results = CourseMauMetrics.save_metrics_bulk(site=self.site,
+                                                     course_maus=course_maus,
+                                                     overwrite=True)
+        assert len(results['updated']) == 3
+        assert {(obj.course_id, obj.date_for): obj.mau
+                for obj in CourseMauMetrics.objects.all()} == course_maus
+
     def test_latest_for_course_month(self):
         date_for = date(2019, 10, 29)
         course_id = str(self.course_overview.id)
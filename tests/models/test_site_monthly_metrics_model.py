@@ -35,3 +35,24 @@ class TestSiteDailyMetrics(object):
         assert metrics and created
         assert metrics.month_for == expected_month_for
         assert metrics.active_user_count == rec['active_user_count']
+
+    def test_add_months(self):
+        SiteMonthlyMetrics.add_month(site=self.site, year=2020, month=3,
+                                     active_user_count=1)
+        counts = {date(2020, 3, 1): 10, date(2020, 4, 1): 20}
+        results = SiteMonthlyMetrics.add_months(site=self.site,
+                                                active_user_counts=counts)
+        assert results == dict(created=[date(2020, 4, 1)],
+                               updated=[],
+                               skipped=[date(2020, 3, 1)])
+        assert dict(SiteMonthlyMetrics.objects.filter(site=self.site).values_list(
+            'month_for', 'active_user_count')) == {date(2020, 3, 1): 1,
+                                                   date(2020, 4, 1): 20}
+
+        counts[date(2020, 4, 1)] = 21
+        results = SiteMonthlyMetrics.add_months(site=self.site,
+                                                active_user_counts=counts,
+                                                overwrite=True)
+        assert results['updated'] == [date(2020, 3, 1), date(2020, 4, 1)]
+        assert dict(SiteMonthlyMetrics.objects.filter(site=self.site).values_list(
+            'month_for', 'active_user_count')) == counts
@@ -0,0 +1,145 @@
+"""Tests populating the ActiveUserBitmap model
+"""
+
+import datetime
+
+import mock
+import pytest
+from django.utils.timezone import utc
+
+from courseware.models import StudentModule  # pylint: disable=import-error
+
+from figures.models import ActiveUserBitmap
+from figures.pipeline.active_user_bitmaps import load_active_user_bitmaps
+from figures.metrics import (
+    active_user_bitmaps_cover_period,
+    get_active_user_count_from_bitmaps,
+    get_active_user_ids_from_bitmaps,
+    get_active_users_for_time_period,
+)
+
+from tests.factories import (
+    CourseOverviewFactory,
+    OrganizationFactory,
+    OrganizationCourseFactory,
+    SiteFactory,
+    StudentModuleFactory,
+    UserFactory,
+)
+from tests.helpers import organizations_support_sites
+
+if organizations_support_sites():
+    from tests.factories import UserOrganizationMappingFactory
+
+
+@pytest.mark.django_db
+class TestActiveUserBitmaps(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        self.site = SiteFactory()
+        self.courses = [CourseOverviewFactory() for i in range(2)]
+        self.users = [UserFactory() for i in range(4)]
+        self.days = [datetime.date(2019, 10, day) for day in (1, 2, 3)]
+        # (user index, course index, day index)
+        activity = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 0, 1), (2, 1, 1), (3, 1, 2)]
+        for user_index, course_index, day_index in activity:
+            modified = datetime.datetime.combine(
+                self.days[day_index], datetime.time(12)).replace(tzinfo=utc)
+            StudentModuleFactory(student=self.users[user_index],
+                                 course_id=self.courses[course_index].id,
+                                 created=modified,
+                                 modified=modified)
+        if organizations_support_sites():
+            settings.FEATURES['FIGURES_IS_MULTISITE'] = True
+            org = OrganizationFactory(sites=[self.site])
+            for course in self.courses:
+                OrganizationCourseFactory(organization=org, course_id=str(course.id))
+            for user in self.users:
+                UserOrganizationMappingFactory(user=user, organization=org)
+        for day in self.days:
+            load_active_user_bitmaps(site=self.site, date_for=day)
+
+    def user_ids(self, *indexes):
+        return sorted(self.users[i].id for i in indexes)
+
+    def test_load(self):
+        site_record = ActiveUserBitmap.objects.get(site=self.site,
+                                                   course_id='',
+                                                   date_for=self.days[0])
+        assert site_record.user_ids == self.user_ids(0, 1)
+        assert site_record.user_count == 2
+        course_record = ActiveUserBitmap.objects.get(site=self.site,
+                                                     course_id=str(self.courses[1].id),
+                                                     date_for=self.days[0])
+        assert course_record.user_ids == self.user_ids(1)
+        # No activity in the first course on the last day
+        assert not ActiveUserBitmap.objects.filter(course_id=str(self.courses[0].id),
+                                                   date_for=self.days[2]).exists()
+
+    def test_load_other_course_activity(self):
+        """The site's users' activity in courses outside the site counts for the
+        site record, as it does for ``get_active_users_for_time_period``
+        """
+        other_course = CourseOverviewFactory()
+        modified = datetime.datetime.combine(
+            self.days[2], datetime.time(12)).replace(tzinfo=utc)
+        StudentModuleFactory(student=self.users[0],
+                             course_id=other_course.id,
+                             created=modified,
+                             modified=modified)
+        site_record = load_active_user_bitmaps(site=self.site,
+                                               date_for=self.days[2],
+                                               force_update=True)
+        assert site_record.user_ids == self.user_ids(0, 3)
+        if organizations_support_sites():
+            assert not ActiveUserBitmap.objects.filter(
+                course_id=str(other_course.id)).exists()
+
+    def test_load_today(self):
+        today = datetime.datetime.utcnow().replace(tzinfo=utc).date()
+        assert load_active_user_bitmaps(site=self.site, date_for=today) is None
+        assert not ActiveUserBitmap.objects.filter(date_for=today).exists()
+
+    def test_load_existing(self):
+        site_record = ActiveUserBitmap.objects.get(site=self.site,
+                                                   course_id='',
+                                                   date_for=self.days[0])
+        assert load_active_user_bitmaps(site=self.site, date_for=self.days[0]) == site_record
+        replaced = load_active_user_bitmaps(site=self.site,
+                                            date_for=self.days[0],
+                                            force_update=True)
+        assert replaced.id != site_record.id
+        assert replaced.user_ids == site_record.user_ids
+        assert ActiveUserBitmap.objects.filter(date_for=self.days[0]).count() == 3
+
+    def test_window_queries(self):
+        assert get_active_user_ids_from_bitmaps(
+            self.site, self.days[0], self.days[2]) == self.user_ids(0, 1, 2, 3)
+        assert get_active_user_count_from_bitmaps(
+            self.site, self.days[1], self.days[2]) == 3
+        assert get_active_user_ids_from_bitmaps(
+            self.site, self.days[0], self.days[1],
+            course_id=self.courses[0].id) == self.user_ids(0, 1)
+        assert get_active_user_count_from_bitmaps(
+            self.site, self.days[2], self.days[2], course_id=self.courses[0].id) == 0
+
+    def test_cover_period(self):
+        assert active_user_bitmaps_cover_period(self.site, self.days[0], self.days[2])
+        assert not active_user_bitmaps_cover_period(
+            self.site, self.days[0], datetime.date(2019, 10, 4))
+
+    def test_active_users_for_time_period(self, settings):
+        features = dict(settings.FEATURES, FIGURES_ACTIVE_USER_BITMAPS=True)
+        expected = get_active_users_for_time_period(
+            site=self.site, start_date=self.days[0], end_date=self.days[2])
+        assert expected == 4
+        StudentModule.objects.all().delete()
+        assert get_active_users_for_time_period(
+            site=self.site, start_date=self.days[0], end_date=self.days[2]) == 0
+        with mock.patch('figures.helpers.settings.FEATURES', features):
+            assert get_active_users_for_time_period(
+                site=self.site, start_date=self.days[0], end_date=self.days[2]) == expected
+            assert get_active_users_for_time_period(
+                site=self.site, start_date=self.days[0],
+                end_date=datetime.date(2019, 10, 4)) == 0
@@ -7,21 +7,28 @@ import datetime
 import mock
 import pytest
 
+from django.contrib.sites.models import Site
 from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from courseware.models import StudentModule
 from student.models import CourseEnrollment, CourseAccessRole
 
-from figures.helpers import as_datetime, next_day, prev_day
+from figures.helpers import as_course_key, as_datetime, next_day, prev_day
 
-from figures.models import CourseDailyMetrics, PipelineError
+from figures.models import CourseDailyMetrics, LearnerCourseGradeMetrics, PipelineError
+import figures.metrics
 from figures.pipeline import course_daily_metrics as pipeline_cdm
 import figures.sites
 
 from tests.factories import (
     CourseAccessRoleFactory,
+    CourseDailyMetricsFactory,
     CourseEnrollmentFactory,
     CourseOverviewFactory,
     GeneratedCertificateFactory,
+    LearnerCourseGradeMetricsFactory,
     OrganizationFactory,
     OrganizationCourseFactory,
     SiteFactory,
@@ -178,6 +185,74 @@ class TestCourseDailyMetricsPipelineFunctions(object):
         # TODO: make the mock data more configurable so we don't have to
         # hardcode the expected value
         assert actual == 0.5
+        assert LearnerCourseGradeMetrics.objects.filter(
+            course_id=str(self.course_overview.id),
+            date_for=self.today).count() == course_enrollments.count()
+
+    @mock.patch('figures.pipeline.loaders.LearnerCourseGradesWriter.flush',
+                side_effect=Exception('mock-failure'))
+    def test_get_average_progress_flush_error(self, mock_flush):
+        """A failed grades write is logged against the course and does not
+        change the learners' progress
+        """
+        course_enrollments = CourseEnrollment.objects.filter(
+            course_id=self.course_overview.id)
+        actual = pipeline_cdm.get_average_progress(
+            course_id=self.course_overview.id,
+            date_for=self.today,
+            course_enrollments=course_enrollments
+            )
+        assert actual == 0.5
+        assert mock_flush.call_count == 1
+        assert PipelineError.objects.count() == 1
+        assert PipelineError.objects.get().user is None
+
+    def test_get_average_progress_incremental(self):
+        """
+        The first learner's grades snapshot is newer than their courseware
+        activity, so it is reused. The second learner has been active since
+        their snapshot and the rest have no snapshot, so they are regraded
+        """
+        course_enrollments = CourseEnrollment.objects.filter(
+            course_id=self.course_overview.id)
+        for ce in self.course_enrollments[:2]:
+            LearnerCourseGradeMetricsFactory(user=ce.user,
+                                             course_id=str(ce.course_id),
+                                             date_for=prev_day(self.today),
+                                             sections_worked=0,
+                                             sections_possible=2)
+        LearnerCourseGradeMetrics.objects.filter(
+            user=self.course_enrollments[1].user).update(
+                modified=as_datetime(prev_day(self.today)))
+        features = {'FIGURES_INCREMENTAL_LEARNER_GRADES': True}
+        course_progress = figures.metrics.LearnerCourseGrades.course_progress
+        with mock.patch('figures.helpers.settings.FEATURES', features):
+            with mock.patch('figures.metrics.LearnerCourseGrades.course_progress',
+                            side_effect=course_progress) as mock_course_progress:
+                actual = pipeline_cdm.get_average_progress(
+                    course_id=self.course_overview.id,
+                    date_for=self.today,
+                    course_enrollments=course_enrollments
+                    )
+        regraded = set(call[0][0].user_id for call in mock_course_progress.call_args_list)
+        assert regraded == set(ce.user_id for ce in self.course_enrollments[1:])
+        assert actual == pytest.approx(0.38)
+
+    def test_get_learner_last_activity_since(self):
+        """Only learners active after ``since`` are returned
+        """
+        first_user = self.course_enrollments[0].user
+        StudentModule.objects.filter(student=first_user).update(
+            modified=as_datetime(prev_day(prev_day(self.today))))
+        last_activity = pipeline_cdm.get_learner_last_activity(
+            course_id=self.course_overview.id, date_for=self.today)
+        assert set(last_activity.keys()) == set(ce.user_id for ce in self.course_enrollments)
+        last_activity = pipeline_cdm.get_learner_last_activity(
+            course_id=self.course_overview.id,
+            date_for=self.today,
+            since=as_datetime(prev_day(self.today)))
+        assert set(last_activity.keys()) == set(ce.user_id for ce in self.course_enrollments[1:])
+        assert last_activity[self.course_enrollments[1].user_id] == as_datetime(self.today)
 
     @mock.patch(
         'figures.metrics.LearnerCourseGrades.course_progress',
@@ -205,6 +280,19 @@ class TestCourseDailyMetricsPipelineFunctions(object):
             date_for=self.today)
         assert actual == expected
 
+    def test_get_days_to_complete_num_queries(self):
+        for ce in [CourseEnrollmentFactory(course=self.course_overview)
+                   for i in range(5)]:
+            GeneratedCertificateFactory(user=ce.user,
+                                        course_id=ce.course_id,
+                                        created_date=ce.created)
+        with CaptureQueriesContext(connection) as ctx:
+            actual = pipeline_cdm.get_days_to_complete(
+                course_id=self.course_overview.id,
+                date_for=self.today)
+        assert len(ctx.captured_queries) == 1
+        assert actual['days'] == self.cert_days_to_complete + [0] * 5
+
     def test_calc_average_days_to_complete(self):
         actual = pipeline_cdm.calc_average_days_to_complete(
             self.cert_days_to_complete)
@@ -315,3 +403,112 @@ class TestCourseDailyMetricsLoader(object):
     @pytest.mark.skip('Implement me!')
     def test_load_force_update(self):
         pass
+
+
+@pytest.mark.django_db
+class TestSiteCourseDailyMetrics(object):
+    """Tests the site level CourseDailyMetrics extractor and loader
+
+    The site level results should match what the per-course extractor returns
+    """
+    COURSE_ROLES = ['ccx_coach', 'instructor', 'staff']
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = Site.objects.first()
+        self.today = datetime.date(2018, 6, 1)
+        self.course_overviews = [CourseOverviewFactory() for i in range(3)]
+        self.course_enrollments = []
+        for co in self.course_overviews[:2]:
+            self.course_enrollments += [CourseEnrollmentFactory(
+                course_id=co.id) for i in range(4)]
+
+        # Make admins of the first three learners in the first course
+        for ce, role in zip(self.course_enrollments, self.COURSE_ROLES):
+            CourseAccessRoleFactory(user=ce.user,
+                                    course_id=ce.course_id,
+                                    role=role)
+        for ce in self.course_enrollments:
+            StudentModuleFactory(course_id=ce.course_id,
+                                 student=ce.user,
+                                 created=ce.created,
+                                 modified=as_datetime(self.today))
+        for ce in self.course_enrollments[:2]:
+            GeneratedCertificateFactory(
+                user=ce.user,
+                course_id=ce.course_id,
+                created_date=ce.created + datetime.timedelta(days=10))
+        self.course_keys = [co.id for co in self.course_overviews]
+
+    def test_grouped_counts(self):
+        admin_ids = figures.sites.get_course_admin_user_ids(self.course_keys)
+        enrollment_counts = pipeline_cdm.get_enrollment_counts(
+            self.course_keys, self.today, admin_ids)
+        active_counts = pipeline_cdm.get_active_learner_counts_today(
+            self.course_keys, self.today)
+        completed_counts = pipeline_cdm.get_num_learners_completed_counts(
+            self.course_keys, self.today)
+        for course_key in self.course_keys:
+            course_id = str(course_key)
+            assert enrollment_counts[course_id] == pipeline_cdm.get_enrolled_in_exclude_admins(
+                course_key, self.today).count()
+            assert active_counts[course_id] == pipeline_cdm.get_active_learner_ids_today(
+                course_key, self.today).count()
+            assert completed_counts[course_id] == pipeline_cdm.get_num_learners_completed(
+                course_key, self.today)
+
+    def test_extract_matches_course_extractor(self):
+        results = pipeline_cdm.SiteCourseDailyMetricsExtractor(batch_size=2).extract(
+            site=self.site,
+            course_keys=self.course_keys,
+            date_for=self.today)
+        assert len(results) == len(self.course_keys)
+        for data in results:
+            expected = pipeline_cdm.CourseDailyMetricsExtractor().extract(
+                course_id=as_course_key(data['course_id']), date_for=self.today)
+            for key in ['enrollment_count', 'active_learners_today',
+                        'average_progress', 'average_days_to_complete',
+                        'num_learners_completed']:
+                assert data[key] == expected[key]
+
+    def test_load(self):
+        results = pipeline_cdm.SiteCourseDailyMetricsLoader(site=self.site).load(
+            date_for=self.today)
+        assert set(results['created']) == set(str(key) for key in self.course_keys)
+        assert not results['updated'] and not results['skipped'] and not results['failed']
+        assert CourseDailyMetrics.objects.filter(
+            site=self.site, date_for=self.today).count() == len(self.course_keys)
+
+        results = pipeline_cdm.SiteCourseDailyMetricsLoader(site=self.site).load(
+            date_for=self.today)
+        assert len(results['skipped']) == len(self.course_keys)
+        assert not results['created'] and not results['updated']
+
+    def test_load_force_update(self):
+        course_id = str(self.course_keys[0])
+        existing = CourseDailyMetricsFactory(site=self.site,
+                                             date_for=self.today,
+                                             course_id=course_id,
+                                             enrollment_count=100)
+        results = pipeline_cdm.SiteCourseDailyMetricsLoader(site=self.site).load(
+            date_for=self.today, force_update=True)
+        assert results['updated'] == [course_id]
+        assert len(results['created']) == len(self.course_keys) - 1
+        existing.refresh_from_db()
+        assert existing.enrollment_count == 1
+
+    def test_load_extract_failure(self, monkeypatch):
+        failing_course_id = str(self.course_keys[1])
+
+        def mock_get_average_days_to_complete(course_id, date_for):
+            if str(course_id) == failing_course_id:
+                raise Exception('mock-failure')
+            return 0.0
+
+        monkeypatch.setattr(pipeline_cdm, 'get_average_days_to_complete',
+                            mock_get_average_days_to_complete)
+        results = pipeline_cdm.SiteCourseDailyMetricsLoader(site=self.site).load(
+            date_for=self.today)
+        assert results['failed'] == [failing_course_id]
+        assert PipelineError.objects.filter(course_id=failing_course_id).count() == 1
+        assert not CourseDailyMetrics.objects.filter(course_id=failing_course_id).exists()
@@ -10,12 +10,18 @@ from mock import Mock
 
 from factory import fuzzy
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from figures.models import CourseMauMetrics
 from figures.pipeline.mau_pipeline import (
     get_all_mau_for_site_course,
     calculate_course_mau,
     save_course_mau,
     collect_course_mau,
+    collect_site_course_mau,
 )
+from figures.sites import get_course_keys_for_site
 
 from tests.factories import (
     SiteFactory,
@@ -141,6 +147,40 @@ def test_course_mau_etl(simple_mau_test_data):
     assert obj.mau == len(expected_mau_ids)
 
 
+@pytest.mark.django_db
+def test_site_course_mau_etl(simple_mau_test_data):
+    """
+    Test that all the site's course MAUs are counted with one grouped query and
+    saved in bulk
+    """
+    our_site = simple_mau_test_data['our_site']
+    our_course = simple_mau_test_data['our_course']
+    month_for = simple_mau_test_data['month_for']
+    expected_mau_ids = simple_mau_test_data['expected_mau_ids']
+    [CourseOverviewFactory() for i in range(5)]
+
+    with CaptureQueriesContext(connection) as ctx:
+        results = collect_site_course_mau(site=our_site, month_for=month_for)
+    # Does not depend on the number of courses
+    assert len(ctx.captured_queries) <= 8
+
+    assert set(key[0] for key in results['created']) == set(
+        str(key) for key in get_course_keys_for_site(our_site))
+    maus = dict(CourseMauMetrics.objects.filter(
+        site=our_site, date_for=month_for).values_list('course_id', 'mau'))
+    assert maus.pop(str(our_course.id)) == len(expected_mau_ids)
+    # The other course's records have random dates, some may be in the month
+    other_course_sm = simple_mau_test_data['our_other_course_sm']
+    assert maus.pop(str(simple_mau_test_data['our_other_course'].id)) == len(set(
+        rec.student_id for rec in other_course_sm
+        if (rec.modified.year, rec.modified.month) == (month_for.year, month_for.month)))
+    assert set(maus.values()) <= set([0])
+
+    results = collect_site_course_mau(site=our_site, month_for=month_for)
+    assert not results['created']
+    assert len(results['skipped']) == len(maus) + 2
+
+
 @pytest.mark.django_db
 class TestExtractMauData(object):
     """
@@ -0,0 +1,129 @@
+"""Tests populating and reading the CourseMonthlyMetrics model
+"""
+
+import datetime
+
+import pytest
+from django.utils.timezone import utc
+
+from figures.metrics import (
+    get_course_average_progress_for_time_period,
+    get_course_monthly_metrics_history,
+    get_month_course_metrics,
+    get_month_course_metrics_for_courses,
+)
+from figures.models import CourseMonthlyMetrics
+from figures.pipeline.course_monthly_metrics import load_course_monthly_metrics
+
+from tests.factories import (
+    CourseDailyMetricsFactory,
+    CourseOverviewFactory,
+    OrganizationFactory,
+    OrganizationCourseFactory,
+    SiteFactory,
+    StudentModuleFactory,
+    UserFactory,
+)
+from tests.helpers import organizations_support_sites
+
+if organizations_support_sites():
+    from tests.factories import UserOrganizationMappingFactory
+
+
+@pytest.mark.django_db
+class TestCourseMonthlyMetrics(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        self.site = SiteFactory()
+        self.courses = [CourseOverviewFactory() for i in range(3)]
+        self.course_ids = [str(course.id) for course in self.courses]
+        self.users = [UserFactory() for i in range(3)]
+        self.month_for = datetime.date(2019, 10, 1)
+        # No activity or daily metrics for the third course
+        for user_index, course_index in [(0, 0), (1, 0), (2, 1)]:
+            modified = datetime.datetime(2019, 10, 5, 12).replace(tzinfo=utc)
+            StudentModuleFactory(student=self.users[user_index],
+                                 course_id=self.courses[course_index].id,
+                                 created=modified,
+                                 modified=modified)
+        for course_index, day, enrollments, progress, days in [(0, 1, 10, 0.2, 3),
+                                                                (0, 31, 12, 0.35, 6),
+                                                                (1, 15, 4, 0.5, 2),
+                                                                (0, 1, 99, 0.9, 9)]:
+            date_for = datetime.date(2019, 10, day)
+            if enrollments == 99:
+                # Outside the month
+                date_for = datetime.date(2019, 11, 1)
+            CourseDailyMetricsFactory(site=self.site,
+                                      course_id=self.course_ids[course_index],
+                                      date_for=date_for,
+                                      enrollment_count=enrollments,
+                                      num_learners_completed=enrollments // 2,
+                                      average_progress=progress,
+                                      average_days_to_complete=days)
+        if organizations_support_sites():
+            settings.FEATURES['FIGURES_IS_MULTISITE'] = True
+            org = OrganizationFactory(sites=[self.site])
+            for course_id in self.course_ids:
+                OrganizationCourseFactory(organization=org, course_id=course_id)
+            for user in self.users:
+                UserOrganizationMappingFactory(user=user, organization=org)
+
+    def test_load_matches_month_course_metrics(self):
+        results = load_course_monthly_metrics(site=self.site, month_for=self.month_for)
+        assert results == dict(created=3, updated=0)
+        assert CourseMonthlyMetrics.objects.filter(site=self.site).count() == 3
+        month_for = '10/2019'
+        expected = [get_month_course_metrics(site=self.site,
+                                             course_id=course_id,
+                                             month_for=month_for)
+                    for course_id in self.course_ids]
+        assert get_month_course_metrics_for_courses(
+            site=self.site, course_ids=self.course_ids, month_for=month_for) == expected
+
+    def test_load_updates_existing(self):
+        load_course_monthly_metrics(site=self.site, month_for=self.month_for)
+        CourseDailyMetricsFactory(site=self.site,
+                                  course_id=self.course_ids[2],
+                                  date_for=datetime.date(2019, 10, 20),
+                                  enrollment_count=7)
+        results = load_course_monthly_metrics(site=self.site,
+                                              month_for=datetime.date(2019, 10, 20))
+        assert results == dict(created=0, updated=3)
+        record = CourseMonthlyMetrics.objects.get(site=self.site,
+                                                  course_id=self.course_ids[2],
+                                                  month_for=self.month_for)
+        assert record.course_enrollments == 7
+
+    def test_missing_records_fall_back(self):
+        CourseMonthlyMetrics.objects.create(site=self.site,
+                                            course_id=self.course_ids[0],
+                                            month_for=self.month_for,
+                                            active_users=42,
+                                            course_enrollments=1,
+                                            num_learners_completed=1,
+                                            avg_days_to_complete=1,
+                                            avg_progress=0.1)
+        data = get_month_course_metrics_for_courses(site=self.site,
+                                                    course_ids=self.course_ids[:2],
+                                                    month_for='10/2019')
+        assert data[0]['active_users'] == 42
+        assert data[1] == get_month_course_metrics(site=self.site,
+                                                   course_id=self.course_ids[1],
+                                                   month_for='10/2019')
+
+    def test_history(self):
+        load_course_monthly_metrics(site=self.site, month_for=self.month_for)
+        history = get_course_monthly_metrics_history(
+            site=self.site,
+            course_id=self.course_ids[0],
+            field_name='avg_progress',
+            func=get_course_average_progress_for_time_period,
+            date_for=datetime.date(2019, 11, 2),
+            months_back=1)
+        # October is read from the record. November has no record
+        assert history == dict(
+            current_month=0.9,
+            history=[dict(period='2019/10', value=0.28),
+                     dict(period='2019/11', value=0.9)])
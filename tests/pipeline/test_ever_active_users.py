@@ -0,0 +1,140 @@
+"""Tests maintaining the SiteEverActiveUsers model
+"""
+
+import datetime
+
+import mock
+import pytest
+from django.utils.timezone import utc
+
+from figures.models import SiteDailyMetrics, SiteEverActiveUsers
+from figures.pipeline.ever_active_users import (
+    rebuild_ever_active_users,
+    update_ever_active_users,
+)
+from figures.pipeline.site_daily_metrics import SiteDailyMetricsLoader
+
+from tests.factories import (
+    CourseOverviewFactory,
+    OrganizationFactory,
+    OrganizationCourseFactory,
+    SiteDailyMetricsFactory,
+    SiteFactory,
+    StudentModuleFactory,
+    UserFactory,
+)
+from tests.helpers import organizations_support_sites
+
+if organizations_support_sites():
+    from tests.factories import UserOrganizationMappingFactory
+
+
+@pytest.mark.django_db
+class TestEverActiveUsers(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        self.site = SiteFactory()
+        self.courses = [CourseOverviewFactory() for i in range(2)]
+        self.users = [UserFactory() for i in range(3)]
+        self.days = [datetime.date(2019, 10, day) for day in (1, 2, 3, 4)]
+        # (user index, course index, day index). Nobody is active on day 2
+        activity = [(0, 0, 0), (1, 1, 0), (0, 1, 1), (1, 0, 1), (2, 0, 3), (0, 0, 3)]
+        for user_index, course_index, day_index in activity:
+            self.add_activity(self.users[user_index], course_index, self.days[day_index])
+        if organizations_support_sites():
+            settings.FEATURES['FIGURES_IS_MULTISITE'] = True
+            self.org = OrganizationFactory(sites=[self.site])
+            for course in self.courses:
+                OrganizationCourseFactory(organization=self.org, course_id=str(course.id))
+            for user in self.users:
+                UserOrganizationMappingFactory(user=user, organization=self.org)
+
+    def add_activity(self, user, course_index, day, hour=12):
+        modified = datetime.datetime.combine(day, datetime.time(hour)).replace(tzinfo=utc)
+        StudentModuleFactory(student=user,
+                             course_id=self.courses[course_index].id,
+                             created=modified,
+                             modified=modified)
+
+    def test_rebuild(self):
+        sdms = [SiteDailyMetricsFactory(site=self.site,
+                                        date_for=day,
+                                        cumulative_active_user_count=100)
+                for day in self.days]
+        ever_active = rebuild_ever_active_users(site=self.site, date_for=self.days[2])
+        assert ever_active.user_count == 2
+        assert ever_active.date_for == self.days[2]
+        counts = [SiteDailyMetrics.objects.get(id=sdm.id).cumulative_active_user_count
+                  for sdm in sdms]
+        # The last day is after the rebuild date so it is left alone
+        assert counts == [2, 2, 2, 100]
+
+        ever_active = rebuild_ever_active_users(site=self.site, date_for=self.days[3])
+        assert ever_active.user_count == 3
+        assert SiteEverActiveUsers.objects.filter(site=self.site).count() == 1
+
+    def test_update(self):
+        assert update_ever_active_users(site=self.site, date_for=self.days[0]) is None
+        rebuild_ever_active_users(site=self.site, date_for=self.days[0])
+        assert update_ever_active_users(site=self.site, date_for=self.days[1]) == 2
+        # Skips day 2 and catches up
+        assert update_ever_active_users(site=self.site, date_for=self.days[3]) == 3
+        # Rerunning the same day does not count anyone twice
+        assert update_ever_active_users(site=self.site, date_for=self.days[3]) == 3
+        assert update_ever_active_users(site=self.site, date_for=self.days[2]) is None
+
+    def test_update_activity_after_run(self):
+        """Activity later on the day of a run is added by the next run
+        """
+        rebuild_ever_active_users(site=self.site, date_for=self.days[1])
+        assert update_ever_active_users(site=self.site, date_for=self.days[3]) == 3
+        user = UserFactory()
+        if organizations_support_sites():
+            UserOrganizationMappingFactory(user=user, organization=self.org)
+        self.add_activity(user, 0, self.days[3], hour=20)
+        next_day = datetime.date(2019, 10, 5)
+        assert update_ever_active_users(site=self.site, date_for=next_day) == 4
+        ever_active = SiteEverActiveUsers.objects.get(site=self.site)
+        assert ever_active.activity_through == datetime.datetime.combine(
+            self.days[3], datetime.time(20)).replace(tzinfo=utc)
+
+    @pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS': True}, [2, 2, 2, 3]),
+        ({}, [2, 4, 4, 6]),
+    ])
+    def test_load_cumulative_active_user_count(self, features, expected):
+        rebuild_ever_active_users(site=self.site, date_for=self.days[0])
+        SiteDailyMetricsFactory(site=self.site,
+                                date_for=self.days[0],
+                                cumulative_active_user_count=2)
+        counts = [2]
+        with mock.patch('figures.helpers.settings.FEATURES', features):
+            for day in self.days[1:]:
+                site_metrics, _ = SiteDailyMetricsLoader().load(site=self.site, date_for=day)
+                counts.append(site_metrics.cumulative_active_user_count)
+        assert counts == expected
+
+    def test_load_logs_fallback(self):
+        features = {'FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS': True}
+        with mock.patch('figures.helpers.settings.FEATURES', features):
+            with mock.patch('figures.pipeline.site_daily_metrics.logger') as mock_logger:
+                site_metrics, _ = SiteDailyMetricsLoader().load(site=self.site,
+                                                                date_for=self.days[0])
+        assert site_metrics.cumulative_active_user_count == 2
+        assert mock_logger.warning.call_count == 1
+
+    def test_load_failure_keeps_set(self):
+        """The set is not advanced when the site daily metrics record is not saved
+        """
+        ever_active = rebuild_ever_active_users(site=self.site, date_for=self.days[0])
+        features = {'FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS': True}
+
+        def save(*args, **kwargs):
+            raise ValueError('save failed')
+
+        with mock.patch('figures.helpers.settings.FEATURES', features):
+            with mock.patch.object(SiteDailyMetrics, 'save', save):
+                with pytest.raises(ValueError):
+                    SiteDailyMetricsLoader().load(site=self.site, date_for=self.days[1])
+        assert SiteEverActiveUsers.objects.get(site=self.site).date_for == ever_active.date_for
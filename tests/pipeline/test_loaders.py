@@ -45,3 +45,76 @@ class TestSaveLearnerCourseGrades(object):
         assert obj.points_earned == details['points_earned']
         assert obj.sections_worked == details['sections_worked']
         assert obj.sections_possible == details['count']
+
+
+@pytest.mark.django_db
+class TestLearnerCourseGradesWriter(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = Site.objects.first()
+        self.date_for = datetime.date(2018, 2, 2)
+        self.course_enrollments = [CourseEnrollmentFactory() for i in range(3)]
+        self.details = dict(
+            points_possible=10.0,
+            points_earned=5.0,
+            sections_worked=15,
+            count=20,
+            )
+
+    def test_create_and_update(self):
+        ce = self.course_enrollments[0]
+        figures.pipeline.loaders.save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for,
+            course_enrollment=ce,
+            course_progress_details=dict(points_possible=1.0,
+                                         points_earned=0.0,
+                                         sections_worked=0,
+                                         count=1))
+        writer = figures.pipeline.loaders.LearnerCourseGradesWriter(site=self.site)
+        for ce in self.course_enrollments:
+            writer.add(date_for=self.date_for,
+                       course_enrollment=ce,
+                       course_progress_details=self.details)
+        assert LearnerCourseGradeMetrics.objects.count() == 1
+        assert writer.flush() == dict(created=2, updated=1)
+        assert (writer.created, writer.updated) == (2, 1)
+        assert LearnerCourseGradeMetrics.objects.count() == 3
+        for ce in self.course_enrollments:
+            obj = LearnerCourseGradeMetrics.objects.get(
+                user=ce.user, course_id=str(ce.course_id), date_for=self.date_for)
+            assert obj.site == self.site
+            assert obj.points_possible == self.details['points_possible']
+            assert obj.points_earned == self.details['points_earned']
+            assert obj.sections_worked == self.details['sections_worked']
+            assert obj.sections_possible == self.details['count']
+        assert writer.flush() == dict(created=0, updated=0)
+
+    def test_same_learner_added_twice(self):
+        ce = self.course_enrollments[0]
+        writer = figures.pipeline.loaders.LearnerCourseGradesWriter(site=self.site)
+        writer.add(date_for=self.date_for,
+                   course_enrollment=ce,
+                   course_progress_details=dict(self.details, sections_worked=1))
+        writer.add(date_for=str(self.date_for),
+                   course_enrollment=ce,
+                   course_progress_details=self.details)
+        assert writer.flush() == dict(created=1, updated=0)
+        obj = LearnerCourseGradeMetrics.objects.get(user=ce.user)
+        assert obj.sections_worked == self.details['sections_worked']
+
+    def test_flushes_when_batch_is_full(self):
+        writer = figures.pipeline.loaders.LearnerCourseGradesWriter(site=self.site,
+                                                                    batch_size=2)
+        for ce in self.course_enrollments:
+            count = LearnerCourseGradeMetrics.objects.count()
+            writer.add(date_for=self.date_for,
+                       course_enrollment=ce,
+                       course_progress_details=self.details)
+            assert LearnerCourseGradeMetrics.objects.count() == count
+            writer.flush_if_full()
+        assert LearnerCourseGradeMetrics.objects.count() == 2
+        writer.flush()
+        assert LearnerCourseGradeMetrics.objects.count() == 3
+        assert writer.created == 3
@@ -0,0 +1,160 @@
+"""Tests the pipeline run ledger in figures.pipeline.runs
+
+"""
+
+import datetime
+import pytest
+
+from django.contrib.sites.models import Site
+from django.utils.timezone import now
+
+from figures.models import PipelineCourseRun, PipelineSiteRun
+import figures.pipeline.runs as runs
+
+from tests.factories import CourseOverviewFactory
+
+
+@pytest.mark.django_db
+class TestPipelineRuns(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = Site.objects.first()
+        self.date_for = datetime.date(2019, 10, 1)
+        self.course_ids = [str(CourseOverviewFactory().id) for i in range(3)]
+
+    def test_start_site_run(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        assert site_run.status == PipelineSiteRun.RUNNING
+        assert site_run.site_metrics_status == PipelineSiteRun.PENDING
+        assert site_run.course_count == 3
+        assert site_run.finished_course_count == 0
+        assert set(site_run.course_runs.values_list('course_id', flat=True)) == set(
+            self.course_ids)
+        assert not site_run.course_runs.exclude(status=PipelineSiteRun.PENDING).exists()
+
+    def test_restart_site_run(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        runs.finish_course_run(runs.claim_course_run(site_run), succeeded=True)
+        restarted = runs.start_site_run(self.site, str(self.date_for), self.course_ids[:2])
+        assert restarted.id == site_run.id
+        assert restarted.course_count == 2
+        assert restarted.finished_course_count == 0
+        assert PipelineCourseRun.objects.filter(
+            site_run=restarted, status=PipelineSiteRun.PENDING).count() == 2
+
+    def test_claim_course_runs(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        claimed = [runs.claim_course_run(site_run) for i in range(3)]
+        assert [cr.course_id for cr in claimed] == self.course_ids
+        assert runs.claim_course_run(site_run) is None
+        assert not site_run.course_runs.exclude(status=PipelineSiteRun.RUNNING).exists()
+
+    def test_site_metrics_barrier(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        course_runs = [runs.claim_course_run(site_run) for i in range(3)]
+        assert runs.finish_course_run(course_runs[0], succeeded=True)
+        # Finishing the same course twice only counts once
+        assert not runs.finish_course_run(course_runs[0], succeeded=True)
+        assert runs.finish_course_run(course_runs[1], succeeded=False)
+        assert not runs.claim_site_metrics(site_run)
+        assert runs.finish_course_run(course_runs[2], succeeded=True)
+        assert PipelineSiteRun.objects.get(id=site_run.id).finished_course_count == 3
+        assert runs.claim_site_metrics(site_run)
+        assert not runs.claim_site_metrics(site_run)
+
+    def test_claim_stale_course_run(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids[:2])
+        stale, running = [runs.claim_course_run(site_run) for i in range(2)]
+        assert runs.claim_course_run(site_run) is None
+        PipelineCourseRun.objects.filter(id=stale.id).update(
+            modified=now() - runs.RUN_CLAIM_TIMEOUT - datetime.timedelta(minutes=1))
+        reclaimed = runs.claim_course_run(site_run)
+        assert reclaimed.id == stale.id
+        assert reclaimed.status == PipelineSiteRun.RUNNING
+        assert runs.claim_course_run(site_run) is None
+        # The course is counted once when both tasks finish
+        assert runs.finish_course_run(reclaimed, succeeded=True)
+        assert not runs.finish_course_run(stale, succeeded=True)
+        assert runs.finish_course_run(running, succeeded=True)
+        assert PipelineSiteRun.objects.get(id=site_run.id).finished_course_count == 2
+
+    def test_claim_stale_site_metrics(self):
+        site_run = runs.start_site_run(self.site, self.date_for, [])
+        assert runs.claim_site_metrics(site_run)
+        assert not runs.claim_site_metrics(site_run)
+        PipelineSiteRun.objects.filter(id=site_run.id).update(
+            modified=now() - runs.RUN_CLAIM_TIMEOUT - datetime.timedelta(minutes=1))
+        assert runs.claim_site_metrics(site_run)
+
+    def test_running_and_stalled_site_runs(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        assert runs.running_site_run(self.site, str(self.date_for)).id == site_run.id
+        assert not runs.running_site_run(self.site, datetime.date(2019, 10, 2))
+        assert not runs.stalled_site_runs().exists()
+        PipelineSiteRun.objects.filter(id=site_run.id).update(
+            modified=now() - runs.RUN_CLAIM_TIMEOUT - datetime.timedelta(minutes=1))
+        assert list(runs.stalled_site_runs()) == [site_run]
+        runs.finish_site_run(site_run, succeeded=True)
+        assert not runs.running_site_run(self.site, self.date_for)
+        assert not runs.stalled_site_runs().exists()
+
+    @pytest.mark.parametrize('course_succeeded, site_succeeded, expected_status', [
+        (True, True, PipelineSiteRun.SUCCEEDED),
+        (False, True, PipelineSiteRun.FAILED),
+        (True, False, PipelineSiteRun.FAILED),
+    ])
+    def test_finish_site_run(self, course_succeeded, site_succeeded, expected_status):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids[:1])
+        runs.finish_course_run(runs.claim_course_run(site_run),
+                               succeeded=course_succeeded)
+        assert runs.claim_site_metrics(site_run)
+        runs.finish_site_run(site_run, succeeded=site_succeeded)
+        site_run = PipelineSiteRun.objects.get(id=site_run.id)
+        assert site_run.status == expected_status
+        expected_site_metrics_status = (PipelineSiteRun.SUCCEEDED if site_succeeded
+                                        else PipelineSiteRun.FAILED)
+        assert site_run.site_metrics_status == expected_site_metrics_status
+
+    def test_claim_all_course_runs(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        claimed = runs.claim_course_runs(site_run)
+        assert [cr.course_id for cr in claimed] == self.course_ids
+        assert runs.claim_course_runs(site_run) == []
+        assert not site_run.course_runs.exclude(status=PipelineSiteRun.RUNNING).exists()
+
+    def test_resume_site_run_without_run(self):
+        site_run = runs.resume_site_run(self.site, self.date_for, self.course_ids)
+        assert site_run.status == PipelineSiteRun.RUNNING
+        assert site_run.course_runs.filter(status=PipelineSiteRun.PENDING).count() == 3
+
+    def test_resume_site_run(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        course_runs = runs.claim_course_runs(site_run)
+        runs.finish_course_run(course_runs[0], succeeded=True)
+        runs.finish_course_run(course_runs[1], succeeded=False)
+        # course_runs[2] was left running by a stopped worker
+        new_course_id = str(CourseOverviewFactory().id)
+        course_ids = self.course_ids[:2] + [new_course_id]
+
+        resumed = runs.resume_site_run(self.site, self.date_for, course_ids)
+        assert resumed.id == site_run.id
+        assert resumed.status == PipelineSiteRun.RUNNING
+        assert resumed.site_metrics_status == PipelineSiteRun.PENDING
+        assert resumed.course_count == 3
+        assert resumed.finished_course_count == 1
+        assert dict(resumed.course_runs.values_list('course_id', 'status')) == {
+            self.course_ids[0]: PipelineSiteRun.SUCCEEDED,
+            self.course_ids[1]: PipelineSiteRun.PENDING,
+            new_course_id: PipelineSiteRun.PENDING,
+        }
+
+    def test_resume_finished_site_run(self):
+        site_run = runs.start_site_run(self.site, self.date_for, self.course_ids)
+        for course_run in runs.claim_course_runs(site_run):
+            runs.finish_course_run(course_run, succeeded=True)
+        assert runs.claim_site_metrics(site_run)
+        runs.finish_site_run(site_run, succeeded=True)
+        resumed = runs.resume_site_run(self.site, self.date_for, self.course_ids)
+        assert resumed.status == PipelineSiteRun.SUCCEEDED
+        assert runs.claim_course_runs(resumed) == []
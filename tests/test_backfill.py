@@ -1,13 +1,21 @@
 """Tests the figures.backfill module
 """
-from datetime import datetime
+from datetime import date, datetime
 import pytest
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import rrule, MONTHLY
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import utc
 
-from figures.backfill import backfill_monthly_metrics_for_site
-from figures.models import SiteMonthlyMetrics
+from figures.backfill import (
+    backfill_course_daily_metrics_for_site,
+    backfill_daily_metrics,
+    backfill_monthly_mau_for_site,
+    backfill_monthly_metrics_for_site,
+)
+from figures.helpers import days_in_month
+from figures.models import CourseMauMetrics, PipelineError, SiteMonthlyMetrics
 
 from tests.factories import (
     CourseOverviewFactory,
@@ -101,3 +109,126 @@ def test_backfill_monthly_metrics_for_site(backfill_test_data):
         assert rec['obj'].active_user_count == check_rec['sm_count']
         assert rec['obj'].month_for.year == check_rec['month'].year
         assert rec['obj'].month_for.month == check_rec['month'].month
+
+
+def test_backfill_monthly_mau_for_site(backfill_test_data):
+    site = backfill_test_data['site']
+    course_id = str(backfill_test_data['course_overview'][0].id)
+    count_check = backfill_test_data['count_check']
+
+    results = backfill_monthly_mau_for_site(site=site)
+    assert len(results['site_months']['created']) == len(count_check)
+    assert len(results['course_months']['created']) == len(count_check)
+    for check_rec in count_check:
+        month = check_rec['month']
+        mau = CourseMauMetrics.objects.get(
+            site=site,
+            course_id=course_id,
+            date_for=month.date().replace(day=days_in_month(month)))
+        assert mau.mau == check_rec['sm_count']
+
+    # Backfilling again without overwrite leaves the records alone
+    results = backfill_monthly_mau_for_site(site=site)
+    assert len(results['site_months']['skipped']) == len(count_check)
+    assert len(results['course_months']['skipped']) == len(count_check)
+
+
+def test_backfill_monthly_mau_num_queries(backfill_test_data):
+    """The number of queries does not depend on the number of months
+    """
+    site = backfill_test_data['site']
+    with CaptureQueriesContext(connection) as ctx:
+        backfill_monthly_mau_for_site(site=site, overwrite=True)
+    assert len(ctx.captured_queries) <= 12
+
+
+@pytest.mark.django_db
+def test_backfill_daily_metrics(monkeypatch):
+    site = SiteFactory()
+    courses = [CourseOverviewFactory() for i in range(2)]
+    course_days = []
+    site_days = []
+    statuses = []
+
+    def mock_cdm_load(self, date_for, force_update, **kwargs):
+        course_days.append((str(self.course_id), date_for))
+
+    def mock_sdm_load(self, site, date_for, force_update, **kwargs):
+        site_days.append((site, date_for))
+
+    monkeypatch.setattr('figures.backfill.get_course_keys_for_site',
+                        lambda site: [course.id for course in courses])
+    monkeypatch.setattr(
+        'figures.backfill.CourseDailyMetricsLoader.__init__',
+        lambda self, course_id: setattr(self, 'course_id', course_id))
+    monkeypatch.setattr('figures.backfill.CourseDailyMetricsLoader.load', mock_cdm_load)
+    monkeypatch.setattr('figures.backfill.SiteDailyMetricsLoader.load', mock_sdm_load)
+
+    results = backfill_daily_metrics(start_date='2019-01-30',
+                                     end_date='2019-02-02',
+                                     sites=[site],
+                                     workers=1,
+                                     report=statuses.append)
+
+    dates = [date(2019, 1, 30), date(2019, 1, 31), date(2019, 2, 1), date(2019, 2, 2)]
+    assert sorted(course_days) == sorted(
+        (str(course.id), date_for) for course in courses for date_for in dates)
+    # Site metrics are populated in date order
+    assert site_days == [(site, date_for) for date_for in dates]
+    assert results['course_failures'] == 0
+    assert results['course_progress'].done == 4
+    assert results['site_progress'].done == 4
+    assert [(s['stage'], s['done']) for s in statuses][-1] == ('site daily metrics', 4)
+    assert all(s['total'] == 4 for s in statuses)
+
+
+@pytest.mark.django_db
+def test_backfill_daily_metrics_failures(monkeypatch):
+    """Failed units and dates are recorded and the backfill continues. A
+    site's dates stop at its first failed date
+    """
+    sites = [SiteFactory(), SiteFactory()]
+    site_days = []
+
+    def mock_course_keys(site):
+        if site == sites[0]:
+            raise Exception('mock site course failure')
+        return []
+
+    def mock_sdm_load(self, site, date_for, force_update, **kwargs):
+        if date_for == date(2019, 1, 31):
+            raise Exception('mock site failure')
+        site_days.append((site, date_for))
+
+    monkeypatch.setattr('figures.backfill.get_course_keys_for_site', mock_course_keys)
+    monkeypatch.setattr('figures.backfill.SiteDailyMetricsLoader.load', mock_sdm_load)
+
+    results = backfill_daily_metrics(start_date='2019-01-30',
+                                     end_date='2019-02-01',
+                                     sites=sites,
+                                     workers=1)
+    assert results['course_failures'] == 3
+    assert results['site_failures'] == 2
+    assert results['course_progress'].done == 6
+    assert results['site_progress'].done == 2
+    assert site_days == [(site, date(2019, 1, 30)) for site in sites]
+    assert results['skipped_site_dates'] == dict(
+        (site.id, [date(2019, 1, 31), date(2019, 2, 1)]) for site in sites)
+    assert PipelineError.objects.filter(site=sites[0]).count() == 4
+    assert PipelineError.objects.filter(site=sites[1]).count() == 1
+
+
+@pytest.mark.django_db
+def test_backfill_course_daily_metrics_failure(monkeypatch):
+    site = SiteFactory()
+    course = CourseOverviewFactory()
+
+    def mock_cdm_load(self, date_for, force_update, **kwargs):
+        raise Exception('mock course failure')
+
+    monkeypatch.setattr('figures.backfill.get_course_keys_for_site',
+                        lambda site: [course.id])
+    monkeypatch.setattr('figures.backfill.CourseDailyMetricsLoader.load', mock_cdm_load)
+    failed = backfill_course_daily_metrics_for_site(site=site, date_for=date(2019, 1, 1))
+    assert failed == 1
+    assert PipelineError.objects.filter(course_id=str(course.id), site=site).count() == 1
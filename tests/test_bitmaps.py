@@ -0,0 +1,35 @@
+"""Tests the figures.bitmaps module
+"""
+
+import pytest
+
+from figures.bitmaps import (
+    bitmap_count,
+    bitmap_to_user_ids,
+    decode_bitmap,
+    encode_bitmap,
+    user_ids_to_bitmap,
+)
+
+
+@pytest.mark.parametrize('user_ids', [
+    [],
+    [0],
+    [1, 2, 3],
+    [7, 8, 9, 4096, 100000],
+])
+def test_bitmap_round_trip(user_ids):
+    bitmap = user_ids_to_bitmap(user_ids)
+    assert bitmap_to_user_ids(bitmap) == user_ids
+    assert bitmap_count(bitmap) == len(user_ids)
+    assert decode_bitmap(encode_bitmap(bitmap)) == bitmap
+
+
+def test_bitmap_union():
+    bitmap = user_ids_to_bitmap([1, 5, 9]) | user_ids_to_bitmap([5, 10])
+    assert bitmap_to_user_ids(bitmap) == [1, 5, 9, 10]
+    assert bitmap_count(bitmap) == 4
+
+
+def test_duplicate_user_ids():
+    assert bitmap_to_user_ids(user_ids_to_bitmap([3, 3, 1])) == [1, 3]
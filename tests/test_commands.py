@@ -1,9 +1,12 @@
 """Test Figures Django management commands
 """
 
+import datetime
+
 import mock
 import pytest
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.utils.six import StringIO
 
@@ -29,6 +32,19 @@ def test_mau_no_delay(transactional_db):
         mock_populate_all_mau.assert_called()
 
 
+def test_resume_no_delay(transactional_db):
+    """
+    We test that the `--resume` option is passed to
+    `figures.tasks.populate_daily_metrics`
+    """
+    path = 'figures.management.commands.populate_figures_metrics.populate_daily_metrics'
+    with mock.patch(path) as mock_populate_daily_metrics:
+        call_command('populate_figures_metrics', '--no-delay', '--resume',
+                     '--date', '2019-01-02')
+        mock_populate_daily_metrics.assert_called_once_with(
+            date_for='2019-01-02', force_update=False, resume=True)
+
+
 def test_backfill(transactional_db):
     """Minimal test the backfill management command
     """
@@ -36,3 +52,45 @@ def test_backfill(transactional_db):
     with mock.patch(path) as mock_backfill:
         call_command('backfill_figures_metrics')
         mock_backfill.assert_called()
+
+
+def test_backfill_daily_metrics_command(transactional_db):
+    """Minimal test of the daily metrics backfill management command
+    """
+    site = SiteFactory()
+    path = 'figures.management.commands.backfill_figures_daily_metrics.backfill_daily_metrics'
+    with mock.patch(path) as mock_backfill:
+        mock_backfill.return_value = dict(course_failures=0, site_failures=0,
+                                          skipped_site_dates={})
+        call_command('backfill_figures_daily_metrics',
+                     '--start-date', '2019-01-01',
+                     '--end-date', '2019-01-31',
+                     '--site', site.domain,
+                     '--workers', '2')
+        kwargs = mock_backfill.call_args[1]
+        assert list(kwargs['sites']) == [site]
+        assert kwargs['workers'] == 2
+        assert str(kwargs['start_date']) == '2019-01-01'
+        assert str(kwargs['end_date']) == '2019-01-31'
+
+
+def test_backfill_daily_metrics_command_bad_dates(transactional_db):
+    with pytest.raises(CommandError):
+        call_command('backfill_figures_daily_metrics',
+                     '--start-date', '2019-02-01',
+                     '--end-date', '2019-01-31')
+
+
+def test_rebuild_ever_active_users(transactional_db):
+    """Minimal test of the ever active users rebuild management command
+    """
+    site = SiteFactory()
+    path = ('figures.management.commands.rebuild_figures_ever_active_users.'
+            'rebuild_ever_active_users')
+    with mock.patch(path) as mock_rebuild:
+        mock_rebuild.return_value.user_count = 0
+        call_command('rebuild_figures_ever_active_users',
+                     '--date', '2019-01-31',
+                     '--site', str(site.id))
+        mock_rebuild.assert_called_once_with(site=site,
+                                             date_for=datetime.date(2019, 1, 31))
@@ -0,0 +1,143 @@
+"""Tests the streaming CSV and NDJSON exports
+"""
+
+from collections import OrderedDict
+import datetime
+import json
+
+import pytest
+
+from django.contrib.auth import get_user_model
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from figures.exports import (
+    csv_rows,
+    export_response,
+    flatten_record,
+    ndjson_rows,
+    queryset_chunks,
+    serializer_columns,
+)
+
+from tests.factories import UserFactory
+
+
+RECORDS = [
+    OrderedDict([('id', 1),
+                 ('user', OrderedDict([('id', 7), ('username', u'al\xefce')])),
+                 ('courses', [dict(course_id='c1')]),
+                 ('is_active', True),
+                 ('date_for', datetime.date(2019, 10, 1)),
+                 ('progress', None)]),
+    OrderedDict([('id', 2),
+                 ('user', OrderedDict([('id', 8), ('username', u'bob')])),
+                 ('courses', []),
+                 ('is_active', False),
+                 ('date_for', datetime.date(2019, 10, 2)),
+                 ('progress', 0.5)]),
+]
+
+
+@pytest.mark.django_db
+def test_queryset_chunks():
+    users = [UserFactory() for i in range(5)]
+    queryset = get_user_model().objects.filter(
+        id__in=[user.id for user in users]).order_by('-username')
+    chunks = list(queryset_chunks(queryset, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [user.id for chunk in chunks for user in chunk] == sorted(user.id for user in users)
+
+
+def test_flatten_record():
+    assert flatten_record(RECORDS[0]) == [
+        ('id', 1),
+        ('user.id', 7),
+        ('user.username', u'al\xefce'),
+        ('courses', '[{"course_id": "c1"}]'),
+        ('is_active', True),
+        ('date_for', datetime.date(2019, 10, 1)),
+        ('progress', None),
+    ]
+
+
+def test_csv_rows():
+    assert list(csv_rows(RECORDS)) == [
+        'id,user.id,user.username,courses,is_active,date_for,progress\r\n',
+        '1,7,al\xc3\xafce,"[{""course_id"": ""c1""}]",True,2019-10-01,\r\n',
+        '2,8,bob,[],False,2019-10-02,0.5\r\n',
+    ]
+    assert list(csv_rows([])) == []
+
+
+def test_csv_rows_columns_from_first_record():
+    records = [
+        OrderedDict([('id', 1), ('name', 'a')]),
+        OrderedDict([('name', 'b'), ('extra', 'x')]),
+    ]
+    assert list(csv_rows(records)) == [
+        'id,name\r\n',
+        '1,a\r\n',
+        ',b\r\n',
+    ]
+
+
+class ExportUserSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    username = serializers.CharField()
+
+
+class ExportSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    user = ExportUserSerializer(allow_null=True)
+    courses = ExportUserSerializer(many=True)
+    details = serializers.DictField()
+    password = serializers.CharField(write_only=True)
+
+
+def test_serializer_columns():
+    assert serializer_columns(ExportSerializer()) == [
+        'id', 'user.id', 'user.username', 'courses', 'details']
+
+
+def test_csv_rows_serializer_columns():
+    """A null nested record in the first record keeps its columns
+    """
+    records = [
+        OrderedDict([('id', 1), ('user', None), ('courses', []), ('details', {'a': 1})]),
+        OrderedDict([('id', 2),
+                     ('user', OrderedDict([('id', 8), ('username', 'bob')])),
+                     ('courses', []),
+                     ('details', {})]),
+    ]
+    assert list(csv_rows(records, columns=serializer_columns(ExportSerializer()))) == [
+        'id,user.id,user.username,courses,details\r\n',
+        '1,,,[],"{""a"": 1}"\r\n',
+        '2,8,bob,[],{}\r\n',
+    ]
+
+
+def test_ndjson_rows():
+    rows = list(ndjson_rows(RECORDS))
+    assert len(rows) == 2
+    assert all(row.endswith('\n') for row in rows)
+    assert json.loads(rows[1]) == dict(id=2, user=dict(id=8, username='bob'), courses=[],
+                                       is_active=False, date_for='2019-10-02',
+                                       progress=0.5)
+
+
+@pytest.mark.parametrize('export_format, content_type', [
+    ('csv', 'text/csv; charset=utf-8'),
+    ('ndjson', 'application/x-ndjson; charset=utf-8'),
+])
+def test_export_response(export_format, content_type):
+    response = export_response(iter(RECORDS), export_format, 'figures-test')
+    assert response.streaming
+    assert response['Content-Type'] == content_type
+    assert response['Content-Disposition'] == 'attachment; filename="figures-test.{}"'.format(
+        export_format)
+
+
+def test_export_response_invalid_format():
+    with pytest.raises(ValidationError):
+        export_response(iter(RECORDS), 'xml', 'figures-test')
@@ -15,11 +15,14 @@ from figures.helpers import (
     as_course_key,
     as_datetime,
     as_date,
+    day_window,
     days_from,
+    month_window,
     next_day,
     prev_day,
     previous_months_iterator,
     first_last_days_for_month,
+    window_filter,
     )
 
 from tests.factories import COURSE_ID_STR_TEMPLATE
@@ -217,3 +220,36 @@ def test_first_last_days_for_month():
     assert last_day.year == year
     assert first_day.day == 1
     assert last_day.day == 29
+
+
+class TestDateWindows(object):
+
+    @pytest.mark.parametrize('date_for', [
+        datetime.date(2019, 12, 31),
+        datetime.datetime(2019, 12, 31, 23, 59, tzinfo=utc),
+        '2019-12-31',
+        ])
+    def test_day_window(self, date_for):
+        assert day_window(date_for) == (
+            datetime.datetime(2019, 12, 31, tzinfo=utc),
+            datetime.datetime(2020, 1, 1, tzinfo=utc))
+        assert day_window(date_for, dates=True) == (
+            datetime.date(2019, 12, 31), datetime.date(2020, 1, 1))
+
+    @pytest.mark.parametrize('month_for', [
+        datetime.date(2019, 12, 15),
+        datetime.datetime(2019, 12, 31, 23, 59, tzinfo=utc),
+        (2019, 12),
+        (2019, 12, 31),
+        ])
+    def test_month_window(self, month_for):
+        assert month_window(month_for) == (
+            datetime.datetime(2019, 12, 1, tzinfo=utc),
+            datetime.datetime(2020, 1, 1, tzinfo=utc))
+        assert month_window(month_for, dates=True) == (
+            datetime.date(2019, 12, 1), datetime.date(2020, 1, 1))
+
+    def test_window_filter(self):
+        window = day_window(datetime.date(2020, 2, 29))
+        assert window_filter('modified', window) == dict(
+            modified__gte=window[0], modified__lt=window[1])
@@ -1,6 +1,9 @@
 
-from datetime import datetime
+from datetime import date, datetime
 from freezegun import freeze_time
+import pytest
+
+from django.db.models import DateTimeField, Value
 
 from courseware.models import StudentModule
 
@@ -8,9 +11,12 @@ from figures.sites import (
     get_student_modules_for_site,
     get_student_modules_for_course_in_site,
 )
+import figures.mau
 from figures.mau import (
     get_mau_from_student_modules,
     get_mau_from_site_course,
+    get_mau_counts_by_course,
+    get_monthly_active_user_counts,
     store_mau_metrics,
 )
 
@@ -47,6 +53,42 @@ def test_get_mau_from_sm_for_site(sm_test_data):
     assert set(users) == set(sm_check)
 
 
+def test_get_mau_counts_by_course(sm_test_data):
+    sm = get_student_modules_for_site(sm_test_data['site'])
+    counts = get_mau_counts_by_course(student_modules=sm,
+                                      year=sm_test_data['year_for'],
+                                      month=sm_test_data['month_for'])
+    for co in sm_test_data['course_overviews']:
+        users = get_mau_from_site_course(site=sm_test_data['site'],
+                                         course_id=str(co.id),
+                                         year=sm_test_data['year_for'],
+                                         month=sm_test_data['month_for'])
+        assert counts[str(co.id)] == users.count()
+    assert not get_mau_counts_by_course(student_modules=sm, year=2018, month=1)
+
+
+@pytest.mark.parametrize('trunc_month', ['db', 'none', 'null'])
+def test_get_monthly_active_user_counts(monkeypatch, sm_test_data, trunc_month):
+    if trunc_month == 'none':
+        monkeypatch.setattr(figures.mau, 'TruncMonth', None)
+    elif trunc_month == 'null':
+        # MySQL without the time zone tables
+        monkeypatch.setattr(figures.mau, 'TruncMonth',
+                            lambda field_name, tzinfo: Value(None, output_field=DateTimeField()))
+    month = date(sm_test_data['year_for'], sm_test_data['month_for'], 1)
+    sm = get_student_modules_for_site(sm_test_data['site'])
+
+    site_counts = get_monthly_active_user_counts(sm, field_name='created')
+    assert site_counts == {
+        month: sm.values_list('student_id', flat=True).distinct().count()}
+
+    course_counts = get_monthly_active_user_counts(sm, by_course=True)
+    assert course_counts == {
+        (str(co.id), month): sm.filter(course_id=co.id).values_list(
+            'student_id', flat=True).distinct().count()
+        for co in sm_test_data['course_overviews']}
+
+
 def test_store_mau_metrics(monkeypatch, sm_test_data):
     """
     Basic minimal test
@@ -1,8 +1,18 @@
+import pytest
+
+from django.contrib.auth import get_user_model
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
 from figures.pagination import (
+    FiguresCursorPagination,
+    FiguresKiloCursorPagination,
     FiguresLimitOffsetPagination,
     FiguresKiloPagination,
 )
 
+from tests.factories import UserFactory
+
 
 class TestFiguresLimitOffsetPagination(object):
     def test_default_pagination_limit(self):
@@ -12,3 +22,36 @@ class TestFiguresLimitOffsetPagination(object):
 class TestFigureKiloPagination(object):
     def test_default_pagination_limit(self):
         assert FiguresKiloPagination.default_limit == 1000
+
+
+class TestFiguresCursorPagination(object):
+    def test_default_page_size(self):
+        assert FiguresCursorPagination.page_size == 20
+        assert FiguresKiloCursorPagination.page_size == 1000
+
+    @pytest.mark.parametrize('query_string, expected', [
+        ('', 20),
+        ('limit=5', 5),
+        ('limit=5000', 1000),
+        ('limit=0', 20),
+        ('limit=bad', 20),
+    ])
+    def test_get_page_size(self, query_string, expected):
+        request = Request(APIRequestFactory().get('/?' + query_string))
+        assert FiguresCursorPagination().get_page_size(request) == expected
+
+    @pytest.mark.django_db
+    def test_paginate_queryset(self):
+        users = [UserFactory() for i in range(5)]
+        queryset = get_user_model().objects.filter(id__in=[user.id for user in users])
+        paginator = FiguresCursorPagination()
+        request = Request(APIRequestFactory().get('/?cursor=&limit=2'))
+        page = paginator.paginate_queryset(queryset.order_by('-username'), request)
+        assert [user.id for user in page] == sorted(user.id for user in users)[:2]
+        assert paginator.get_paginated_response([]).data.keys() == [
+            'next', 'previous', 'results']
+
+        request = Request(APIRequestFactory().get(paginator.get_next_link() + '&count=1'))
+        page = paginator.paginate_queryset(queryset, request)
+        assert [user.id for user in page] == sorted(user.id for user in users)[2:4]
+        assert paginator.get_paginated_response([]).data['count'] == 5
@@ -0,0 +1,156 @@
+"""Tests the site API response cache
+"""
+
+import pytest
+
+import django.contrib.sites.shortcuts
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from figures.response_cache import (
+    cache_site_response,
+    etag_matches,
+    invalidate_site_responses,
+    site_generation,
+)
+from figures.views import GeneralSiteMetricsView
+
+from tests.factories import SiteFactory, UserFactory
+
+
+class CountingView(APIView):
+    """Returns the number of times the handler was called
+    """
+    calls = 0
+    response_status = status.HTTP_200_OK
+
+    @cache_site_response
+    def get(self, request, format=None):  # pylint: disable=redefined-builtin
+        CountingView.calls += 1
+        return Response(dict(calls=CountingView.calls, params=request.query_params),
+                        status=CountingView.response_status)
+
+
+@pytest.mark.django_db
+class TestCacheSiteResponse(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings, monkeypatch):
+        monkeypatch.setitem(settings.FEATURES, 'FIGURES_API_RESPONSE_CACHE', True)
+        self.sites = [SiteFactory(), SiteFactory()]
+        self.current_site = self.sites[0]
+        monkeypatch.setattr(django.contrib.sites.shortcuts,
+                            'get_current_site',
+                            lambda req: self.current_site)
+        CountingView.calls = 0
+        CountingView.response_status = status.HTTP_200_OK
+        for site in self.sites:
+            invalidate_site_responses(site)
+
+    def get_response(self, path='/figures/api/test/', **extra):
+        return CountingView.as_view()(APIRequestFactory().get(path, **extra))
+
+    def get(self, path='/figures/api/test/'):
+        response = self.get_response(path)
+        return response.status_code, response.data.get('calls')
+
+    def test_cached(self):
+        assert self.get() == (200, 1)
+        assert self.get() == (200, 1)
+
+    def test_disabled(self, settings, monkeypatch):
+        monkeypatch.setitem(settings.FEATURES, 'FIGURES_API_RESPONSE_CACHE', False)
+        assert self.get() == (200, 1)
+        assert self.get() == (200, 2)
+        assert not self.get_response().has_header('ETag')
+
+    def test_query_params(self):
+        assert self.get('/figures/api/test/?a=1&b=2') == (200, 1)
+        assert self.get('/figures/api/test/?b=2&a=1') == (200, 1)
+        assert self.get('/figures/api/test/?a=1&b=3') == (200, 2)
+        assert self.get('/figures/api/other/?a=1&b=2') == (200, 3)
+
+    def test_sites(self):
+        assert self.get() == (200, 1)
+        self.current_site = self.sites[1]
+        assert self.get() == (200, 2)
+        self.current_site = self.sites[0]
+        assert self.get() == (200, 1)
+
+    def test_invalidate_site_responses(self):
+        assert self.get() == (200, 1)
+        generation = site_generation(self.sites[0])
+        invalidate_site_responses(self.sites[1])
+        assert self.get() == (200, 1)
+        invalidate_site_responses(self.sites[0])
+        assert site_generation(self.sites[0]) != generation
+        assert self.get() == (200, 2)
+
+    def test_errors_not_cached(self):
+        CountingView.response_status = status.HTTP_404_NOT_FOUND
+        assert self.get() == (404, 1)
+        assert self.get() == (404, 2)
+
+    def test_etag_not_modified(self):
+        etag = self.get_response()['ETag']
+        response = self.get_response(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+        response = self.get_response(HTTP_IF_NONE_MATCH='"other", W/{}'.format(etag))
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert CountingView.calls == 1
+
+    @pytest.mark.parametrize('header, expected', [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"other" , W/"abc"', True),
+        ('*', True),
+        ('"other"', False),
+        ('"abcd"', False),
+        ('', False),
+    ])
+    def test_etag_matches(self, header, expected):
+        request = APIRequestFactory().get('/figures/api/test/', HTTP_IF_NONE_MATCH=header)
+        assert etag_matches(request, '"abc"') == expected
+
+    def test_etag_changes_with_request(self):
+        etag = self.get_response()['ETag']
+        response = self.get_response('/figures/api/test/?a=1', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+        self.current_site = self.sites[1]
+        response = self.get_response(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_etag_changes_with_generation(self):
+        etag = self.get_response()['ETag']
+        invalidate_site_responses(self.sites[0])
+        response = self.get_response(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['calls'] == 2
+        assert response['ETag'] != etag
+
+    def test_errors_have_no_etag(self):
+        CountingView.response_status = status.HTTP_404_NOT_FOUND
+        assert not self.get_response().has_header('ETag')
+
+    def test_not_modified_requires_permission(self, monkeypatch):
+        monkeypatch.setattr(GeneralSiteMetricsView, 'metrics_method',
+                            property(lambda self: lambda site, date_for: dict(site_id=site.id)))
+        view = GeneralSiteMetricsView.as_view()
+
+        def get_site_metrics(user, **extra):
+            request = APIRequestFactory().get('/figures/api/general-site-metrics/', **extra)
+            force_authenticate(request, user=user)
+            return view(request)
+
+        response = get_site_metrics(UserFactory(is_staff=True))
+        assert response.status_code == status.HTTP_200_OK
+        etag = response['ETag']
+        response = get_site_metrics(UserFactory(is_staff=True), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        response = get_site_metrics(UserFactory(), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
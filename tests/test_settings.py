@@ -36,6 +36,16 @@ def test_log_pipeline_errors_to_db_true(features, expected):
         assert figures_helpers.log_pipeline_errors_to_db() == expected
 
 
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_SITE_COURSE_DAILY_METRICS': True}, True),
+        ({'FIGURES_SITE_COURSE_DAILY_METRICS': False}, False),
+        ({}, False),
+    ])
+def test_use_site_course_daily_metrics(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_site_course_daily_metrics() == expected
+
+
 class TestUpdateSettings(object):
     '''
     figures.settings.update_settings is a convenience method that wraps
@@ -85,6 +95,7 @@ class TestUpdateSettings(object):
             self.validate_celerybeat_schedule_settings(settings.CELERYBEAT_SCHEDULE)
         else:
             assert self.CELERY_TASK_NAME not in settings.CELERYBEAT_SCHEDULE
+        assert 'figures-resume-stalled-site-runs' in settings.CELERYBEAT_SCHEDULE
 
         assert settings.ENV_TOKENS['FIGURES'] == figures_env_tokens
 
@@ -129,3 +140,53 @@ class TestDailyMauPipelineSettings(object):
         assert 'FIGURES' not in self.settings.ENV_TOKENS
         plugin_settings(self.settings)
         assert self.TASK_NAME not in self.settings.CELERYBEAT_SCHEDULE
+
+
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_INCREMENTAL_LEARNER_GRADES': True}, True),
+        ({'FIGURES_INCREMENTAL_LEARNER_GRADES': False}, False),
+        ({}, False),
+    ])
+def test_use_incremental_learner_grades(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_incremental_learner_grades() == expected
+
+
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_ACTIVE_USER_BITMAPS': True}, True),
+        ({'FIGURES_ACTIVE_USER_BITMAPS': False}, False),
+        ({}, False),
+    ])
+def test_use_active_user_bitmaps(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_active_user_bitmaps() == expected
+
+
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS': True}, True),
+        ({'FIGURES_DISTINCT_CUMULATIVE_ACTIVE_USERS': False}, False),
+        ({}, False),
+    ])
+def test_use_distinct_cumulative_active_users(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_distinct_cumulative_active_users() == expected
+
+
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_COURSE_MONTHLY_METRICS': True}, True),
+        ({'FIGURES_COURSE_MONTHLY_METRICS': False}, False),
+        ({}, False),
+    ])
+def test_use_course_monthly_metrics(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_course_monthly_metrics() == expected
+
+
+@pytest.mark.parametrize('features, expected', [
+        ({'FIGURES_API_RESPONSE_CACHE': True}, True),
+        ({'FIGURES_API_RESPONSE_CACHE': False}, False),
+        ({}, False),
+    ])
+def test_use_api_response_cache(features, expected):
+    with mock.patch('figures.helpers.settings.FEATURES', features):
+        assert figures_helpers.use_api_response_cache() == expected
@@ -27,6 +27,8 @@ import pytest
 
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
 
 import organizations
 
@@ -38,6 +40,7 @@ import figures.helpers
 import figures.sites
 
 from tests.factories import (
+    CourseAccessRoleFactory,
     CourseEnrollmentFactory,
     CourseOverviewFactory,
     OrganizationFactory,
@@ -331,3 +334,166 @@ def test_site_iterator():
         collected_ids.append(site_id)
 
     assert set(collected_ids) == set([site.id for site in sites])
+
+
+@pytest.mark.django_db
+class TestCourseAdminUserIds(object):
+    """
+    Tests retrieving and caching course staff, instructor and CCX coach user ids
+    """
+    COURSE_ROLES = ['ccx_coach', 'instructor', 'staff']
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        cache.clear()
+        self.site = Site.objects.first()
+        self.course_overviews = [CourseOverviewFactory() for i in range(2)]
+        self.course_keys = [co.id for co in self.course_overviews]
+        self.roles = [CourseAccessRoleFactory(course_id=self.course_keys[0], role=role)
+                      for role in self.COURSE_ROLES]
+        # Not an admin role
+        CourseAccessRoleFactory(course_id=self.course_keys[0], role='beta_testers')
+        self.expected = {
+            str(self.course_keys[0]): set(role.user_id for role in self.roles)
+        }
+
+    def test_get_course_admin_user_ids(self):
+        admin_ids = figures.sites.get_course_admin_user_ids(self.course_keys)
+        assert admin_ids == self.expected
+
+    def test_get_course_admin_user_ids_for_site_is_cached(self):
+        with mock.patch('figures.helpers.settings.FEATURES', {}):
+            admin_ids = figures.sites.get_course_admin_user_ids_for_site(self.site)
+            assert admin_ids == self.expected
+            with mock.patch('figures.sites.get_course_admin_user_ids') as mock_get:
+                assert figures.sites.get_course_admin_user_ids_for_site(
+                    self.site) == self.expected
+                assert not mock_get.called
+
+    def test_role_change_invalidates_cache(self):
+        with mock.patch('figures.helpers.settings.FEATURES', {}):
+            figures.sites.get_course_admin_user_ids_for_site(self.site)
+            role = CourseAccessRoleFactory(course_id=self.course_keys[1], role='staff')
+            self.expected[str(self.course_keys[1])] = set([role.user_id])
+            assert figures.sites.get_course_admin_user_ids_for_site(
+                self.site) == self.expected
+            role.delete()
+            del self.expected[str(self.course_keys[1])]
+            assert figures.sites.get_course_admin_user_ids_for_site(
+                self.site) == self.expected
+
+    def test_invalidate_without_version(self):
+        cache.clear()
+        figures.sites.invalidate_course_admin_user_ids()
+        assert figures.sites.course_admin_roles_version()
+
+
+@pytest.mark.django_db
+class TestSiteTopology(object):
+    """
+    Tests building, caching and invalidating the site topology
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = SiteFactory()
+        if organizations_support_sites():
+            self.organization = OrganizationFactory(sites=[self.site])
+        else:
+            self.organization = OrganizationFactory()
+        self.course_ids = [str(CourseOverviewFactory().id) for i in range(2)]
+        for course_id in self.course_ids:
+            OrganizationCourseFactory(organization=self.organization, course_id=course_id)
+
+    def test_build_site_topology(self):
+        topology = figures.sites.build_site_topology()
+        assert topology['course_orgs'] == dict(
+            (course_id, [(self.organization.id, self.organization.name)])
+            for course_id in self.course_ids)
+        assert topology['has_sites'] == organizations_support_sites()
+        if organizations_support_sites():
+            assert topology['site_course_ids'][self.site.id] == self.course_ids
+            assert topology['site_orgs'][self.site.id] == [self.organization.id]
+        else:
+            assert topology['site_course_ids'] == {}
+
+    def test_get_site_topology_is_cached(self):
+        topology = figures.sites.get_site_topology()
+        with mock.patch('figures.sites.build_site_topology') as mock_build:
+            assert figures.sites.get_site_topology() is topology
+            # Another process reads the shared cache
+            figures.sites._site_topology = {}
+            assert figures.sites.get_site_topology()['course_orgs'] == topology['course_orgs']
+            assert not mock_build.called
+
+    def test_organization_course_change_invalidates(self):
+        figures.sites.get_site_topology()
+        org_course = OrganizationCourseFactory(organization=self.organization,
+                                               course_id=str(CourseOverviewFactory().id))
+        assert org_course.course_id in figures.sites.get_site_topology()['course_orgs']
+        org_course.delete()
+        assert org_course.course_id not in figures.sites.get_site_topology()['course_orgs']
+
+    def test_invalidate_without_version(self):
+        cache.clear()
+        figures.sites.invalidate_site_topology()
+        assert figures.sites.site_topology_version()
+
+    def test_get_site_topology_expires(self):
+        topology = figures.sites.get_site_topology()
+        expires_at = topology['expires_at']
+        with mock.patch('figures.sites.time.time', return_value=expires_at - 1):
+            assert figures.sites.get_site_topology() is topology
+        # Changes made without the signals, as by the CMS
+        with mock.patch('figures.sites.bump_cache_version'):
+            org_course = OrganizationCourseFactory(
+                organization=self.organization,
+                course_id=str(CourseOverviewFactory().id))
+        with mock.patch('figures.sites.time.time', return_value=expires_at - 1):
+            assert org_course.course_id not in figures.sites.get_site_topology()['course_orgs']
+        with mock.patch('figures.sites.time.time', return_value=expires_at):
+            assert org_course.course_id in figures.sites.get_site_topology()['course_orgs']
+
+    def test_get_site_topology_without_shared_cache(self):
+        figures.sites._site_topology = {}
+        with mock.patch('figures.sites.cache', DummyCache('figures-test', {})):
+            assert sorted(figures.sites.get_site_topology()['course_orgs']) == sorted(
+                self.course_ids)
+
+
+@pytest.mark.skipif(not organizations_support_sites(),
+                    reason='Organizations support sites')
+@pytest.mark.django_db
+class TestSiteTopologyForMultisiteMode(object):
+    """
+    Tests figures.sites functions use the site topology in multisite mode
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        settings.FEATURES['FIGURES_IS_MULTISITE'] = True
+        self.site = SiteFactory()
+        self.organization = OrganizationFactory(sites=[self.site])
+        self.course_overview = CourseOverviewFactory()
+        OrganizationCourseFactory(organization=self.organization,
+                                  course_id=str(self.course_overview.id))
+
+    def test_repeat_calls_use_topology(self):
+        course_id = str(self.course_overview.id)
+        assert figures.sites.get_site_for_course(course_id) == self.site
+        assert figures.sites.get_course_keys_for_site(self.site) == [self.course_overview.id]
+        with mock.patch('figures.sites.build_site_topology') as mock_build:
+            with mock.patch('figures.sites.Site.objects') as mock_site_objects:
+                assert figures.sites.get_site_for_course(course_id) == self.site
+                assert figures.sites.get_course_keys_for_site(
+                    self.site) == [self.course_overview.id]
+                assert not mock_site_objects.filter.called
+            assert not mock_build.called
+
+    def test_organization_sites_change_invalidates(self):
+        other_site = SiteFactory()
+        assert figures.sites.get_course_keys_for_site(other_site) == []
+        self.organization.sites.remove(self.site)
+        self.organization.sites.add(other_site)
+        assert figures.sites.get_site_for_course(str(self.course_overview.id)) == other_site
+        assert figures.sites.get_course_keys_for_site(other_site) == [self.course_overview.id]
+        assert list(figures.sites.get_organizations_for_site(other_site)) == [
+            self.organization]
@@ -2,9 +2,13 @@
 
 """
 
-from datetime import date
+from datetime import date, timedelta
+import mock
+import pytest
+
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
+from django.utils.timezone import now
 
 from openedx.core.djangoapps.content.course_overviews.models import (
     CourseOverview,
@@ -13,11 +17,16 @@ from openedx.core.djangoapps.content.course_overviews.models import (
 from figures.helpers import as_course_key, as_date
 from figures.models import (
     CourseDailyMetrics,
+    PipelineCourseRun,
     PipelineError,
+    PipelineSiteRun,
     SiteDailyMetrics,
     )
+import figures.pipeline.runs
 import figures.tasks
 import figures.mau
+import figures.sites
+from figures.response_cache import site_generation
 
 from tests.factories import (
     CourseDailyMetricsFactory,
@@ -103,6 +112,20 @@ def test_populate_daily_metrics_multisite(transactional_db, monkeypatch):
         figures.tasks.populate_daily_metrics(date_for=date_for)
 
 
+@pytest.mark.parametrize('task, site_func', [
+    (figures.tasks.populate_daily_metrics, 'populate_daily_metrics_for_site'),
+    (figures.tasks.populate_daily_metrics_parallel, 'populate_site_daily_metrics_parallel'),
+])
+def test_populate_daily_metrics_refreshes_site_topology(transactional_db, task, site_func):
+    """Organization courses created in the CMS send no signals, so each run
+    rebuilds the site topology
+    """
+    version = figures.sites.site_topology_version()
+    with mock.patch('figures.tasks.{}'.format(site_func)):
+        task(date_for='2019-01-02')
+    assert figures.sites.site_topology_version() != version
+
+
 def test_populate_course_mau(transactional_db, monkeypatch):
     expected_site = SiteFactory()
     course = CourseOverviewFactory()
@@ -176,3 +199,406 @@ def test_populate_all_mau_multiple_site(transactional_db, monkeypatch):
     figures.tasks.populate_all_mau()
 
     assert set(sites_visited) == set([site.id for site in sites])
+
+
+def test_populate_site_course_daily_metrics(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    site = SiteFactory()
+    expected_results = dict(created=['course'], updated=[], skipped=[], failed=[])
+
+    def mock_load(self, date_for, force_update, **kwargs):
+        assert self.site == site
+        assert date_for == as_date('2019-01-02')
+        return expected_results
+
+    monkeypatch.setattr(
+        figures.pipeline.course_daily_metrics.SiteCourseDailyMetricsLoader,
+        'load', mock_load)
+    results = figures.tasks.populate_site_course_daily_metrics(site.id, date_for)
+    assert results == expected_results
+
+
+def test_populate_daily_metrics_site_course_daily_metrics(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    sites_visited = []
+
+    def mock_pop_site_cdms(site_id, date_for, force_update, course_ids):
+        sites_visited.append(site_id)
+        return dict(created=course_ids, updated=[], skipped=[], failed=[])
+
+    def mock_pop_single_cdm(**kwargs):
+        raise Exception('Per-course path should not be called')
+
+    monkeypatch.setattr('figures.tasks.populate_site_course_daily_metrics',
+                        mock_pop_site_cdms)
+    monkeypatch.setattr('figures.tasks.populate_single_cdm', mock_pop_single_cdm)
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda **kwargs: None)
+    [CourseOverviewFactory() for i in range(2)]
+    with mock.patch('figures.helpers.settings.FEATURES',
+                    {'FIGURES_SITE_COURSE_DAILY_METRICS': True}):
+        figures.tasks.populate_daily_metrics(date_for=date_for)
+    assert sites_visited == [site.id for site in Site.objects.all()]
+
+
+def test_populate_daily_metrics_site_course_fallback(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    course = CourseOverviewFactory()
+    courses_visited = []
+
+    def mock_pop_site_cdms(site_id, date_for, force_update, course_ids):
+        raise Exception('mock site level failure')
+
+    def mock_pop_single_cdm(course_id, **kwargs):
+        courses_visited.append(course_id)
+
+    monkeypatch.setattr('figures.tasks.populate_site_course_daily_metrics',
+                        mock_pop_site_cdms)
+    monkeypatch.setattr('figures.tasks.populate_single_cdm', mock_pop_single_cdm)
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda **kwargs: None)
+    with mock.patch('figures.helpers.settings.FEATURES',
+                    {'FIGURES_SITE_COURSE_DAILY_METRICS': True}):
+        figures.tasks.populate_daily_metrics(date_for=date_for)
+    assert courses_visited == [str(course.id)]
+
+
+def test_populate_daily_metrics_resume(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    site = Site.objects.first()
+    courses = [CourseOverviewFactory() for i in range(3)]
+    failing_course_ids = [str(courses[1].id)]
+    courses_visited = []
+    sdm_calls = []
+
+    def mock_pop_single_cdm(course_id, date_for, force_update):
+        courses_visited.append(str(course_id))
+        if str(course_id) in failing_course_ids:
+            raise Exception('mock course failure')
+
+    def mock_pop_sdm(site_id, date_for, force_update, **kwargs):
+        sdm_calls.append(site_id)
+
+    monkeypatch.setattr('figures.tasks.populate_single_cdm', mock_pop_single_cdm)
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics', mock_pop_sdm)
+
+    figures.tasks.populate_daily_metrics(date_for=date_for)
+    site_run = PipelineSiteRun.objects.get(site=site, date_for=as_date(date_for))
+    assert sorted(courses_visited) == sorted(str(co.id) for co in courses)
+    assert site_run.status == PipelineSiteRun.FAILED
+    assert sdm_calls == [site.id]
+
+    # Only the failed course is rerun, then the site metrics
+    courses_visited[:] = []
+    failing_course_ids[:] = []
+    figures.tasks.populate_daily_metrics(date_for=date_for, resume=True)
+    site_run.refresh_from_db()
+    assert courses_visited == [str(courses[1].id)]
+    assert sdm_calls == [site.id, site.id]
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+    assert site_run.finished_course_count == len(courses)
+
+    # Nothing left to resume
+    courses_visited[:] = []
+    figures.tasks.populate_daily_metrics(date_for=date_for, resume=True)
+    assert courses_visited == []
+    assert sdm_calls == [site.id, site.id]
+
+
+def run_delay_inline(monkeypatch, task):
+    monkeypatch.setattr(task, 'delay', lambda **kwargs: task(**kwargs))
+
+
+def test_populate_daily_metrics_parallel(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    site = Site.objects.first()
+    courses = [CourseOverviewFactory() for i in range(5)]
+    failing_course_id = str(courses[2].id)
+    courses_visited = []
+    sdm_calls = []
+
+    def mock_pop_single_cdm(course_id, date_for, force_update):
+        courses_visited.append(str(course_id))
+        if str(course_id) == failing_course_id:
+            raise Exception('mock course failure')
+
+    def mock_pop_sdm(site_id, date_for, force_update, **kwargs):
+        sdm_calls.append(site_id)
+
+    monkeypatch.setattr('figures.tasks.populate_single_cdm', mock_pop_single_cdm)
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics', mock_pop_sdm)
+    run_delay_inline(monkeypatch, figures.tasks.populate_site_daily_metrics_parallel)
+    run_delay_inline(monkeypatch, figures.tasks.populate_course_daily_metrics_for_run)
+
+    figures.tasks.populate_daily_metrics_parallel(date_for=date_for, max_course_tasks=2)
+
+    assert sorted(courses_visited) == sorted(str(co.id) for co in courses)
+    assert sdm_calls == [site.id]
+    site_run = PipelineSiteRun.objects.get(site=site, date_for=as_date(date_for))
+    assert site_run.finished_course_count == len(courses)
+    assert site_run.site_metrics_status == PipelineSiteRun.SUCCEEDED
+    assert site_run.status == PipelineSiteRun.FAILED
+    assert site_run.course_runs.get(
+        status=PipelineSiteRun.FAILED).course_id == failing_course_id
+    assert PipelineError.objects.filter(course_id=failing_course_id).count() == 1
+
+
+def test_populate_site_daily_metrics_parallel_bounded(transactional_db, monkeypatch):
+    site = Site.objects.first()
+    [CourseOverviewFactory() for i in range(5)]
+    started = []
+
+    def mock_delay(course_run_id, force_update):
+        started.append(course_run_id)
+
+    monkeypatch.setattr(figures.tasks.populate_course_daily_metrics_for_run,
+                        'delay', mock_delay)
+    figures.tasks.populate_site_daily_metrics_parallel(site_id=site.id,
+                                                       date_for='2019-01-02',
+                                                       max_course_tasks=2)
+    site_run = PipelineSiteRun.objects.get(site=site)
+    assert len(started) == 2
+    assert set(site_run.course_runs.filter(
+        status=PipelineSiteRun.RUNNING).values_list('id', flat=True)) == set(started)
+    assert site_run.site_metrics_status == PipelineSiteRun.PENDING
+
+
+def test_populate_site_daily_metrics_parallel_queue_failure(transactional_db, monkeypatch):
+    """If the course tasks cannot be queued, the courses are populated in the
+    running task
+    """
+    site = Site.objects.first()
+    courses = [CourseOverviewFactory() for i in range(3)]
+    courses_visited = []
+    sdm_calls = []
+
+    def mock_delay(**kwargs):
+        raise Exception('mock broker failure')
+
+    monkeypatch.setattr('figures.tasks.populate_single_cdm',
+                        lambda course_id, **kwargs: courses_visited.append(str(course_id)))
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda site_id, **kwargs: sdm_calls.append(site_id))
+    monkeypatch.setattr(figures.tasks.populate_course_daily_metrics_for_run,
+                        'delay', mock_delay)
+    figures.tasks.populate_site_daily_metrics_parallel(site_id=site.id,
+                                                       date_for='2019-01-02',
+                                                       max_course_tasks=2)
+    assert sorted(courses_visited) == sorted(str(co.id) for co in courses)
+    assert sdm_calls == [site.id]
+    site_run = PipelineSiteRun.objects.get(site=site)
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+
+
+def test_populate_course_daily_metrics_for_run_missing_run(transactional_db, monkeypatch):
+    """Course tasks for course runs removed by a restarted site run, or that
+    have already finished, do nothing
+    """
+    site = Site.objects.first()
+    [CourseOverviewFactory() for i in range(2)]
+    courses_visited = []
+    monkeypatch.setattr('figures.tasks.populate_single_cdm',
+                        lambda course_id, **kwargs: courses_visited.append(str(course_id)))
+    site_run = figures.pipeline.runs.start_site_run(
+        site=site, date_for='2019-01-02',
+        course_ids=figures.sites.get_course_keys_for_site(site))
+    course_run = figures.pipeline.runs.claim_course_run(site_run)
+    figures.pipeline.runs.start_site_run(
+        site=site, date_for='2019-01-02',
+        course_ids=figures.sites.get_course_keys_for_site(site))
+    figures.tasks.populate_course_daily_metrics_for_run(course_run_id=course_run.id)
+
+    course_run = figures.pipeline.runs.claim_course_run(site_run)
+    figures.pipeline.runs.finish_course_run(course_run, succeeded=True)
+    figures.tasks.populate_course_daily_metrics_for_run(course_run_id=course_run.id)
+    assert courses_visited == []
+
+
+def test_populate_course_daily_metrics_for_run_redelivered(transactional_db, monkeypatch):
+    """A course task delivered again after its course run finished populates
+    the site daily metrics the stopped worker did not get to
+    """
+    site = Site.objects.first()
+    CourseOverviewFactory()
+    sdm_calls = []
+    monkeypatch.setattr('figures.tasks.populate_single_cdm', lambda **kwargs: None)
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda site_id, **kwargs: sdm_calls.append(site_id))
+    site_run = figures.pipeline.runs.start_site_run(
+        site=site, date_for='2019-01-02',
+        course_ids=figures.sites.get_course_keys_for_site(site))
+    course_run = figures.pipeline.runs.claim_course_run(site_run)
+    figures.pipeline.runs.finish_course_run(course_run, succeeded=True)
+    figures.tasks.populate_course_daily_metrics_for_run(course_run_id=course_run.id)
+    figures.tasks.populate_course_daily_metrics_for_run(course_run_id=course_run.id)
+    assert sdm_calls == [site.id]
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+
+
+def test_populate_site_daily_metrics_parallel_redelivered(transactional_db, monkeypatch):
+    """A site task delivered again continues the running site run instead of
+    removing the course runs in flight
+    """
+    site = Site.objects.first()
+    [CourseOverviewFactory() for i in range(3)]
+    started = []
+    monkeypatch.setattr(figures.tasks.populate_course_daily_metrics_for_run, 'delay',
+                        lambda course_run_id, force_update: started.append(course_run_id))
+    figures.tasks.populate_site_daily_metrics_parallel(site_id=site.id,
+                                                       date_for='2019-01-02',
+                                                       max_course_tasks=2)
+    figures.tasks.populate_site_daily_metrics_parallel(site_id=site.id,
+                                                       date_for='2019-01-02',
+                                                       max_course_tasks=2)
+    site_run = PipelineSiteRun.objects.get(site=site)
+    assert len(started) == 3
+    assert set(site_run.course_runs.values_list('id', flat=True)) == set(started)
+
+
+def test_resume_stalled_site_runs(transactional_db, monkeypatch):
+    site = Site.objects.first()
+    [CourseOverviewFactory() for i in range(2)]
+    courses_visited = []
+    sdm_calls = []
+    monkeypatch.setattr('figures.tasks.populate_single_cdm',
+                        lambda course_id, **kwargs: courses_visited.append(str(course_id)))
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda site_id, **kwargs: sdm_calls.append(site_id))
+    run_delay_inline(monkeypatch, figures.tasks.populate_course_daily_metrics_for_run)
+    site_run = figures.pipeline.runs.start_site_run(
+        site=site, date_for='2019-01-02',
+        course_ids=figures.sites.get_course_keys_for_site(site))
+    # The worker running the first course stopped
+    course_run = figures.pipeline.runs.claim_course_run(site_run)
+    figures.tasks.resume_stalled_site_runs()
+    assert courses_visited == []
+
+    stale = now() - figures.pipeline.runs.RUN_CLAIM_TIMEOUT - timedelta(minutes=1)
+    PipelineSiteRun.objects.filter(id=site_run.id).update(modified=stale)
+    PipelineCourseRun.objects.filter(id=course_run.id).update(modified=stale)
+    figures.tasks.resume_stalled_site_runs()
+    assert len(courses_visited) == 2
+    assert sdm_calls == [site.id]
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+
+
+def test_populate_site_daily_metrics_parallel_no_courses(transactional_db, monkeypatch):
+    site = SiteFactory()
+    sdm_calls = []
+    monkeypatch.setattr('figures.sites.get_course_keys_for_site', lambda site: [])
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda site_id, **kwargs: sdm_calls.append(site_id))
+    figures.tasks.populate_site_daily_metrics_parallel(site_id=site.id,
+                                                       date_for='2019-01-02')
+    assert sdm_calls == [site.id]
+    assert PipelineSiteRun.objects.get(site=site).status == PipelineSiteRun.SUCCEEDED
+
+
+def test_populate_site_daily_metrics_for_run_failure(transactional_db, monkeypatch):
+    site = SiteFactory()
+    site_run = figures.pipeline.runs.start_site_run(site=site,
+                                                    date_for='2019-01-02',
+                                                    course_ids=[])
+
+    def mock_pop_sdm(**kwargs):
+        raise Exception('mock site failure')
+
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics', mock_pop_sdm)
+    with pytest.raises(Exception):
+        figures.tasks.populate_site_daily_metrics_for_run(site_run)
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.FAILED
+    assert site_run.site_metrics_status == PipelineSiteRun.FAILED
+
+
+def test_populate_site_daily_metrics_for_run_monthly_failure(transactional_db, monkeypatch):
+    site = SiteFactory()
+    site_run = figures.pipeline.runs.start_site_run(site=site,
+                                                    date_for='2019-01-02',
+                                                    course_ids=[])
+
+    def mock_load_cmm(**kwargs):
+        raise Exception('mock course monthly metrics failure')
+
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda **kwargs: None)
+    monkeypatch.setattr('figures.tasks.load_course_monthly_metrics', mock_load_cmm)
+    with mock.patch('figures.helpers.settings.FEATURES',
+                    {'FIGURES_COURSE_MONTHLY_METRICS': True}):
+        with pytest.raises(Exception):
+            figures.tasks.populate_site_daily_metrics_for_run(site_run)
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.FAILED
+    assert site_run.site_metrics_status == PipelineSiteRun.FAILED
+
+
+def test_populate_site_daily_metrics_for_run_bitmaps(transactional_db, monkeypatch):
+    site = SiteFactory()
+    bitmap_calls = []
+    site_run = figures.pipeline.runs.start_site_run(site=site,
+                                                    date_for='2019-01-02',
+                                                    course_ids=[])
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda **kwargs: None)
+    monkeypatch.setattr('figures.tasks.load_active_user_bitmaps',
+                        lambda **kwargs: bitmap_calls.append(kwargs))
+    with mock.patch('figures.helpers.settings.FEATURES',
+                    {'FIGURES_ACTIVE_USER_BITMAPS': True}):
+        figures.tasks.populate_site_daily_metrics_for_run(site_run)
+    assert bitmap_calls == [dict(site=site,
+                                 date_for=as_date('2019-01-01'),
+                                 force_update=False),
+                            dict(site=site,
+                                 date_for=as_date('2019-01-02'),
+                                 force_update=False)]
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+
+
+@pytest.mark.parametrize('date_for, months_for', [
+    ('2019-01-02', ['2019-01-02']),
+    ('2019-02-01', ['2019-01-31', '2019-02-01']),
+])
+def test_populate_site_daily_metrics_for_run_course_monthly(transactional_db,
+                                                            monkeypatch,
+                                                            date_for,
+                                                            months_for):
+    site = SiteFactory()
+    load_calls = []
+    site_run = figures.pipeline.runs.start_site_run(site=site,
+                                                    date_for=date_for,
+                                                    course_ids=[])
+    monkeypatch.setattr('figures.tasks.populate_site_daily_metrics',
+                        lambda **kwargs: None)
+    monkeypatch.setattr('figures.tasks.load_course_monthly_metrics',
+                        lambda **kwargs: load_calls.append(kwargs))
+    with mock.patch('figures.helpers.settings.FEATURES',
+                    {'FIGURES_COURSE_MONTHLY_METRICS': True}):
+        figures.tasks.populate_site_daily_metrics_for_run(site_run)
+    assert load_calls == [dict(site=site, month_for=as_date(month_for))
+                          for month_for in months_for]
+    site_run.refresh_from_db()
+    assert site_run.status == PipelineSiteRun.SUCCEEDED
+
+
+def test_populate_site_daily_metrics_invalidates_responses(transactional_db, monkeypatch):
+    site = SiteFactory()
+    generation = site_generation(site)
+    monkeypatch.setattr('figures.tasks.SiteDailyMetricsLoader.load',
+                        lambda self, **kwargs: None)
+    figures.tasks.populate_site_daily_metrics(site_id=site.id, date_for='2019-01-02')
+    assert site_generation(site) != generation
+
+
+def test_populate_site_daily_metrics_for_run_invalidates_once(transactional_db, monkeypatch):
+    site = SiteFactory()
+    site_run = figures.pipeline.runs.start_site_run(site=site,
+                                                    date_for='2019-01-02',
+                                                    course_ids=[])
+    monkeypatch.setattr('figures.tasks.SiteDailyMetricsLoader.load',
+                        lambda self, **kwargs: None)
+    with mock.patch('figures.tasks.invalidate_site_responses') as mock_invalidate:
+        figures.tasks.populate_site_daily_metrics_for_run(site_run)
+    mock_invalidate.assert_called_once_with(site.id)
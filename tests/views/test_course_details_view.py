@@ -0,0 +1,101 @@
+"""Tests Figures course details viewset
+"""
+
+import datetime
+
+import pytest
+
+import django.contrib.sites.shortcuts
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from figures.serializers import CourseDetailsSerializer
+from figures.views import CourseDetailsViewSet
+
+from tests.factories import (
+    CourseAccessRoleFactory,
+    CourseDailyMetricsFactory,
+    CourseOverviewFactory,
+    OrganizationFactory,
+    OrganizationCourseFactory,
+    SiteFactory,
+    UserFactory,
+)
+from tests.helpers import organizations_support_sites
+from tests.views.base import BaseViewTest
+
+if organizations_support_sites():
+    from tests.factories import UserOrganizationMappingFactory
+
+
+@pytest.mark.django_db
+class TestCourseDetailsViewSet(BaseViewTest):
+    """Tests the course details list endpoint
+    """
+    base_request_path = 'api/courses/detail/'
+    view_class = CourseDetailsViewSet
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        super(TestCourseDetailsViewSet, self).setup(db)
+        self.caller = UserFactory(is_staff=True)
+        if organizations_support_sites():
+            settings.FEATURES['FIGURES_IS_MULTISITE'] = True
+            self.site = SiteFactory()
+            self.org = OrganizationFactory(sites=[self.site])
+            UserOrganizationMappingFactory(user=self.caller,
+                                           organization=self.org,
+                                           is_amc_admin=True)
+        else:
+            self.org = OrganizationFactory()
+
+    def make_courses(self, count):
+        today = datetime.datetime.utcnow().date()
+        course_overviews = [CourseOverviewFactory() for i in range(count)]
+        for i, course_overview in enumerate(course_overviews):
+            OrganizationCourseFactory(organization=self.org,
+                                      course_id=str(course_overview.id))
+            CourseAccessRoleFactory(course_id=course_overview.id, role='staff')
+            for days_back in (0, 40, 75):
+                CourseDailyMetricsFactory(site=self.site,
+                                          course_id=str(course_overview.id),
+                                          date_for=today - datetime.timedelta(days=days_back),
+                                          enrollment_count=i + days_back,
+                                          average_progress=0.1 * (i + 1),
+                                          average_days_to_complete=i + 3)
+        return course_overviews
+
+    def get_list(self, monkeypatch):
+        request = APIRequestFactory().get(self.base_request_path)
+        request.META['HTTP_HOST'] = self.site.domain
+        monkeypatch.setattr(django.contrib.sites.shortcuts,
+                            'get_current_site',
+                            lambda req: self.site)
+        force_authenticate(request, user=self.caller)
+        view = self.view_class.as_view({'get': 'list'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(request)
+            response.render()
+        assert response.status_code == status.HTTP_200_OK
+        return response, len(ctx.captured_queries)
+
+    def test_list_matches_serializer(self, monkeypatch):
+        course_overviews = self.make_courses(2)
+        response, _num_queries = self.get_list(monkeypatch)
+        expected = dict((str(course_overview.id),
+                         CourseDetailsSerializer(course_overview).data)
+                        for course_overview in course_overviews)
+        results = response.data['results']
+        assert len(results) == len(expected)
+        for rec in results:
+            assert rec == expected[rec['course_id']]
+
+    def test_list_queries_independent_of_page_size(self, monkeypatch):
+        self.make_courses(1)
+        _response, num_queries = self.get_list(monkeypatch)
+        self.make_courses(4)
+        response, more_num_queries = self.get_list(monkeypatch)
+        assert len(response.data['results']) == 5
+        assert more_num_queries == num_queries
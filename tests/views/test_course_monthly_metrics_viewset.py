@@ -1,6 +1,8 @@
 """Tests Figures course monthly metrics viewset
 """
 
+import datetime
+
 from faker import Faker
 import pytest
 
@@ -9,6 +11,7 @@ from django.utils.timezone import utc
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, force_authenticate
 
+from figures.models import CourseMonthlyMetrics
 from figures.views import CourseMonthlyMetricsViewSet
 
 from tests.factories import (
@@ -366,3 +369,68 @@ class TestCourseMonthlyMetricsViewSet(BaseViewTest):
         response = view(request, pk=str(course_overview.id))
         assert response.status_code == status.HTTP_200_OK
         assert response.data['avg_progress'] == expected_response
+
+    def test_list_reads_course_monthly_metrics(self, monkeypatch, settings, sog_data):
+        site = sog_data['site']
+        course_overview = sog_data['course_overview']
+        settings.FEATURES['FIGURES_COURSE_MONTHLY_METRICS'] = True
+        if organizations_support_sites():
+            caller = UserFactory(is_staff=True)
+            map_users_to_org_site(caller=caller, site=site, users=[])
+        else:
+            caller = UserFactory(is_staff=True)
+        today = datetime.datetime.utcnow().date()
+        CourseMonthlyMetrics.objects.create(site=site,
+                                            course_id=str(course_overview.id),
+                                            month_for=today.replace(day=1),
+                                            active_users=3,
+                                            course_enrollments=12,
+                                            num_learners_completed=2,
+                                            avg_days_to_complete=5,
+                                            avg_progress=0.25)
+
+        request = APIRequestFactory().get(self.base_request_path)
+        request.META['HTTP_HOST'] = site.domain
+        monkeypatch.setattr(django.contrib.sites.shortcuts,
+                            'get_current_site',
+                            lambda req: site)
+        force_authenticate(request, user=caller)
+        view = self.view_class.as_view({'get': 'list'})
+        response = view(request)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == [dict(
+            course_id=str(course_overview.id),
+            month_for='{}/{}'.format(today.month, today.year),
+            active_users=3,
+            course_enrollments=12,
+            num_learners_completed=2,
+            avg_days_to_complete=5,
+            avg_progress=0.25)]
+
+    def test_history_reads_course_monthly_metrics(self, monkeypatch, settings, sog_data):
+        site = sog_data['site']
+        course_overview = sog_data['course_overview']
+        settings.FEATURES['FIGURES_COURSE_MONTHLY_METRICS'] = True
+        if organizations_support_sites():
+            caller = UserFactory(is_staff=True)
+            map_users_to_org_site(caller=caller, site=site, users=[])
+        else:
+            caller = UserFactory(is_staff=True)
+
+        def mock_get_course_monthly_metrics_history(**kwargs):
+            return kwargs['field_name']
+
+        monkeypatch.setattr('figures.views.metrics.get_course_monthly_metrics_history',
+                            mock_get_course_monthly_metrics_history)
+
+        request_path = self.base_request_path + str(course_overview.id) + '/avg_progress/'
+        request = APIRequestFactory().get(request_path)
+        request.META['HTTP_HOST'] = site.domain
+        monkeypatch.setattr(django.contrib.sites.shortcuts,
+                            'get_current_site',
+                            lambda req: site)
+        force_authenticate(request, user=caller)
+        view = self.view_class.as_view({'get': 'avg_progress'})
+        response = view(request, pk=str(course_overview.id))
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['avg_progress'] == 'avg_progress'
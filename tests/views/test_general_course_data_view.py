@@ -4,7 +4,9 @@ import pytest
 
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 
 
 
@@ -21,9 +23,11 @@ from student.models import CourseEnrollment
 
 import figures.helpers
 from figures.helpers import as_course_key, is_multisite
+from figures.serializers import GeneralCourseDataSerializer
 from figures.views import GeneralCourseDataViewSet
 
 from tests.factories import (
+    CourseAccessRoleFactory,
     CourseDailyMetricsFactory,
     CourseEnrollmentFactory,
     CourseOverviewFactory,
@@ -153,6 +157,45 @@ class TestGeneralCourseDataViewSet(BaseViewTest):
             # We're starting to need more complex data set-up, so deferring to
             # implement a
 
+    def test_get_list_prefetched(self):
+        """Tests the list has the same staff and metrics as serializing each
+        course, with a number of queries independent of the number of courses
+        """
+        def get_list():
+            request = APIRequestFactory().get(self.request_path)
+            force_authenticate(request, user=self.staff_user)
+            view = self.view_class.as_view({'get': 'list'})
+            with CaptureQueriesContext(connection) as ctx:
+                response = view(request)
+                response.render()
+            assert response.status_code == 200
+            return response, len(ctx.captured_queries)
+
+        def add_course_data(course_overview):
+            CourseAccessRoleFactory(course_id=course_overview.id,
+                                    user=self.users[0],
+                                    role='staff')
+            for date_for in ('2019-01-01', '2019-01-02'):
+                CourseDailyMetricsFactory(site=self.site,
+                                          course_id=str(course_overview.id),
+                                          date_for=date_for)
+
+        add_course_data(self.course_overviews[0])
+        # The first request caches the current site
+        get_list()
+        response, num_queries = get_list()
+        results = dict((rec['course_id'], rec) for rec in response.data['results'])
+        for course_overview in self.course_overviews:
+            assert results[str(course_overview.id)] == GeneralCourseDataSerializer(
+                course_overview).data
+        assert results[str(self.course_overviews[0].id)]['metrics']['date_for'] == '2019-01-02'
+        assert results[str(self.course_overviews[1].id)]['metrics'] == []
+
+        for course_overview in self.course_overviews[1:]:
+            add_course_data(course_overview)
+        _response, more_num_queries = get_list()
+        assert more_num_queries == num_queries
+
     def test_get_retrieve(self):
         '''Tests retrieving a list of users with abbreviated details
 
@@ -29,10 +29,16 @@ Front end expects data to be returned in the following form:
 
 '''
 
+import csv
+import functools
+import json
+
 import pytest
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import (
     APIRequestFactory,
@@ -42,8 +48,12 @@ from rest_framework.test import (
 
 from student.models import CourseEnrollment
 
+from figures.exports import queryset_chunks
 from figures.helpers import is_multisite
+from figures.serializers import GeneralUserDataSerializer
 from figures.views import GeneralUserDataViewSet
+import figures.sites
+import figures.views
 
 from tests.factories import (
     CourseEnrollmentFactory,
@@ -194,6 +204,59 @@ class TestGeneralUserViewSet(BaseViewTest):
                 # Test that the course id exists in the data
                 assert get_course_rec(course_enrollment.course_id, rec['courses'])
 
+    def test_get_general_user_list_prefetched(self):
+        """Tests the list has the same data as serializing each user, with a
+        number of queries independent of the number of users
+        """
+        def get_list():
+            request = APIRequestFactory().get(self.request_path)
+            force_authenticate(request, user=self.staff_user)
+            view = self.view_class.as_view({'get': 'list'})
+            with CaptureQueriesContext(connection) as ctx:
+                response = view(request)
+            assert response.status_code == 200
+            return response, len(ctx.captured_queries)
+
+        # The first request caches the current site
+        get_list()
+        response, num_queries = get_list()
+        for rec in response.data['results']:
+            user = get_user_model().objects.get(id=rec['id'])
+            assert rec == GeneralUserDataSerializer(user).data
+
+        for i in range(3):
+            make_course_enrollments(UserFactory(), self.course_overviews[i:])
+        response, more_num_queries = get_list()
+        assert response.data['count'] == len(self.users) + len(self.callers) + 3
+        assert more_num_queries == num_queries
+
+    def get_export(self, query_string=''):
+        request = APIRequestFactory().get(self.request_path + '/export/' + query_string)
+        force_authenticate(request, user=self.staff_user)
+        view = self.view_class.as_view({'get': 'export'})
+        return view(request)
+
+    def test_export_csv(self, monkeypatch):
+        """Tests the CSV export has a row for every user with the same data as
+        the list, serialized in chunks
+        """
+        monkeypatch.setattr(figures.views, 'queryset_chunks',
+                            functools.partial(queryset_chunks, chunk_size=3))
+        response = self.get_export()
+        assert response.status_code == 200
+        assert response['Content-Disposition'] == 'attachment; filename="users-general.csv"'
+        rows = list(csv.DictReader(b''.join(response.streaming_content).splitlines()))
+        users = figures.sites.get_users_for_site(self.site).order_by('id')
+        assert [int(row['id']) for row in rows] == [user.id for user in users]
+        for row in rows:
+            expected = GeneralUserDataSerializer(users.get(id=row['id'])).data
+            assert row['username'] == expected['username']
+            assert json.loads(row['courses']) == json.loads(json.dumps(expected['courses']))
+
+    def test_export_invalid_format(self):
+        response = self.get_export('?export_format=xml')
+        assert response.status_code == 400
+
     @pytest.mark.parametrize('search_term', SEARCH_TERMS)
     def test_get_search(self, search_term):
         """
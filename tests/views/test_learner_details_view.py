@@ -33,7 +33,9 @@ import mock
 import pytest
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import (
     APIRequestFactory,
@@ -44,7 +46,7 @@ from rest_framework.test import (
 from student.models import CourseEnrollment
 
 from figures.helpers import as_course_key
-from figures.serializers import LearnerCourseDetailsSerializer
+from figures.serializers import LearnerCourseDetailsSerializer, LearnerDetailsSerializer
 from figures.sites import get_course_enrollments_for_site
 from figures.views import LearnerDetailsViewSet
 import figures.settings
@@ -52,6 +54,8 @@ import figures.settings
 from tests.factories import (
     CourseEnrollmentFactory,
     CourseOverviewFactory,
+    GeneratedCertificateFactory,
+    LearnerCourseGradeMetricsFactory,
     OrganizationFactory,
     OrganizationCourseFactory,
     SiteFactory,
@@ -222,6 +226,45 @@ class TestLearnerDetailsViewSetStandalone(BaseViewTest):
             for ce in user_course_enrollments:
                 assert get_course_rec(ce.course_id, rec['courses'])
 
+    def test_get_learner_details_list_prefetched(self):
+        """Tests the list has the same data as serializing each learner, with
+        a number of queries independent of the number of learners
+        """
+        def add_learner_data(enrollment):
+            GeneratedCertificateFactory(user=enrollment.user,
+                                        course_id=enrollment.course_id)
+            for date_for in ('2019-01-01', '2019-01-02'):
+                LearnerCourseGradeMetricsFactory(site=self.site,
+                                                 user=enrollment.user,
+                                                 course_id=str(enrollment.course_id),
+                                                 date_for=date_for,
+                                                 points_earned=10.0 * int(date_for[-1]))
+
+        def get_list():
+            request = APIRequestFactory().get(self.request_path)
+            force_authenticate(request, user=self.staff_user)
+            view = self.view_class.as_view({'get': 'list'})
+            with CaptureQueriesContext(connection) as ctx:
+                response = view(request)
+                response.render()
+            assert response.status_code == 200
+            return response, len(ctx.captured_queries)
+
+        for enrollment in self.enrollments:
+            add_learner_data(enrollment)
+        # The first request caches the current site
+        get_list()
+        response, num_queries = get_list()
+        for rec in response.data['results']:
+            user = get_user_model().objects.get(id=rec['id'])
+            assert rec == LearnerDetailsSerializer(user, context=dict(site=self.site)).data
+
+        for i in range(3):
+            add_learner_data(CourseEnrollmentFactory(course=self.course_overviews[3]))
+        response, more_num_queries = get_list()
+        assert len(response.data['results']) == len(self.users) + len(self.callers) + 3
+        assert more_num_queries == num_queries
+
 
 @pytest.mark.skipif(not organizations_support_sites(),
                     reason='Organizations support sites')
@@ -3,6 +3,7 @@
 '''
 
 import datetime
+import json
 from dateutil.parser import parse
 from dateutil.rrule import rrule, DAILY
 import pytest
@@ -110,6 +111,25 @@ class TestSiteDailyMetricsView(BaseViewTest):
         for field_name in check_fields:
             assert data[field_name] == getattr(db_rec,field_name)
 
+    def test_export_date_range(self):
+        """Tests the export streams every record in the date range as NDJSON
+        """
+        endpoint = '{}/export/?export_format=ndjson&date_0=2018-02-01&date_1=2018-02-28'.format(
+            self.request_path)
+        request = APIRequestFactory().get(endpoint)
+        force_authenticate(request, user=self.staff_user)
+        view = self.view_class.as_view({'get': 'export'})
+        response = view(request)
+        assert response.status_code == 200
+        assert response.streaming
+        records = [json.loads(line) for line in
+                   b''.join(response.streaming_content).splitlines()]
+        expected_data = SiteDailyMetrics.objects.filter(
+            date_for__range=('2018-02-01', '2018-02-28')).order_by('id')
+        assert [rec['id'] for rec in records] == [rec.id for rec in expected_data]
+        assert [rec['date_for'] for rec in records] == [
+            str(rec.date_for) for rec in expected_data]
+
     @pytest.mark.xfail
     def test_create(self):
         """
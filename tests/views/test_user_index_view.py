@@ -5,7 +5,9 @@
 import pytest
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import (
     APIRequestFactory,
@@ -14,6 +16,7 @@ from rest_framework.test import (
     )
 
 from figures.helpers import is_multisite
+import figures.sites
 from figures.views import UserIndexViewSet
 
 from tests.factories import (
@@ -117,3 +120,30 @@ class TestUserIndexViewSet(BaseViewTest):
             match_rec = (item for item in expected_data 
                 if item['username'] == rec['username']).next()
             assert rec == match_rec
+
+    def get_list(self, path):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=self.staff_user)
+        view = self.view_class.as_view({'get': 'list'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(request)
+        assert response.status_code == 200
+        return response, [query['sql'] for query in ctx.captured_queries]
+
+    def test_cursor_pagination(self):
+        expected_ids = sorted(figures.sites.get_users_for_site(self.site).values_list(
+            'id', flat=True))
+        path = self.request_path + '?cursor=&limit=3'
+        user_ids = []
+        while path:
+            response, queries = self.get_list(path)
+            assert set(response.data.keys()) == set(['next', 'previous', 'results'])
+            assert not [sql for sql in queries if 'COUNT(' in sql]
+            user_ids.extend(rec['id'] for rec in response.data['results'])
+            path = response.data['next']
+        assert user_ids == expected_ids
+
+    def test_cursor_pagination_count(self):
+        response, _queries = self.get_list(self.request_path + '?cursor=&count=true')
+        assert response.data['count'] == figures.sites.get_users_for_site(self.site).count()
+        assert response.data['next'] is None